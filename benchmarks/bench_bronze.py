@@ -0,0 +1,85 @@
+"""
+Compare bronze codecs: stored size, encode cost and read cost.
+
+Encodes a run of snapshots the way fetch (one per object) and the collector
+(BATCH_SNAPSHOTS per object) would, once per codec, and reports bytes per
+snapshot, encode and decode time per snapshot, and S3 PUTs for the run. The
+last column is the bytes a reader fetches to get one snapshot out of a batch:
+the whole object for .pbd, footer + index + one frame for .hslb.
+
+Run: python benchmarks/bench_bronze.py [snapshots] [n_trips]
+"""
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "layers" / "common" / "python"))
+
+from hsl_common.bronze import CODECS, Container, encode_bronze, read_snapshots  # noqa: E402
+from hsl_common.feed import encode_frames  # noqa: E402
+from synthetic_feed import FEED_TIMESTAMP, build_feed  # noqa: E402
+
+BATCH_SNAPSHOTS = 30
+POLL_INTERVAL = 10
+
+
+def one_snapshot_read(body):
+    """Bytes read to pull the middle snapshot out of a container."""
+    read = []
+
+    def read_range(start, end):
+        read.append(end - start)
+        return body[start:end]
+
+    container = Container(read_range, len(body))
+    container.snapshot(len(container) // 2)
+    return sum(read)
+
+
+def measure(snapshots, codec, batch):
+    """(bytes, encode seconds, decode seconds, PUTs, bytes for one snapshot) over all snapshots."""
+    stored, encode_time, decode_time, puts, single = 0, 0.0, 0.0, 0, []
+    for i in range(0, len(snapshots), batch):
+        chunk = snapshots[i:i + batch]
+        start = time.perf_counter()
+        extension, body = encode_bronze(chunk, codec)
+        encode_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        decoded = read_snapshots(extension, body)
+        decode_time += time.perf_counter() - start
+        assert decoded == chunk, f"{codec} round trip failed"
+
+        stored += len(body)
+        puts += 1
+        single.append(one_snapshot_read(body) if extension != ".pb" else len(body))
+    return stored, encode_time, decode_time, puts, sum(single) / len(single)
+
+
+if __name__ == "__main__":
+    n_snapshots = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    n_trips = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+    snapshots = [
+        build_feed(n_trips, 20, seed=i, feed_timestamp=FEED_TIMESTAMP + i * POLL_INTERVAL).SerializeToString()
+        for i in range(n_snapshots)
+    ]
+    raw = sum(len(s) for s in snapshots)
+    print(f"{n_snapshots} snapshots of {n_trips} trips, {raw / n_snapshots / 1024:.0f}KB each uncompressed")
+    print(f"\n  {'layout':<22} {'KB/snap':>8} {'ratio':>6} {'enc ms':>7} {'dec ms':>7} {'PUTs':>5} {'1-snap KB':>10}")
+
+    pbd = encode_frames(snapshots[:BATCH_SNAPSHOTS])
+    rows = [(".pbd batch (before)", None, BATCH_SNAPSHOTS)]
+    rows += [(f"per fetch, {codec}", codec, 1) for codec in CODECS]
+    rows += [(f"batch, {codec}", codec, BATCH_SNAPSHOTS) for codec in CODECS]
+    for label, codec, batch in rows:
+        if codec is None:
+            stored = sum(len(encode_frames(snapshots[i:i + batch])) for i in range(0, n_snapshots, batch))
+            puts = -(-n_snapshots // batch)
+            print(f"  {label:<22} {stored / n_snapshots / 1024:>8.1f} {raw / stored:>5.1f}x "
+                  f"{'':>7} {'':>7} {puts:>5} {len(pbd) / 1024:>10.0f}")
+            continue
+        stored, encode_time, decode_time, puts, single = measure(snapshots, codec, batch)
+        print(f"  {label:<22} {stored / n_snapshots / 1024:>8.1f} {raw / stored:>5.1f}x "
+              f"{encode_time / n_snapshots * 1000:>7.1f} {decode_time / n_snapshots * 1000:>7.1f} "
+              f"{puts:>5} {single / 1024:>10.0f}")
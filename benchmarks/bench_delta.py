@@ -0,0 +1,104 @@
+"""
+Compare snapshot silver with change-data-capture (delta) silver.
+
+Simulates a run of polls: each snapshot re-predicts a fraction of the trips
+(arrival shifts), drops the next stop of trips whose vehicle passed it, and
+starts a few new trips. The run is written both ways, one Parquet file per
+collector batch of BATCH_SNAPSHOTS: whole snapshots vs. their delta rows.
+as_of() is checked against every snapshot.
+
+Run: python benchmarks/bench_delta.py [snapshots] [changed_fraction] [n_trips]
+"""
+import random
+import sys
+import time
+from pathlib import Path
+
+import pyarrow as pa
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "layers" / "common" / "python"))
+
+from hsl_common.delta import apply, as_of  # noqa: E402
+from hsl_common.feed import feed_to_columns  # noqa: E402
+from hsl_common.silver import columns_to_table, write_parquet  # noqa: E402
+from synthetic_feed import FEED_TIMESTAMP, build_feed  # noqa: E402
+
+POLL_INTERVAL = 10
+BATCH_SNAPSHOTS = 30
+
+
+def evolve(feed, rng, changed_fraction, timestamp, next_trip):
+    """Next snapshot: some trips re-predicted, passed stops dropped, a new trip or two."""
+    feed.header.timestamp = timestamp
+    for entity in list(feed.entity):
+        stops = entity.trip_update.stop_time_update
+        if rng.random() < changed_fraction:
+            shift = rng.randrange(-30, 60)
+            for stu in stops:
+                stu.arrival.time += shift
+                stu.departure.time += shift
+        if len(stops) and stops[0].arrival.time <= timestamp:
+            del stops[0]
+    for entity in [e for e in feed.entity if not len(e.trip_update.stop_time_update)]:
+        feed.entity.remove(entity)
+
+    template = build_feed(2, 20, seed=next_trip, feed_timestamp=timestamp)
+    for entity in template.entity:
+        entity.id = f"{entity.id}_new{next_trip}"
+        feed.entity.add().CopyFrom(entity)
+    return feed
+
+
+def sorted_rows(table):
+    return sorted(table.to_pylist(), key=lambda r: (r["trip_id"], r["stop_id"], r["predicted_arrival"] or 0))
+
+
+def batched_size(tables):
+    """Parquet bytes when tables are written BATCH_SNAPSHOTS at a time."""
+    return sum(
+        len(write_parquet(pa.concat_tables(tables[i:i + BATCH_SNAPSHOTS])).getvalue())
+        for i in range(0, len(tables), BATCH_SNAPSHOTS)
+    )
+
+
+if __name__ == "__main__":
+    n_snapshots = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    changed_fraction = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    n_trips = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+
+    rng = random.Random(0)
+    feed = build_feed(n_trips, 20)
+    snapshots = []
+    for i in range(n_snapshots):
+        timestamp = FEED_TIMESTAMP + i * POLL_INTERVAL
+        if i:
+            feed = evolve(feed, rng, changed_fraction, timestamp, i)
+        snapshots.append(columns_to_table(feed_to_columns(feed)))
+
+    state, deltas, delta_time = None, [], 0.0
+    for snapshot in snapshots:
+        start = time.perf_counter()
+        state, delta = apply(state, snapshot)
+        delta_time += time.perf_counter() - start
+        deltas.append(delta)
+
+    snapshot_rows = sum(s.num_rows for s in snapshots)
+    delta_rows = sum(d.num_rows for d in deltas)
+    snapshot_bytes = batched_size(snapshots)
+    delta_bytes = batched_size(deltas)
+
+    start = time.perf_counter()
+    for snapshot in snapshots:
+        timestamp = snapshot["feed_timestamp"][0].as_py()
+        if sorted_rows(as_of(deltas, timestamp)) != sorted_rows(snapshot):
+            print(f"❌ as_of({timestamp}) does not match the snapshot")
+            sys.exit(1)
+    as_of_time = (time.perf_counter() - start) / len(snapshots)
+
+    print(f"{n_snapshots} snapshots every {POLL_INTERVAL}s, {changed_fraction:.0%} of trips re-predicted per poll")
+    print(f"\n  {'':<10} {'rows':>12} {'Parquet':>10}")
+    print(f"  {'snapshot':<10} {snapshot_rows:>12,} {snapshot_bytes / 1024 / 1024:>8.1f}MB")
+    print(f"  {'delta':<10} {delta_rows:>12,} {delta_bytes / 1024 / 1024:>8.1f}MB")
+    print(f"\n  {snapshot_rows / delta_rows:.1f}x fewer rows, {snapshot_bytes / delta_bytes:.1f}x fewer bytes")
+    print(f"  diff {delta_time / n_snapshots * 1000:.0f}ms/snapshot, as_of {as_of_time * 1000:.0f}ms; "
+          f"every snapshot rebuilt exactly")
@@ -0,0 +1,70 @@
+"""
+Compare the bronze → silver flatten paths on a large synthetic feed.
+
+  dict path:     ParseFromString → MessageToDict → json.dumps (bronze)
+                 → json.loads (flatten) → flatten_entities
+  columnar path: ParseFromString → feed_to_columns
+
+Both start from the raw protobuf bytes the fetch Lambda receives. Prints wall
+time and tracemalloc peak for each, and checks that both produce the same rows.
+
+Run: python benchmarks/bench_flatten.py [n_trips] [stops_per_trip]
+"""
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+from google.protobuf.json_format import MessageToDict
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "layers" / "common" / "python"))
+
+from hsl_common.feed import feed_to_columns, flatten_entities, parse_feed, rows_to_columns  # noqa: E402
+from synthetic_feed import build_feed_bytes  # noqa: E402
+
+
+def dict_path(binary_data):
+    feed = parse_feed(binary_data)
+    bronze = json.dumps(MessageToDict(feed, preserving_proto_field_name=True))
+    return rows_to_columns(flatten_entities(json.loads(bronze)))
+
+
+def columnar_path(binary_data):
+    return feed_to_columns(parse_feed(binary_data))
+
+
+def measure(fn, binary_data, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(binary_data)
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    result = fn(binary_data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, best, peak
+
+
+if __name__ == "__main__":
+    n_trips = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    stops_per_trip = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+
+    binary_data = build_feed_bytes(n_trips, stops_per_trip)
+    print(f"Feed: {n_trips:,} trips x {stops_per_trip} stops, {len(binary_data) / 1024 / 1024:.1f} MB protobuf")
+
+    dict_cols, dict_time, dict_peak = measure(dict_path, binary_data)
+    col_cols, col_time, col_peak = measure(columnar_path, binary_data)
+
+    if dict_cols != col_cols:
+        print("❌ Columnar path produced different rows than flatten_entities")
+        sys.exit(1)
+
+    rows = len(col_cols["trip_id"])
+    print(f"\n  {'path':<10} {'time':>9} {'rows/s':>12} {'peak mem':>10}")
+    for name, elapsed, peak in (("dict", dict_time, dict_peak), ("columnar", col_time, col_peak)):
+        print(f"  {name:<10} {elapsed * 1000:>7.0f}ms {rows / elapsed:>12,.0f} {peak / 1024 / 1024:>8.1f}MB")
+    print(f"\n  {rows:,} rows, identical output")
+    print(f"  Speedup: {dict_time / col_time:.1f}x, peak memory: {dict_peak / col_peak:.1f}x lower")
@@ -0,0 +1,127 @@
+"""
+Local stand-in for the HSL trip-updates endpoint, for exercising the collector.
+
+Serves recorded protobuf snapshots in order, moving to the next one every
+--period seconds, so polling faster than that sees repeats. Snapshots come
+from a directory of bronze objects (.pb, or .pbd/.hslb batches, expanded
+snapshot by snapshot) or, without --recorded, from synthetic_feed with
+advancing header timestamps.
+
+Like a CDN-fronted feed it sends ETag and Last-Modified and answers matching
+conditional requests with 304; --no-validators turns that off so only the
+collector's header-timestamp dedupe is left. HTTP/1.1 keep-alive is on, and
+each new TCP connection is logged, so connection reuse is visible.
+
+Run: python benchmarks/feed_stub.py [--recorded bronze_dir] [--period 15] [--port 8000]
+Then: python lambdas/fetch_realtime/collector.py --url http://localhost:8000/ --interval 2 --output-dir /tmp/bronze
+"""
+import argparse
+import hashlib
+import sys
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "layers" / "common" / "python"))
+
+from hsl_common.bronze import read_snapshots  # noqa: E402
+from synthetic_feed import FEED_TIMESTAMP, build_feed  # noqa: E402
+
+
+def load_recorded(directory):
+    """Snapshots from bronze objects under directory, in key order."""
+    snapshots = []
+    for path in sorted(Path(directory).rglob("*")):
+        if path.suffix in (".pb", ".pbd", ".hslb"):
+            snapshots.extend(read_snapshots(path.name, path.read_bytes()))
+    return snapshots
+
+
+def synthetic(count, n_trips, stops_per_trip, period):
+    return [
+        build_feed(n_trips, stops_per_trip, seed=i, feed_timestamp=FEED_TIMESTAMP + int(i * period)).SerializeToString()
+        for i in range(count)
+    ]
+
+
+class FeedStub:
+    """Which snapshot is current: advances every period seconds, wrapping around."""
+
+    def __init__(self, snapshots, period, validators=True, clock=time.time):
+        self.snapshots = snapshots
+        self.period = period
+        self.validators = validators
+        self.clock = clock
+        self.started = clock()
+        self.etags = [f'"{hashlib.md5(body).hexdigest()}"' for body in snapshots]
+
+    def current(self):
+        """(index, body, etag, last_modified) of the snapshot being served now."""
+        elapsed = int((self.clock() - self.started) // self.period)
+        index = elapsed % len(self.snapshots)
+        changed_at = self.started + elapsed * self.period
+        return index, self.snapshots[index], self.etags[index], formatdate(changed_at, usegmt=True)
+
+
+def make_handler(stub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+
+        def setup(self):
+            super().setup()
+            print(f"connection from {self.client_address[0]}:{self.client_address[1]}")
+
+        def do_GET(self):
+            index, body, etag, last_modified = stub.current()
+            if stub.validators and (self.headers.get("If-None-Match") == etag
+                                    or self.headers.get("If-Modified-Since") == last_modified):
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-protobuf")
+            self.send_header("Content-Length", str(len(body)))
+            if stub.validators:
+                self.send_header("ETag", etag)
+                self.send_header("Last-Modified", last_modified)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve recorded or synthetic GTFS-RT snapshots over HTTP.")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--period", type=float, default=15.0, help="seconds between feed updates")
+    parser.add_argument("--recorded", help="directory of bronze .pb/.pbd/.hslb objects to replay")
+    parser.add_argument("--snapshots", type=int, default=20, help="synthetic snapshots (without --recorded)")
+    parser.add_argument("--trips", type=int, default=1000)
+    parser.add_argument("--stops-per-trip", type=int, default=20)
+    parser.add_argument("--no-validators", action="store_true", help="send no ETag/Last-Modified, never 304")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.recorded:
+        snapshots = load_recorded(args.recorded)
+    else:
+        snapshots = synthetic(args.snapshots, args.trips, args.stops_per_trip, args.period)
+    if not snapshots:
+        sys.exit("No snapshots to serve")
+
+    stub = FeedStub(snapshots, args.period, validators=not args.no_validators)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(stub))
+    print(f"Serving {len(snapshots)} snapshots on http://127.0.0.1:{args.port}/ (new one every {args.period:g}s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
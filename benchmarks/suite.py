@@ -0,0 +1,280 @@
+"""
+Throughput and peak memory of each flatten stage, checked against a baseline.
+
+Stages, on synthetic feeds (synthetic_feed) of several sizes, with 3% of
+trips CANCELED and 5% of stops NO_DATA:
+
+  decode      parse_feed: protobuf bytes → FeedMessage
+  flatten     feed_to_columns: FeedMessage → silver columns
+  serialize   columns_to_table + write_parquet: columns → silver Parquet
+  delay_join  compute_gold: silver + ScheduleIndex → gold rows
+  index       ScheduleIndex.build over a day's schedule (covertToPaquet.py)
+
+Each stage is timed like timeit: calls are batched to at least 0.2 s and
+the fastest of --repeat batches is reported as rows/s (silver rows, or
+schedule rows for index). Right before each stage a fixed reference
+workload (a Python loop, a list sort and an Arrow sort) is timed the same
+way. The stage's rows/s divided by the reference's is its "relative"
+throughput. A faster or slower machine, or one busy with other work, moves
+both, so the ratio is what is checked. Peak memory is the tracemalloc peak (Python and
+NumPy) plus the Arrow memory pool's peak, both for a single run. The
+protobuf runtime allocates messages in its own arena, which neither sees, so
+decode reports close to nothing.
+
+  python benchmarks/suite.py --save-baseline    # record benchmarks/baseline.json
+  python benchmarks/suite.py                    # compare with it
+  python benchmarks/suite.py --sizes large --json results.json
+
+The baseline is local (not committed): record it on the machine that runs
+the check. The run exits 1 when a stage's relative throughput is more than
+--slower (default 20%) below the baseline's, or it uses more than --memory
+(default 10%) more memory. Without a baseline, or with one recorded under a
+different environment (Python, pyarrow, protobuf, CPU), the results are
+printed and nothing is checked.
+"""
+import argparse
+import json
+import platform
+import re
+import statistics
+import sys
+import timeit
+import tracemalloc
+from pathlib import Path
+
+import google.protobuf
+import pyarrow as pa
+import pyarrow.compute as pc
+from google.transit import gtfs_realtime_pb2
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "layers" / "common" / "python"))
+
+from hsl_common.feed import feed_to_columns, parse_feed  # noqa: E402
+from hsl_common.gold import compute_gold  # noqa: E402
+from hsl_common.schedule_index import ScheduleIndex  # noqa: E402
+from hsl_common.silver import columns_to_table, write_parquet  # noqa: E402
+from synthetic_feed import build_feed, build_schedule  # noqa: E402
+
+BASELINE = Path(__file__).resolve().parent / "baseline.json"
+
+# name: (trips, stops per trip)
+SIZES = {
+    "small": (200, 10),
+    "medium": (1000, 20),
+    "large": (3000, 30),
+}
+CANCELED_FRACTION = 0.03
+NO_DATA_FRACTION = 0.05
+
+_CANCELED = gtfs_realtime_pb2.TripDescriptor.CANCELED
+_NO_DATA = gtfs_realtime_pb2.TripUpdate.StopTimeUpdate.NO_DATA
+
+REPEAT = 5
+SLOWER = 0.20
+MEMORY = 0.10
+# A stage that looks slower is measured again before it counts, and a new
+# baseline takes the median of this many more runs; timings on a busy
+# machine drift more than SLOWER from one run to the next
+RETRIES = 4
+# Peaks this small swing by more than MEMORY between runs
+MEMORY_SLACK_MB = 0.5
+
+# The reference workload: the same values every run
+REFERENCE_ROWS = 100_000
+_REFERENCE_VALUES = [(i * 7919) % 100_003 for i in range(REFERENCE_ROWS)]
+_REFERENCE_ARRAY = pa.array(_REFERENCE_VALUES)
+
+
+def measure(fn, *args, repeat=REPEAT):
+    """(best seconds, peak MB) of fn(*args)."""
+    timer = timeit.Timer(lambda: fn(*args))
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat, number)) / number
+
+    # A fresh pool so its peak belongs to this run alone
+    pool = pa.proxy_memory_pool(pa.default_memory_pool())
+    previous = pa.default_memory_pool()
+    pa.set_memory_pool(pool)
+    tracemalloc.start()
+    try:
+        fn(*args)
+        _, python_peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        pa.set_memory_pool(previous)
+    return best, (python_peak + pool.max_memory()) / 1024 / 1024
+
+
+def reference():
+    """A fixed mix of interpreter and native work, like the stages' own."""
+    total = 0
+    for value in _REFERENCE_VALUES:
+        total += value & 0xFF
+    sorted(_REFERENCE_VALUES, reverse=True)
+    pc.sort_indices(_REFERENCE_ARRAY)
+    return total
+
+
+def serialize(columns):
+    return write_parquet(columns_to_table(columns))
+
+
+def prepare(n_trips, stops_per_trip):
+    """(silver rows, protobuf bytes, {stage: (fn, args, rows)}) for one feed size."""
+    feed = build_feed(n_trips, stops_per_trip, canceled_fraction=CANCELED_FRACTION,
+                      no_data_fraction=NO_DATA_FRACTION)
+    binary_data = feed.SerializeToString()
+    columns = feed_to_columns(feed)
+    silver = columns_to_table(columns)
+    schedule = build_schedule(feed)
+    index = ScheduleIndex.build(**schedule)
+
+    # The filters must have dropped exactly the canceled trips and NO_DATA stops
+    expected = sum(
+        1
+        for entity in feed.entity if entity.trip_update.trip.schedule_relationship != _CANCELED
+        for stu in entity.trip_update.stop_time_update if stu.schedule_relationship != _NO_DATA
+    )
+    if silver.num_rows != expected:
+        raise AssertionError(f"flatten kept {silver.num_rows} rows, expected {expected}")
+
+    rows = silver.num_rows
+    stages = {
+        "decode": (parse_feed, (binary_data,), rows),
+        "flatten": (feed_to_columns, (feed,), rows),
+        "serialize": (serialize, (columns,), rows),
+        "delay_join": (compute_gold, (silver, index), rows),
+        "index": (lambda: ScheduleIndex.build(**schedule), (), len(schedule["stop_ids"])),
+    }
+    return rows, len(binary_data), stages
+
+
+def run_stage(fn, args, rows, repeat=REPEAT):
+    """rows/s and peak MB of a stage, and its rows/s relative to the reference's."""
+    # Timed on both sides of the stage, the faster kept, like the stage's own batches
+    before, _ = measure(reference, repeat=repeat)
+    seconds, peak_mb = measure(fn, *args, repeat=repeat)
+    after, _ = measure(reference, repeat=repeat)
+    reference_seconds = min(before, after)
+    return {
+        "rows_per_second": round(rows / seconds),
+        "relative": round(rows / seconds * reference_seconds / REFERENCE_ROWS, 4),
+        "peak_mb": round(peak_mb, 2),
+    }
+
+
+def too_slow(now, before, slower=SLOWER):
+    return before is not None and now["relative"] < before["relative"] * (1 - slower)
+
+
+def _cpu():
+    try:
+        match = re.search(r"^model name\s*:\s*(.+)$", Path("/proc/cpuinfo").read_text(), re.MULTILINE)
+    except OSError:
+        match = None
+    return match.group(1).strip() if match else platform.processor()
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "pyarrow": pa.__version__,
+        "protobuf": google.protobuf.__version__,
+        "machine": f"{platform.system()} {platform.machine()}",
+        "cpu": _cpu(),
+    }
+
+
+def regressions(results, baseline, slower=SLOWER, memory=MEMORY):
+    """["size/stage: what got worse"] for results against baseline results."""
+    found = []
+    for name, stages in results.items():
+        for stage, now in stages.items():
+            before = baseline.get(name, {}).get(stage)
+            if before is None:
+                continue
+            if too_slow(now, before, slower):
+                found.append(f"{name}/{stage}: {now['relative']:.3f}x the reference, "
+                             f"baseline {before['relative']:.3f}x")
+            if now["peak_mb"] > before["peak_mb"] * (1 + memory) + MEMORY_SLACK_MB:
+                found.append(f"{name}/{stage}: {now['peak_mb']:.1f} MB peak, baseline {before['peak_mb']:.1f}")
+    return found
+
+
+def change(now, before):
+    return f"{(now / before - 1) * 100:+.0f}%" if before else ""
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the flatten stages against a baseline.")
+    parser.add_argument("--sizes", nargs="+", choices=SIZES, default=list(SIZES))
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="timed runs per stage (best is kept)")
+    parser.add_argument("--baseline", type=Path, default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--slower", type=float, default=SLOWER, help="allowed throughput drop (fraction)")
+    parser.add_argument("--memory", type=float, default=MEMORY, help="allowed peak memory growth (fraction)")
+    parser.add_argument("--retries", type=int, default=RETRIES,
+                        help="re-measure a stage this often before calling it slower "
+                             "(with --save-baseline: extra runs to take the median of)")
+    parser.add_argument("--json", type=Path, help="also write the results here")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {"results": {}}
+    comparable = baseline.get("environment") in (None, environment())
+    if not comparable:
+        print(f"Baseline was recorded on {baseline['environment']}; not checking against it\n")
+
+    results = {}
+    for name in args.sizes:
+        n_trips, stops_per_trip = SIZES[name]
+        rows, size, stages = prepare(n_trips, stops_per_trip)
+        results[name] = {}
+        for stage, (fn, fn_args, count) in stages.items():
+            now = run_stage(fn, fn_args, count, args.repeat)
+            if args.save_baseline:
+                # The typical run, not a lucky one, is what later runs are held to
+                runs = [now] + [run_stage(fn, fn_args, count, args.repeat) for _ in range(args.retries)]
+                now = sorted(runs, key=lambda run: run["relative"])[len(runs) // 2]
+                now["peak_mb"] = statistics.median(run["peak_mb"] for run in runs)
+                results[name][stage] = now
+                continue
+            before = baseline["results"].get(name, {}).get(stage)
+            for _ in range(args.retries if comparable else 0):
+                if not too_slow(now, before, args.slower):
+                    break
+                again = run_stage(fn, fn_args, count, args.repeat)
+                if again["relative"] > now["relative"]:
+                    now.update(rows_per_second=again["rows_per_second"], relative=again["relative"])
+            results[name][stage] = now
+        print(f"{name}: {n_trips:,} trips x {stops_per_trip} stops, {rows:,} rows, {size / 1024 / 1024:.1f} MB protobuf")
+        print(f"  {'stage':<11} {'rows/s':>12} {'relative':>9} {'':>6} {'peak MB':>9} {'':>6}")
+        for stage, now in results[name].items():
+            before = baseline["results"].get(name, {}).get(stage, {}) if comparable else {}
+            print(f"  {stage:<11} {now['rows_per_second']:>12,} {now['relative']:>9.3f} "
+                  f"{change(now['relative'], before.get('relative')):>6} "
+                  f"{now['peak_mb']:>9.1f} {change(now['peak_mb'], before.get('peak_mb')):>6}")
+        print()
+
+    output = {"environment": environment(), "results": results}
+    if args.json:
+        args.json.write_text(json.dumps(output, indent=2) + "\n")
+    if args.save_baseline:
+        kept = baseline["results"] if comparable else {}
+        merged = {"environment": environment(), "results": {**kept, **results}}
+        args.baseline.write_text(json.dumps(merged, indent=2) + "\n")
+        print(f"Baseline written to {args.baseline}")
+        sys.exit(0)
+
+    if not comparable or not baseline["results"]:
+        print("No baseline for this environment; record one with --save-baseline")
+        sys.exit(0)
+    found = regressions(results, baseline["results"], args.slower, args.memory)
+    if found:
+        print("❌ Regressed past the baseline:")
+        for line in found:
+            print(f"  {line}")
+        sys.exit(1)
+    print("✅ Within the baseline")
@@ -0,0 +1,117 @@
+"""
+Synthetic GTFS-RT trip update feeds for benchmarking.
+
+Builds FeedMessages shaped like the HSL trip-updates feed: one entity per
+trip, trip_id/route_id/start_time in HSL style, and a run of consecutive
+stop predictions per trip. Optionally a share of the trips is CANCELED and a
+share of the stops NO_DATA, the two cases flatten drops.
+
+build_schedule makes the matching ScheduleIndex input, so the feed can be
+joined for delays without a real GTFS download.
+"""
+import random
+
+from google.transit import gtfs_realtime_pb2
+
+_CANCELED = gtfs_realtime_pb2.TripDescriptor.CANCELED
+_NO_DATA = gtfs_realtime_pb2.TripUpdate.StopTimeUpdate.NO_DATA
+
+FEED_TIMESTAMP = 1770825600  # 2026-02-11 16:00 UTC
+
+
+def build_feed(n_trips=1000, stops_per_trip=20, seed=0, feed_timestamp=FEED_TIMESTAMP,
+               canceled_fraction=0.0, no_data_fraction=0.0):
+    """
+    Return a FeedMessage with n_trips trip updates of stops_per_trip stops each.
+
+    canceled_fraction of the trips are CANCELED (their stops still listed) and
+    no_data_fraction of the remaining stops are NO_DATA without times. The
+    statuses come from their own generator, so the trips themselves are the
+    same for a seed whatever the fractions.
+    """
+    rng = random.Random(seed)
+    status = random.Random(seed + 1)
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = "2.0"
+    feed.header.timestamp = feed_timestamp
+
+    for i in range(n_trips):
+        route_id = str(1000 + rng.randrange(600))
+        direction_id = rng.randrange(2)
+        start_minutes = 300 + rng.randrange(1200)
+        start_time = f"{start_minutes // 60:02d}:{start_minutes % 60:02d}:00"
+
+        entity = feed.entity.add()
+        entity.id = f"{route_id}_20260211_Ke_{direction_id + 1}_{start_minutes // 60:02d}{start_minutes % 60:02d}_{i}"
+        trip = entity.trip_update.trip
+        trip.route_id = route_id
+        trip.direction_id = direction_id
+        trip.start_time = start_time
+        trip.start_date = "20260211"
+        if canceled_fraction and status.random() < canceled_fraction:
+            trip.schedule_relationship = _CANCELED
+
+        first_stop = 1000000 + rng.randrange(900000)
+        arrival = feed_timestamp + rng.randrange(3600)
+        for seq in range(stops_per_trip):
+            arrival += 60 + rng.randrange(120)
+            stu = entity.trip_update.stop_time_update.add()
+            stu.stop_sequence = seq + 1
+            stu.stop_id = str(first_stop + seq)
+            if no_data_fraction and status.random() < no_data_fraction:
+                stu.schedule_relationship = _NO_DATA
+                continue
+            stu.arrival.time = arrival
+            stu.arrival.uncertainty = rng.choice((0, 30, 60))
+            stu.departure.time = arrival + 30
+            stu.departure.uncertainty = stu.arrival.uncertainty
+
+    return feed
+
+
+def build_feed_bytes(n_trips=1000, stops_per_trip=20, seed=0, canceled_fraction=0.0, no_data_fraction=0.0):
+    return build_feed(n_trips, stops_per_trip, seed,
+                      canceled_fraction=canceled_fraction, no_data_fraction=no_data_fraction).SerializeToString()
+
+
+def build_schedule(feed, seed=0, unscheduled_fraction=0.05, extra_trips=4):
+    """
+    ScheduleIndex.build arguments for the trips of feed.
+
+    Each predicted stop is scheduled 1-10 minutes before its prediction
+    (a few early), unscheduled_fraction of the trips are left out so the join
+    also misses, and extra_trips times as many trips that are not in the feed
+    pad the index to a day's size.
+    """
+    rng = random.Random(seed)
+    day_start = FEED_TIMESTAMP - FEED_TIMESTAMP % 86400 - 2 * 3600  # 20260211 00:00 Helsinki
+    columns = {name: [] for name in ("route_ids", "direction_ids", "start_seconds", "stop_ids",
+                                      "arrival_seconds", "stop_sequence")}
+
+    def add(route_id, direction_id, start_seconds, stops):
+        for sequence, (stop_id, arrival) in enumerate(stops, 1):
+            columns["route_ids"].append(route_id)
+            columns["direction_ids"].append(direction_id)
+            columns["start_seconds"].append(start_seconds)
+            columns["stop_ids"].append(stop_id)
+            columns["arrival_seconds"].append(arrival)
+            columns["stop_sequence"].append(sequence)
+
+    for entity in feed.entity:
+        if rng.random() < unscheduled_fraction:
+            continue
+        trip = entity.trip_update.trip
+        hours, minutes, seconds = map(int, trip.start_time.split(":"))
+        stops = [
+            (stu.stop_id, (stu.arrival.time or feed.header.timestamp) - day_start - rng.randrange(-60, 600))
+            for stu in entity.trip_update.stop_time_update
+        ]
+        add(trip.route_id, trip.direction_id, hours * 3600 + minutes * 60 + seconds, stops)
+
+    for _ in range(extra_trips * len(feed.entity)):
+        start_seconds = 300 * 60 + rng.randrange(1200) * 60
+        first_stop = 1000000 + rng.randrange(900000)
+        stops = [(str(first_stop + i), start_seconds + 120 * i) for i in range(20)]
+        add(str(1000 + rng.randrange(600)), rng.randrange(2), start_seconds, stops)
+
+    return columns
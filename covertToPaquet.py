@@ -5,182 +5,577 @@ Converts trips.txt, stop_times.txt, stops.txt, and routes.txt to Parquet format
 for use in Athena. Adds a derived start_time column to trips for joining with
 realtime data.
 
+Also builds schedule_index.bin, a memory-mappable lookup of
+(route_id, direction_id, start_time, stop_id) → scheduled arrival seconds +
+stop_sequence that flatten_data uses instead of joining stop_times in Athena.
+
+Refreshes are incremental. Every input is hashed (sha256) and the hashes are
+kept in OUTPUT_DIR/manifest.json; unchanged files are not converted again.
+trips and stop_times are written per feed version
+(trips/feed_version=<v>/trips.parquet), so delays from an older period keep
+joining against the schedule that was valid then. feed_versions.parquet
+lists each version's valid_from/valid_to service dates.
+
 Usage:
   1. Place your GTFS txt files in a folder
-  2. Update INPUT_DIR and OUTPUT_DIR below
-  3. Run: python convert_gtfs_to_parquet.py
+  2. Run: python covertToPaquet.py [--input-dir ./statics] [--output-dir ./output]
+     (--force reconverts everything, --feed-version overrides the version id)
 
-The output Parquet files go to your S3 reference bucket.
+The output directory mirrors the S3 reference bucket layout.
 """
 
-import pandas as pd
+import argparse
+import csv
+import hashlib
+import json
 import os
+import resource
+import shutil
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "layers", "common", "python"))
+from hsl_common.schedule_index import ScheduleIndex, hms_to_seconds  # noqa: E402
+
+INPUT_DIR = "./statics"      # default folder with your .txt files
+OUTPUT_DIR = "./output"    # default folder for .parquet output
+
+MANIFEST = "manifest.json"
+HASH_CHUNK = 1024 * 1024
+
+# Converted per feed version; the others are overwritten in place
+VERSIONED = ["trips", "stop_times"]
+UNVERSIONED = ["routes", "stops"]
+
+# Open end of the latest feed version's validity
+OPEN_END = "99991231"
+
+# CSV is parsed in small blocks (Arrow reads a few dozen blocks ahead, so
+# this is what bounds memory) and written in row groups of ROW_GROUP_ROWS,
+# so memory stays flat however big stop_times.txt gets
+BLOCK_SIZE = 1024 * 1024
+ROW_GROUP_ROWS = 512 * 1024
+
+# Explicit types (matching the ref_* tables in athena.tf). Nothing is left to
+# inference: a column that is empty in the first block would otherwise be
+# typed null and break on the first value further down the file.
+STRING = pa.string()
+CATEGORY = pa.dictionary(pa.int32(), pa.string())
+
+TRIPS_TYPES = {
+    "route_id": STRING,
+    "service_id": STRING,
+    "trip_id": STRING,
+    "trip_headsign": STRING,
+    "direction_id": pa.int64(),
+    "shape_id": STRING,
+    "wheelchair_accessible": pa.int64(),
+    "bikes_allowed": pa.int64(),
+    "max_delay": pa.int64(),
+}
+
+STOP_TIMES_TYPES = {
+    "trip_id": CATEGORY,         # ~100 rows per trip
+    "arrival_time": STRING,
+    "departure_time": STRING,
+    "stop_id": pa.int64(),
+    "stop_sequence": pa.int32(),
+    "stop_headsign": STRING,
+    "pickup_type": pa.int64(),
+    "drop_off_type": pa.int64(),
+    "shape_dist_traveled": pa.float64(),
+    "timepoint": pa.int64(),
+}
+
+ROUTES_TYPES = {
+    "route_id": STRING,
+    "agency_id": STRING,
+    "route_short_name": STRING,
+    "route_long_name": STRING,
+    "route_desc": STRING,
+    "route_type": pa.int64(),
+    "route_url": STRING,
+}
+
+STOPS_TYPES = {
+    "stop_id": pa.int64(),
+    "stop_code": STRING,
+    "stop_name": STRING,
+    "stop_desc": STRING,
+    "stop_lat": pa.float64(),
+    "stop_lon": pa.float64(),
+    "zone_id": STRING,
+    "stop_url": STRING,
+    "location_type": pa.int64(),
+    "parent_station": STRING,
+    "wheelchair_boarding": pa.int64(),
+    "platform_code": STRING,
+    "vehicle_type": pa.int64(),
+    "radius": pa.int64(),
+}
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def stream_csv(input_path, output_path, column_types, transform=None):
+    """
+    Stream a CSV into Parquet, ROW_GROUP_ROWS rows at a time.
+
+    Only the reader's readahead and one pending row group are in memory.
+    Returns (row count, first batch) — the first batch is kept for the sample
+    printout.
+    """
+    reader = pacsv.open_csv(
+        input_path,
+        read_options=pacsv.ReadOptions(block_size=BLOCK_SIZE),
+        convert_options=pacsv.ConvertOptions(column_types=column_types, strings_can_be_null=True),
+    )
+    transform = transform or (lambda batch: batch)
+    writer = None
+    pending = []
+    pending_rows = 0
+    rows = 0
+    first = None
+
+    def flush():
+        writer.write_table(pa.Table.from_batches(pending), row_group_size=ROW_GROUP_ROWS)
+        pending.clear()
+
+    try:
+        for batch in reader:
+            batch = transform(batch)
+            if writer is None:
+                writer = pq.ParquetWriter(output_path, batch.schema, compression="snappy")
+                first = batch
+            pending.append(batch)
+            pending_rows += batch.num_rows
+            rows += batch.num_rows
+            if pending_rows >= ROW_GROUP_ROWS:
+                flush()
+                pending_rows = 0
+        if pending:
+            flush()
+        if writer is None:
+            # Header-only file: still write an (empty) table with the right schema
+            empty = pa.RecordBatch.from_arrays(
+                [pa.array([], type=field.type) for field in reader.schema], schema=reader.schema
+            )
+            first = transform(empty)
+            pq.write_table(pa.Table.from_batches([first]), output_path, compression="snappy")
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows, first
+
+
+def convert_file(name, input_dir, output_path, column_types, transform=None, sample_rows=3):
+    """Convert input_dir/<name>.txt → output_path and describe the result."""
+    input_path = os.path.join(input_dir, f"{name}.txt")
+
+    start = time.perf_counter()
+    rows, first = stream_csv(input_path, output_path, column_types, transform)
+    elapsed = time.perf_counter() - start
+
+    csv_size = os.path.getsize(input_path) / 1024 / 1024
+    parquet_size = os.path.getsize(output_path) / 1024 / 1024
+    lines = [
+        f"  Rows: {rows:,}",
+        f"  Columns: {first.schema.names}",
+        "",
+        "  Sample rows:",
+        first.slice(0, sample_rows).to_pandas().to_string(index=False),
+        "",
+        f"  CSV size:     {csv_size:.1f} MB",
+        f"  Parquet size: {parquet_size:.1f} MB ({pq.ParquetFile(output_path).num_row_groups} row groups)",
+        f"  Throughput:   {rows / max(elapsed, 1e-9):,.0f} rows/s ({elapsed:.1f}s)",
+        f"  Peak RSS:     {peak_rss_mb():.0f} MB",
+        f"  Saved → {output_path}",
+    ]
+    return {"name": name, "rows": rows, "seconds": elapsed, "lines": lines, "first": first}
+
+
+def add_start_time(batch):
+    """
+    Derive start_time from the trip_id's last segment (HHMM)
 
-INPUT_DIR = "./statics"      # folder with your .txt files
-OUTPUT_DIR = "./output"    # folder for .parquet output
+    Example: trip_id "1001_20260210_Ke_1_0540" → start_time "05:40:00"
+    trip_ids without a trailing _HHMM get null.
+    """
+    trip_id = batch.column("trip_id")
+    has_time = pc.match_substring_regex(trip_id, r"_\d{4}$")
+    start_time = pc.replace_substring_regex(trip_id, pattern=r"^.*_(\d\d)(\d\d)$", replacement=r"\1:\2:00")
+    start_time = pc.if_else(has_time, start_time, pa.scalar(None, type=pa.string()))
+    return batch.append_column("start_time", start_time)
 
 
-def convert_trips(input_dir, output_dir):
+def convert_trips(input_dir, output_path):
     """
     Convert trips.txt → trips.parquet
 
-    Key transformation: extract start_time from trip_id
-    Example: trip_id "1001_20260210_Ke_1_0540" → start_time "05:40:00"
+    Key transformation: extract start_time from trip_id (see add_start_time)
     """
-    print("\n--- trips.txt ---")
-    df = pd.read_csv(os.path.join(input_dir, "trips.txt"))
-    print(f"  Rows: {len(df):,}")
-    print(f"  Columns: {list(df.columns)}")
-
-    # Extract start time from trip_id
-    # Pattern: routeid_date_daycode_direction_HHMM
-    # We want the last segment
-    def extract_start_time(trip_id):
-        try:
-            parts = trip_id.split("_")
-            time_part = parts[-1]  # e.g., "0540"
-            hours = time_part[:2]
-            minutes = time_part[2:]
-            return f"{hours}:{minutes}:00"
-        except (IndexError, ValueError):
-            return None
-
-    df["start_time"] = df["trip_id"].apply(extract_start_time)
+    result = convert_file("trips", input_dir, output_path, TRIPS_TYPES, transform=add_start_time)
 
     # Show a few examples to verify
-    print(f"\n  Start time extraction examples:")
-    for _, row in df.head(3).iterrows():
-        print(f"    {row['trip_id']} → {row['start_time']}")
+    first = result.pop("first")
+    examples = first.select(["trip_id", "start_time"]).slice(0, 3).to_pylist()
+    result["lines"] += ["", "  Start time extraction examples:"]
+    result["lines"] += [f"    {row['trip_id']} → {row['start_time']}" for row in examples]
 
     # Check for any failed extractions
-    null_count = df["start_time"].isna().sum()
+    null_count = pq.read_table(output_path, columns=["start_time"])["start_time"].null_count
     if null_count > 0:
-        print(f"  ⚠️  {null_count} rows failed start_time extraction")
+        result["lines"].append(f"  ⚠️  {null_count} rows failed start_time extraction")
+    return result
 
-    output_path = os.path.join(output_dir, "trips.parquet")
-    df.to_parquet(output_path, index=False)
-    print(f"  Saved → {output_path} ({os.path.getsize(output_path) / 1024 / 1024:.1f} MB)")
-    return df
 
-
-def convert_stop_times(input_dir, output_dir):
+def convert_stop_times(input_dir, output_path):
     """
     Convert stop_times.txt → stop_times.parquet
 
-    This is the big one (753MB CSV). Parquet compression will shrink it
-    dramatically because columnar storage handles repeated values well.
+    This is the big one (753MB CSV). It is streamed block by block, so memory
+    stays at a few blocks regardless of file size; trip_id is read as a
+    dictionary (each trip repeats once per stop) and stop_sequence as int32.
     """
-    print("\n--- stop_times.txt ---")
-    df = pd.read_csv(os.path.join(input_dir, "stop_times.txt"))
-    print(f"  Rows: {len(df):,}")
-    print(f"  Columns: {list(df.columns)}")
+    result = convert_file("stop_times", input_dir, output_path, STOP_TIMES_TYPES)
+    result.pop("first")
+    return result
 
-    # Show sample
-    print(f"\n  Sample rows:")
-    print(df.head(3).to_string(index=False))
 
-    output_path = os.path.join(output_dir, "stop_times.parquet")
-    df.to_parquet(output_path, index=False)
+def convert_routes(input_dir, output_path):
+    """
+    Convert routes.txt → routes.parquet
 
-    original_size = os.path.getsize(os.path.join(input_dir, "stop_times.txt")) / 1024 / 1024
-    parquet_size = os.path.getsize(output_path) / 1024 / 1024
-    print(f"\n  CSV size:     {original_size:.1f} MB")
-    print(f"  Parquet size: {parquet_size:.1f} MB")
-    print(f"  Compression:  {(1 - parquet_size/original_size) * 100:.0f}% smaller")
-    print(f"  Saved → {output_path}")
-    return df
+    Gives us: route_id → route_short_name (e.g., "3") + route_type (tram/bus/metro)
+    """
+    result = convert_file("routes", input_dir, output_path, ROUTES_TYPES, sample_rows=5)
+    result.pop("first")
+    return result
 
 
-def convert_routes(input_dir, output_dir):
+def convert_stops(input_dir, output_path):
     """
-    Convert routes.txt → routes.parquet
+    Convert stops.txt → stops.parquet
 
-    Gives us: route_id → route_short_name (e.g., "3") + route_type (tram/bus/metro)
+    Gives us: stop_id → stop_name + lat/lon coordinates
     """
-    print("\n--- routes.txt ---")
-    df = pd.read_csv(os.path.join(input_dir, "routes.txt"))
-    print(f"  Rows: {len(df):,}")
-    print(f"  Columns: {list(df.columns)}")
+    result = convert_file("stops", input_dir, output_path, STOPS_TYPES, sample_rows=5)
+    result.pop("first")
+    return result
 
-    # Show sample
-    print(f"\n  Sample rows:")
-    print(df.head(5).to_string(index=False))
 
-    output_path = os.path.join(output_dir, "routes.parquet")
-    df.to_parquet(output_path, index=False)
-    print(f"  Saved → {output_path} ({os.path.getsize(output_path) / 1024:.1f} KB)")
-    return df
+# stop_times first: it's by far the longest, so it should start straight away
+CONVERTERS = {
+    "stop_times": convert_stop_times,
+    "trips": convert_trips,
+    "routes": convert_routes,
+    "stops": convert_stops,
+}
 
 
-def convert_stops(input_dir, output_dir):
+def output_path(name, feed_version=None):
+    """Path of a converted file relative to the output dir (= its S3 key)."""
+    if feed_version is None:
+        return os.path.join(name, f"{name}.parquet")
+    return os.path.join(name, f"feed_version={feed_version}", f"{name}.parquet")
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST)
+    if not os.path.exists(path):
+        return {"files": {}, "versions": []}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(output_dir, manifest):
+    # Write-then-rename so an interrupted run never leaves a torn manifest
+    path = os.path.join(output_dir, MANIFEST)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def first_service_date(input_dir):
     """
-    Convert stops.txt → stops.parquet
+    First service date (YYYYMMDD) the feed covers
 
-    Gives us: stop_id → stop_name + lat/lon coordinates
+    feed_info.txt feed_start_date if present, else the earliest
+    calendar.txt start_date, else today.
     """
-    print("\n--- stops.txt ---")
-    df = pd.read_csv(os.path.join(input_dir, "stops.txt"))
-    print(f"  Rows: {len(df):,}")
-    print(f"  Columns: {list(df.columns)}")
+    for filename, column in (("feed_info.txt", "feed_start_date"), ("calendar.txt", "start_date")):
+        path = os.path.join(input_dir, filename)
+        if not os.path.exists(path):
+            continue
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            dates = [row[column] for row in csv.DictReader(f) if row.get(column)]
+        if dates:
+            return min(dates)
+    return datetime.now().strftime("%Y%m%d")
+
+
+def write_feed_versions(versions, output_dir):
+    """
+    feed_versions/feed_versions.parquet: which feed version was valid when
 
-    # Show sample
-    print(f"\n  Sample rows:")
-    print(df.head(5).to_string(index=False))
+    A version is valid from its valid_from up to the day before the next
+    version's valid_from (the latest one is open-ended). Joining silver
+    start_date BETWEEN valid_from AND valid_to picks the schedule a trip
+    actually ran on.
+    """
+    versions = sorted(versions, key=lambda v: (v["valid_from"], v["converted_at"]))
+    valid_to = []
+    for following in versions[1:]:
+        day_before = datetime.strptime(following["valid_from"], "%Y%m%d") - timedelta(days=1)
+        valid_to.append(day_before.strftime("%Y%m%d"))
+    valid_to.append(OPEN_END)
+
+    path = os.path.join(output_dir, "feed_versions", "feed_versions.parquet")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = pa.table({
+        "feed_version": [v["feed_version"] for v in versions],
+        "valid_from": [v["valid_from"] for v in versions],
+        "valid_to": valid_to,
+        "trips_sha256": [v["trips_sha256"] for v in versions],
+        "stop_times_sha256": [v["stop_times_sha256"] for v in versions],
+        "converted_at": [v["converted_at"] for v in versions],
+    })
+    pq.write_table(table, path, compression="snappy")
+    return path
+
+
+def build_schedule_index(output_dir, feed_version):
+    """
+    Build schedule_index.bin for one feed version from the converted tables
 
-    output_path = os.path.join(output_dir, "stops.parquet")
-    df.to_parquet(output_path, index=False)
-    print(f"  Saved → {output_path} ({os.path.getsize(output_path) / 1024:.1f} KB)")
-    return df
+    Same lookup as the gold_performance joins (ref_trips → ref_stop_times),
+    precomputed: arrival_time is parsed to seconds once here, route/stop
+    names are interned into the index header.
+
+    Reads back only the columns it needs from the Parquet outputs. The
+    trip_id join is done per distinct trip (stop_times.trip_id is a
+    dictionary), then gathered to rows as integer arrays.
+
+    Written to schedule_index/feed_version=<v>/ and copied to
+    schedule_index/schedule_index.bin, which flatten_data loads.
+    """
+    trips = pq.read_table(
+        os.path.join(output_dir, output_path("trips", feed_version)),
+        columns=["trip_id", "route_id", "direction_id", "start_time"],
+    )
+    stop_times = pq.read_table(
+        os.path.join(output_dir, output_path("stop_times", feed_version)),
+        columns=["trip_id", "stop_id", "arrival_time", "stop_sequence"],
+        read_dictionary=["trip_id", "arrival_time"],
+    ).unify_dictionaries()
+    routes = pq.read_table(os.path.join(output_dir, output_path("routes")), columns=["route_id", "route_short_name"])
+    stops = pq.read_table(os.path.join(output_dir, output_path("stops")), columns=["stop_id", "stop_name"])
+
+    # trips row for each stop_times row (-1 when the trip isn't in trips.txt)
+    stop_trips = stop_times["trip_id"].combine_chunks()
+    trip_of_value = pc.index_in(stop_trips.dictionary, value_set=trips["trip_id"])
+    trip_of_value = np.append(trip_of_value.fill_null(-1).to_numpy(zero_copy_only=False), -1)
+    trip_row = trip_of_value[stop_trips.indices.fill_null(-1).to_numpy(zero_copy_only=False)]
+
+    trip_direction = np.append(trips["direction_id"].fill_null(-1).to_numpy(), -1)[trip_row]
+    trip_start = np.append(hms_to_seconds(trips["start_time"]), -1)[trip_row]
+    keep = (trip_row >= 0) & ((trip_direction == 0) | (trip_direction == 1)) & (trip_start >= 0)
+
+    index = ScheduleIndex.build(
+        route_ids=pa.DictionaryArray.from_arrays(
+            pa.array(trip_row[keep], type=pa.int32()), trips["route_id"].combine_chunks()
+        ),
+        direction_ids=trip_direction[keep],
+        start_seconds=trip_start[keep],
+        stop_ids=stop_times["stop_id"].filter(pa.array(keep)),
+        arrival_seconds=hms_to_seconds(stop_times["arrival_time"])[keep],
+        stop_sequence=stop_times["stop_sequence"].to_numpy()[keep],
+        route_names=dict(zip(routes["route_id"].to_pylist(), routes["route_short_name"].to_pylist())),
+        stop_names=dict(zip(stops["stop_id"].cast(pa.string()).to_pylist(), stops["stop_name"].to_pylist())),
+    )
+
+    versioned_path = os.path.join(output_dir, "schedule_index", f"feed_version={feed_version}", "schedule_index.bin")
+    latest_path = os.path.join(output_dir, "schedule_index", "schedule_index.bin")
+    os.makedirs(os.path.dirname(versioned_path), exist_ok=True)
+    index.write(versioned_path)
+    shutil.copyfile(versioned_path, latest_path)
+    scheduled = int(keep.sum())
+    print(f"\n--- schedule_index.bin ({feed_version}) ---")
+    print(f"  Keys: {len(index):,} ({scheduled - len(index):,} duplicate service-day rows folded)")
+    print(f"  Routes: {len(index.routes):,}, stops: {len(index.stops):,}")
+    print(f"  Saved → {latest_path} ({os.path.getsize(latest_path) / 1024 / 1024:.1f} MB)")
+    return index
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Convert GTFS static files to Parquet (incrementally)")
+    parser.add_argument("--input-dir", default=INPUT_DIR, help="folder with the GTFS .txt files")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR, help="folder for the Parquet output")
+    parser.add_argument("--feed-version", help="version id for this feed (default: <valid_from>-<content hash>)")
+    parser.add_argument("--force", action="store_true", help="reconvert every file even if unchanged")
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
+    args = parse_args()
+    input_dir, output_dir = args.input_dir, args.output_dir
+
     print("=" * 60)
     print("GTFS Static → Parquet Converter")
     print("=" * 60)
 
     # Create output directory
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    os.makedirs(output_dir, exist_ok=True)
 
     # Check input files exist
     required_files = ["trips.txt", "stop_times.txt", "routes.txt", "stops.txt"]
-    missing = [f for f in required_files if not os.path.exists(os.path.join(INPUT_DIR, f))]
+    missing = [f for f in required_files if not os.path.exists(os.path.join(input_dir, f))]
     if missing:
-        print(f"\n❌ Missing files in {INPUT_DIR}: {missing}")
+        print(f"\n❌ Missing files in {input_dir}: {missing}")
         print(f"   Place your GTFS files there and try again.")
         sys.exit(1)
 
-    # Convert all files
-    trips_df = convert_trips(INPUT_DIR, OUTPUT_DIR)
-    stop_times_df = convert_stop_times(INPUT_DIR, OUTPUT_DIR)
-    routes_df = convert_routes(INPUT_DIR, OUTPUT_DIR)
-    stops_df = convert_stops(INPUT_DIR, OUTPUT_DIR)
+    started = time.perf_counter()
+    manifest = load_manifest(output_dir)
+    hashes = {name: file_sha256(os.path.join(input_dir, f"{name}.txt")) for name in CONVERTERS}
+    previous = manifest["files"]
+
+    def unchanged(name):
+        entry = previous.get(name)
+        return (
+            not args.force and entry is not None and entry["sha256"] == hashes[name]
+            and os.path.exists(os.path.join(output_dir, entry["output"]))
+        )
+
+    # A feed version is one (trips, stop_times) content pair
+    latest = manifest["versions"][-1] if manifest["versions"] else None
+    if latest and all(unchanged(name) for name in VERSIONED) and args.feed_version in (None, latest["feed_version"]):
+        feed_version = latest["feed_version"]
+        new_version = False
+    else:
+        valid_from = first_service_date(input_dir)
+        content = hashlib.sha256("".join(hashes[name] for name in VERSIONED).encode()).hexdigest()
+        feed_version = args.feed_version or f"{valid_from}-{content[:8]}"
+        new_version = True
+
+    # Decide per file: convert, reuse the previous version's output, or skip
+    jobs = {}
+    actions = {}
+    for name in CONVERTERS:
+        target = output_path(name, feed_version if name in VERSIONED else None)
+        if not unchanged(name):
+            jobs[name] = target
+            actions[name] = "converted"
+        elif previous[name]["output"] != target:
+            # Same content under a new feed version (e.g. only trips changed)
+            os.makedirs(os.path.dirname(os.path.join(output_dir, target)), exist_ok=True)
+            shutil.copyfile(os.path.join(output_dir, previous[name]["output"]), os.path.join(output_dir, target))
+            actions[name] = "reused"
+        else:
+            actions[name] = "unchanged"
+
+    # Convert what changed, one process per file
+    results = {}
+    if jobs:
+        with ProcessPoolExecutor(max_workers=min(len(jobs), os.cpu_count() or 1)) as pool:
+            futures = []
+            for name, target in jobs.items():
+                os.makedirs(os.path.dirname(os.path.join(output_dir, target)), exist_ok=True)
+                futures.append(pool.submit(CONVERTERS[name], input_dir, os.path.join(output_dir, target)))
+            results = {result["name"]: result for result in (future.result() for future in futures)}
+    converted = time.perf_counter() - started
+
+    for name in ["trips", "stop_times", "routes", "stops"]:
+        if name in results:
+            print(f"\n--- {name}.txt ---")
+            print("\n".join(results[name]["lines"]))
+        previous[name] = {
+            "sha256": hashes[name],
+            "output": output_path(name, feed_version if name in VERSIONED else None),
+            "rows": results[name]["rows"] if name in results else previous[name]["rows"],
+        }
+
+    if new_version:
+        manifest["versions"] = [v for v in manifest["versions"] if v["feed_version"] != feed_version]
+        manifest["versions"].append({
+            "feed_version": feed_version,
+            "valid_from": valid_from,
+            "trips_sha256": hashes["trips"],
+            "stop_times_sha256": hashes["stop_times"],
+            "converted_at": datetime.now().isoformat(timespec="seconds"),
+        })
+        write_feed_versions(manifest["versions"], output_dir)
+
+    # Route/stop names live in the index header, so those changes rebuild it too
+    index_path = os.path.join(output_dir, "schedule_index", "schedule_index.bin")
+    schedule_index = None
+    if jobs or new_version or not os.path.exists(index_path):
+        schedule_index = build_schedule_index(output_dir, feed_version)
+
+    # Only record the new state once every output is in place
+    save_manifest(output_dir, manifest)
+    total_rows = sum(result["rows"] for result in results.values())
 
     print("\n" + "=" * 60)
     print("SUMMARY")
     print("=" * 60)
-    print(f"""
-  Files converted:
-    trips.parquet      — {len(trips_df):,} rows (with derived start_time)
-    stop_times.parquet — {len(stop_times_df):,} rows
-    routes.parquet     — {len(routes_df):,} rows
-    stops.parquet      — {len(stops_df):,} rows
+    print(f"\n  Feed version: {feed_version}{' (new)' if new_version else ''}")
+    print("  Files:")
+    for name in ["trips", "stop_times", "routes", "stops"]:
+        print(f"    {previous[name]['output']:<62} {previous[name]['rows']:>12,} rows  {actions[name]}")
+    if schedule_index is not None:
+        print(f"    {'schedule_index/schedule_index.bin':<62} {len(schedule_index):>12,} keys  rebuilt")
+    else:
+        print(f"    {'schedule_index/schedule_index.bin':<62} {'':>12}       unchanged")
+
+    if results:
+        print(f"\n  Conversion: {converted:.1f}s, {total_rows / max(converted, 1e-9):,.0f} rows/s")
+        print(f"  Peak RSS:   {peak_rss_mb(resource.RUSAGE_CHILDREN):.0f} MB per converter, "
+              f"{peak_rss_mb():.0f} MB main (index build)")
+    else:
+        print(f"\n  Nothing changed ({converted:.1f}s)")
 
+    print(f"""
   Next steps:
-    1. Upload these to s3://emkidev-reference-hsl/
-       aws s3 cp {OUTPUT_DIR}/ s3://emkidev-reference-hsl/ --recursive
+    1. Sync to s3://emkidev-reference-hsl/ (only new/changed files are uploaded)
+       aws s3 sync {output_dir}/ s3://emkidev-reference-hsl/ --exclude {MANIFEST}
 
-    2. The Athena tables in athena.tf point at these files
+    2. Register new feed versions with Athena
+       MSCK REPAIR TABLE ref_trips;
+       MSCK REPAIR TABLE ref_stop_times;
 
     3. Test the join:
        SELECT s.route_id, s.predicted_arrival, st.arrival_time
        FROM silver_realtime s
+       JOIN ref_feed_versions fv
+           ON s.start_date BETWEEN fv.valid_from AND fv.valid_to
        JOIN ref_trips t
-           ON s.route_id = t.route_id
+           ON t.feed_version = fv.feed_version
+           AND s.route_id = t.route_id
            AND s.direction_id = t.direction_id
            AND s.start_time = t.start_time
        JOIN ref_stop_times st
-           ON t.trip_id = st.trip_id
+           ON st.feed_version = t.feed_version
+           AND t.trip_id = st.trip_id
            AND s.stop_id = st.stop_id
        LIMIT 10
 """)
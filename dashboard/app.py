@@ -3,13 +3,43 @@ HSL Performance Dashboard - Which lines are late today?
 Run with: streamlit run app.py
 
 Reads stats from bundled JSON file (frozen mode) or S3 (live mode).
+
+The History section reads the per-route time series generate_stats keeps
+(hsl_common.history): bundled under data/history/, or from the public
+results bucket when HSL_HISTORY_URL is set. Only the months in the chosen
+date range are fetched, and hourly rows only for the route being drilled
+into.
+
+Where Delay Builds Up reads the per-day stop delays next to them
+(hsl_common.propagation, history/stops/day=YYYY-MM-DD.parquet), one small
+file per day of the range.
 """
+import io
+import os
+import sys
+from datetime import timedelta
+from zoneinfo import ZoneInfo
+
 import streamlit as st
 import pandas as pd
 import altair as alt
 import json
+import pyarrow.parquet as pq
+import requests
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "layers" / "common" / "python"))
+from hsl_common import history, propagation  # noqa: E402
+
+HISTORY_DIR = Path(__file__).parent / "data" / "history"
+# e.g. https://emkidev-results-hsl.s3.eu-north-1.amazonaws.com
+HISTORY_URL = os.environ.get("HSL_HISTORY_URL")
+LOCAL_TZ = ZoneInfo("Europe/Helsinki")
+DEFAULT_DAYS = 30
+RANKED_ROUTES = 20
+DEFAULT_STOP_DAYS = 7
+RANKED_STOPS = 20
+
 st.set_page_config(page_title="HSL Late Lines", layout="wide", menu_items={})
 
 # Hide deploy button and menu
@@ -71,5 +101,202 @@ if late_routes:
 else:
     st.success("No routes averaging more than 5 minutes late!")
 
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def fetch(key):
+    """Bytes of a history object, or None if it has not been published."""
+    if HISTORY_URL:
+        response = requests.get(f"{HISTORY_URL.rstrip('/')}/{key}", timeout=30)
+        # Public buckets answer 403 for missing keys
+        if response.status_code in (403, 404):
+            return None
+        response.raise_for_status()
+        return response.content
+    path = HISTORY_DIR / key.removeprefix(f"{history.PREFIX}/")
+    return path.read_bytes() if path.exists() else None
+
+
+def open_history(key):
+    body = fetch(key)
+    return None if body is None else io.BytesIO(body)
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def load(grain, start, end, routes=None):
+    """History rows as a DataFrame with avg_delay_min; routes is a tuple or None for all."""
+    df = history.read(open_history, grain, start, end, routes).to_pandas()
+    df["route_short_name"] = df["route_short_name"].astype(str)
+    df["date"] = pd.to_datetime(df["date"])
+    return df
+
+
+def average(df, by):
+    grouped = df.groupby(by, as_index=False)[["delay_count", "delay_sum"]].sum()
+    grouped["avg_delay_min"] = (grouped["delay_sum"] / grouped["delay_count"] / 60.0).round(1)
+    return grouped
+
+
+def history_section():
+    index = fetch(history.INDEX_KEY)
+    if index is None:
+        st.caption("No history published yet.")
+        return
+    months = json.loads(index)["months"].values()
+    first = pd.Timestamp(min(m["from"] for m in months)).date()
+    last = pd.Timestamp(max(m["to"] for m in months)).date()
+
+    picked = st.date_input(
+        "Dates",
+        (max(first, last - timedelta(days=DEFAULT_DAYS - 1)), last),
+        min_value=first,
+        max_value=last,
+    )
+    if len(picked) != 2:
+        return
+    start, end = picked
+
+    # Daily rows are ~one per route per day, so all routes load for the ranking
+    with st.spinner("Loading history..."):
+        daily = load("daily", start, end)
+    if daily.empty:
+        st.info("No data in this range.")
+        return
+
+    ranking = average(daily, "route_short_name").sort_values("avg_delay_min", ascending=False)
+    st.subheader(f"Most Delayed Routes {start:%d.%m.} – {end:%d.%m.%Y} (Average)")
+    st.altair_chart(
+        alt.Chart(ranking.head(RANKED_ROUTES)).mark_bar().encode(
+            x=alt.X("route_short_name:N", title="Route", sort="-y", axis=alt.Axis(labelAngle=0)),
+            y=alt.Y("avg_delay_min:Q", title="Average Delay (minutes)"),
+            tooltip=["route_short_name", "avg_delay_min", "delay_count"],
+        ).properties(height=350),
+        use_container_width=True,
+    )
+
+    routes = st.multiselect(
+        "Routes",
+        ranking["route_short_name"].tolist(),
+        default=ranking["route_short_name"].head(3).tolist(),
+    )
+    if not routes:
+        return
+
+    st.subheader("Daily Trend")
+    trend = average(daily[daily["route_short_name"].isin(routes)], ["date", "route_short_name"])
+    st.altair_chart(
+        alt.Chart(trend).mark_line(point=True).encode(
+            x=alt.X("date:T", title="Date"),
+            y=alt.Y("avg_delay_min:Q", title="Average Delay (minutes)"),
+            color=alt.Color("route_short_name:N", title="Route"),
+            tooltip=["date:T", "route_short_name", "avg_delay_min"],
+        ).properties(height=350),
+        use_container_width=True,
+    )
+
+    route = st.selectbox("Drill down", routes)
+    with st.spinner(f"Loading hourly data for {route}..."):
+        hourly = load("hourly", start, end, (route,))
+    if hourly.empty:
+        return
+    hourly["hour_of_day"] = pd.to_datetime(hourly["hour"], unit="s", utc=True).dt.tz_convert(LOCAL_TZ).dt.hour
+    profile = average(hourly, "hour_of_day")
+    st.subheader(f"Route {route}: Delay by Hour of Day")
+    st.altair_chart(
+        alt.Chart(profile).mark_bar().encode(
+            x=alt.X("hour_of_day:O", title="Hour (Helsinki time)", axis=alt.Axis(labelAngle=0)),
+            y=alt.Y("avg_delay_min:Q", title="Average Delay (minutes)"),
+            tooltip=["hour_of_day", "avg_delay_min", "delay_count"],
+        ).properties(height=300),
+        use_container_width=True,
+    )
+
+    days = daily[daily["route_short_name"] == route].sort_values("date")
+    st.dataframe(
+        pd.DataFrame({
+            "Date": days["date"].dt.date,
+            "Average (min)": (days["delay_sum"] / days["delay_count"] / 60.0).round(1),
+            "Worst (min)": (days["delay_max"] / 60.0).round(1),
+            "Predictions": days["delay_count"],
+        }),
+        hide_index=True,
+        use_container_width=True,
+    )
+
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def load_stops(start, end):
+    """Stop delays of the days from start to end merged, with mean_added_min and mean_delay_min."""
+    days = pd.date_range(start, end)
+    tables = [pq.read_table(io.BytesIO(body)) for body in (fetch(propagation.day_key(day)) for day in days)
+              if body is not None]
+    stops = propagation.merge_stop_delays(tables)
+    mean, spread, mean_delay = propagation.summarize_stops(stops)
+    df = stops.to_pandas()
+    for column in ("route_id", "route_short_name", "stop_id", "stop_name"):
+        df[column] = df[column].astype(str)
+    df["mean_added_min"] = (mean / 60.0).round(2)
+    df["spread_min"] = (spread / 60.0).round(2)
+    df["mean_delay_min"] = (mean_delay / 60.0).round(1)
+    return df
+
+
+def stops_section():
+    index = fetch(history.INDEX_KEY)
+    if index is None:
+        return
+    last = pd.Timestamp(max(m["to"] for m in json.loads(index)["months"].values())).date()
+    picked = st.date_input("Stop dates", (last - timedelta(days=DEFAULT_STOP_DAYS - 1), last), max_value=last)
+    if len(picked) != 2:
+        return
+    start, end = picked
+    with st.spinner("Loading stop delays..."):
+        stops = load_stops(start, end)
+    if stops.empty:
+        st.info("No stop delays in this range.")
+        return
+
+    stops["line"] = stops["route_short_name"] + " (direction " + stops["direction_id"].astype("Int64").astype(str) + ")"
+    worst = stops[stops["trips"] >= propagation.MIN_TRIPS].nlargest(RANKED_STOPS, "mean_added_min")
+    worst["label"] = worst["route_short_name"] + " → " + worst["stop_name"]
+    st.subheader("Stops Adding the Most Delay (Average per Trip)")
+    st.altair_chart(
+        alt.Chart(worst).mark_bar().encode(
+            x=alt.X("mean_added_min:Q", title="Delay Added Since Previous Stop (minutes)"),
+            y=alt.Y("label:N", title=None, sort="-x"),
+            tooltip=["route_short_name", "direction_id", "stop_name", "stop_id",
+                     "mean_added_min", "spread_min", "added_max", "trips"],
+        ).properties(height=25 * len(worst)),
+        use_container_width=True,
+    )
+
+    lines = stops.groupby("line")["added_sum"].sum().sort_values(ascending=False).index.tolist()
+    default = worst["line"].iloc[0] if not worst.empty else lines[0]
+    line = st.selectbox("Route and direction", lines, index=lines.index(default))
+    along = stops[stops["line"] == line].sort_values("stop_sequence")
+    st.subheader(f"{line}: Delay Along the Route")
+    base = alt.Chart(along).encode(
+        x=alt.X("stop_sequence:O", title="Stop", axis=alt.Axis(labelAngle=0)),
+        tooltip=["stop_sequence", "stop_name", "mean_added_min", "mean_delay_min", "trips"],
+    )
+    st.altair_chart(
+        alt.layer(
+            base.mark_bar().encode(
+                y=alt.Y("mean_added_min:Q", title="Added (bars) / Delay (line), minutes"),
+                color=alt.condition("datum.mean_added_min > 0", alt.value("#d62728"), alt.value("#2ca02c")),
+            ),
+            base.mark_line(point=True, color="#444").encode(y="mean_delay_min:Q"),
+        ).properties(height=350),
+        use_container_width=True,
+    )
+
+
+st.divider()
+st.header("History")
+history_section()
+
+st.divider()
+st.header("Where Delay Builds Up")
+stops_section()
+
 st.divider()
 st.caption(f"Data collected: {data.get('generated_at', 'Unknown')[:16]} | Source: HSL GTFS-realtime API")
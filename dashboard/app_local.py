@@ -1,123 +1,130 @@
 """
-HSL Performance Dashboard - LOCAL VERSION (queries Athena directly)
+HSL Performance Dashboard - LOCAL VERSION (reads gold rollups directly)
 Run with: streamlit run app_local.py
 
 Use this for testing locally before publishing.
+Results come from a ResultStore (result_store.py) shared by every viewer and
+refreshed in the background from the gold bucket. The page re-renders from
+memory and shows how old the data is. Picking a late route queries its
+stops over the last few hours (result_store.route_stops_query), reading only
+that route's bucket and those hours. Set HSL_QUERY_BACKEND=duckdb (and
+HSL_LOCAL_DATA) to run offline against mirrored buckets instead of S3 and
+Athena.
 """
-import streamlit as st
-import boto3
+import os
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
 import pandas as pd
-import time
-from datetime import datetime
+import streamlit as st
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "layers" / "common" / "python"))
+from hsl_common.athena import LocalCacheStore, ResultCache, create_runner  # noqa: E402
+from result_store import (  # noqa: E402
+    DRILL_HOURS, LATE_THRESHOLD_MIN, LocalSource, ResultStore, S3Source, route_stops_query,
+)
 
 # Config
-DATABASE = "hsl_transport"
-WORKGROUP = "primary"
+GOLD_BUCKET = "emkidev-gold-hsl"
+RESULTS_BUCKET = "emkidev-results-hsl"
 REGION = "eu-north-1"
-REFRESH_INTERVAL = 300
+# Drill-down results are reused for this long
+DRILL_CACHE_TTL = 60
+REFRESH_INTERVAL = 30   # background refresh of the store
+RERENDER_INTERVAL = 10  # how often the page re-reads it
+LOCAL_TZ = ZoneInfo("Europe/Helsinki")
 
 st.set_page_config(page_title="HSL Late Lines Today", layout="wide", menu_items={})
 
 st.markdown(
-    f"""
-    <meta http-equiv="refresh" content="{REFRESH_INTERVAL}">
+    """
     <style>
-        .stDeployButton {{display: none;}}
-        #MainMenu {{visibility: hidden;}}
+        .stDeployButton {display: none;}
+        #MainMenu {visibility: hidden;}
     </style>
     """,
     unsafe_allow_html=True,
 )
 
 
-@st.cache_data(ttl=60)
-def run_athena_query(query: str) -> pd.DataFrame:
-    client = boto3.client("athena", region_name=REGION)
-
-    response = client.start_query_execution(
-        QueryString=query,
-        QueryExecutionContext={"Database": DATABASE},
-        WorkGroup=WORKGROUP,
-        ResultConfiguration={
-            "OutputLocation": "s3://emkidev-results-hsl/"
-        },
-    )
-    query_id = response["QueryExecutionId"]
-
-    while True:
-        result = client.get_query_execution(QueryExecutionId=query_id)
-        state = result["QueryExecution"]["Status"]["State"]
-        if state == "SUCCEEDED":
-            break
-        elif state in ("FAILED", "CANCELLED"):
-            raise Exception(f"Query {state}")
-        time.sleep(0.5)
-
-    paginator = client.get_paginator("get_query_results")
-    results = []
-    for page in paginator.paginate(QueryExecutionId=query_id):
-        for row in page["ResultSet"]["Rows"]:
-            results.append([col.get("VarCharValue", "") for col in row["Data"]])
-
-    if len(results) > 1:
-        return pd.DataFrame(results[1:], columns=results[0])
-    return pd.DataFrame()
-
-
-today = datetime.now()
-year = today.strftime("%Y")
-month = today.strftime("%m")
-day = today.strftime("%d")
+@st.cache_resource
+def result_store() -> ResultStore:
+    """One store per server process, started once and shared by all sessions."""
+    if os.environ.get("HSL_QUERY_BACKEND") == "duckdb":
+        source = LocalSource(Path(os.environ.get("HSL_LOCAL_DATA", "data")) / "gold")
+    else:
+        import boto3
+        source = S3Source(boto3.client("s3", region_name=REGION), GOLD_BUCKET)
+    return ResultStore(source, interval=REFRESH_INTERVAL).start()
 
-st.title("Which HSL lines are late today?")
-st.caption(f"Showing data for {today.strftime('%A, %d %B %Y')} | Auto-refreshes every 5 minutes")
-
-query = f"""
-SELECT
-    route_short_name,
-    ROUND(AVG(delay_seconds) / 60.0, 1) as avg_delay_min
-FROM gold_performance
-WHERE year = '{year}' AND month = '{month}' AND day = '{day}'
-  AND scheduled_arrival IS NOT NULL
-  AND route_short_name IS NOT NULL
-GROUP BY route_short_name
-HAVING AVG(delay_seconds) / 60.0 > 5
-ORDER BY avg_delay_min DESC
-"""
 
-stats_query = f"""
-SELECT
-    MIN(from_unixtime(CAST(feed_timestamp AS bigint) + 7200)) as first_feed,
-    MAX(from_unixtime(CAST(feed_timestamp AS bigint) + 7200)) as last_feed
-FROM silver_realtime
-WHERE year = '{year}' AND month = '{month}' AND day = '{day}'
-"""
+@st.cache_resource
+def query_runner():
+    """Athena (or DuckDB) for route drill-downs, with a short-lived local result cache."""
+    cache = ResultCache(LocalCacheStore(Path(__file__).parent / ".cache" / "queries"), ttl=DRILL_CACHE_TTL)
+    return create_runner(REGION, output_location=f"s3://{RESULTS_BUCKET}/", cache=cache)
+
+
+def local_time(moment):
+    return moment.astimezone(LOCAL_TZ).strftime("%H:%M")
 
-with st.spinner("Querying Athena..."):
-    try:
-        df = run_athena_query(query)
-        stats = run_athena_query(stats_query)
-        if not df.empty:
-            df["avg_delay_min"] = pd.to_numeric(df["avg_delay_min"])
-    except Exception as e:
-        st.error(f"Error: {e}")
-        st.stop()
-
-if not stats.empty and stats.iloc[0]["first_feed"]:
-    first = str(stats.iloc[0]["first_feed"])[11:16]
-    last = str(stats.iloc[0]["last_feed"])[11:16]
-    st.info(f"Data from {first} → {last}")
-else:
-    st.warning("No data collected today yet.")
-    st.stop()
-
-st.subheader("Routes Running >5 Minutes Late (Average)")
-
-if not df.empty:
-    st.bar_chart(df.set_index("route_short_name")["avg_delay_min"], height=500)
-    st.caption(f"{len(df)} routes averaging more than 5 minutes late")
-else:
-    st.success("No routes averaging more than 5 minutes late today!")
-
-st.divider()
-st.caption(f"Last updated: {datetime.now().strftime('%H:%M:%S')} | Data from HSL GTFS-realtime API")
+
+store = result_store()
+today = datetime.now(LOCAL_TZ)
+
+st.title("Which HSL lines are late today?")
+st.caption(f"Showing data for {today.strftime('%A, %d %B %Y')} | Updates every {REFRESH_INTERVAL} seconds")
+
+with st.spinner("Loading today's rollups..."):
+    store.wait_ready(timeout=60)
+
+
+@st.fragment(run_every=RERENDER_INTERVAL)
+def late_routes():
+    results = store.current()
+    now = datetime.now(timezone.utc)
+
+    if results.error:
+        age = f"{(now - results.refreshed_at).total_seconds():.0f}s old" if results.refreshed_at else "no data yet"
+        st.warning(f"Refresh failed ({age}): {results.error}")
+    if results.last_snapshot is None:
+        st.warning("No data collected today yet.")
+        return
+
+    st.info(f"Data from {local_time(results.first_snapshot)} → {local_time(results.last_snapshot)}"
+            f" | {results.objects} flattened objects")
+
+    st.subheader(f"Routes Running >{LATE_THRESHOLD_MIN} Minutes Late (Average)")
+    df = results.late_routes
+    if not df.empty:
+        st.bar_chart(df.set_index("route_short_name")["avg_delay_min"], height=500)
+        st.caption(f"{len(df)} routes averaging more than {LATE_THRESHOLD_MIN} minutes late")
+    else:
+        st.success(f"No routes averaging more than {LATE_THRESHOLD_MIN} minutes late today!")
+
+    if not df.empty:
+        route = st.selectbox("Drill down", df["route_short_name"])
+        route_ids = df.loc[df["route_short_name"] == route, "route_ids"].iloc[0]
+        if route_ids:
+            # Whole minutes, so re-renders within DRILL_CACHE_TTL repeat the same query
+            end = now.replace(second=0, microsecond=0)
+            stops = pd.DataFrame(query_runner().run(route_stops_query(route_ids, end)))
+            st.subheader(f"Route {route}: Delay by Stop, Last {DRILL_HOURS} Hours")
+            if stops.empty:
+                st.caption("No predictions in that window.")
+            else:
+                for direction, rows in stops.groupby("direction_id"):
+                    st.caption(f"Direction {direction}")
+                    st.bar_chart(rows.set_index("stop_sequence")["avg_delay_min"], height=250)
+
+    st.divider()
+    staleness = (now - results.last_snapshot).total_seconds() / 60
+    checked = (now - results.refreshed_at).total_seconds() if results.refreshed_at else None
+    st.caption(f"Newest snapshot {staleness:.0f} min old"
+               + (f" | Checked for new data {checked:.0f}s ago" if checked is not None else "")
+               + " | Data from HSL GTFS-realtime API")
+
+
+late_routes()
@@ -1,10 +1,22 @@
-"""Check what data we actually have in the pipeline."""
-import boto3
-import time
+"""Check what data we actually have in the pipeline (the last DAYS days)."""
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
 
-client = boto3.client("athena", region_name="eu-north-1")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "layers" / "common" / "python"))
+from hsl_common.athena import create_runner  # noqa: E402
+from hsl_common.partitions import window_predicate  # noqa: E402
 
-query = """
+# silver_realtime is partition-projected: an unbounded query would have
+# Athena enumerate every hour and bucket in the projection range
+DAYS = 14
+
+runner = create_runner("eu-north-1", output_location="s3://emkidev-results-hsl/")
+
+now = datetime.now(timezone.utc)
+window = window_predicate((now - timedelta(days=DAYS - 1)).replace(hour=0), now + timedelta(hours=1))
+
+query = f"""
 SELECT
     year, month, day,
     MIN(feed_timestamp) as earliest_feed,
@@ -12,32 +24,17 @@ SELECT
     COUNT(*) as row_count,
     COUNT(DISTINCT feed_timestamp) as unique_feeds
 FROM hsl_transport.silver_realtime
+WHERE {window}
 GROUP BY year, month, day
 ORDER BY year, month, day
 """
 
-response = client.start_query_execution(
-    QueryString=query,
-    QueryExecutionContext={"Database": "hsl_transport"},
-    WorkGroup="primary",
-    ResultConfiguration={"OutputLocation": "s3://emkidev-results-hsl/"},
-)
-
-query_id = response["QueryExecutionId"]
-print(f"Query ID: {query_id}")
-
-while True:
-    result = client.get_query_execution(QueryExecutionId=query_id)
-    state = result["QueryExecution"]["Status"]["State"]
-    print(f"Status: {state}")
-    if state in ("SUCCEEDED", "FAILED", "CANCELLED"):
-        break
-    time.sleep(1)
+rows = runner.run(query)
 
-if state == "SUCCEEDED":
-    results = client.get_query_results(QueryExecutionId=query_id)
-    print("\n" + "="*80)
-    print("DATA AVAILABLE IN SILVER LAYER:")
-    print("="*80)
-    for row in results["ResultSet"]["Rows"]:
-        print(" | ".join([col.get("VarCharValue", "") for col in row["Data"]]))
+print("\n" + "="*80)
+print("DATA AVAILABLE IN SILVER LAYER:")
+print("="*80)
+if rows:
+    print(" | ".join(rows[0]))
+for row in rows:
+    print(" | ".join(str(value) for value in row.values()))
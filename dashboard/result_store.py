@@ -0,0 +1,241 @@
+"""
+Background-refreshed results for app_local.
+
+A page render used to run its own Athena queries, and each viewer's render
+ran them again. ResultStore keeps today's late-route table in memory
+instead. One worker thread keeps it current: every interval it lists the
+gold rollups written since its watermark (list_objects_v2 StartAfter) and
+merges only those into a running total (hsl_common.rollup.merge_rollups).
+Renders read the latest Results without waiting on anything. app_local
+holds one store per Streamlit server (st.cache_resource), so any number of
+open tabs share one refresh.
+
+Rollup keys are rollups/year=/month=/day=/utc_hour=HH/HHMMSS.parquet in
+UTC snapshot time (hsl_common.partitions, hsl_common.silver.snapshot_key),
+so they list in snapshot order, and StartAfter skips whole hours the store
+has already merged. Flattens running side by side can land a key slightly
+behind the newest one, so each listing starts OVERLAP before the watermark
+and skips keys already merged. At UTC midnight the store starts over on the
+new day's partition.
+
+Drilling into one route is a query instead (route_stops_query), over
+gold_realtime for the last DRILL_HOURS. Its partition predicates name those
+hours and the route's bucket, so Athena reads only those prefixes.
+"""
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timedelta, timezone
+from pathlib import Path
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from hsl_common.partitions import route_predicate, window_predicate
+from hsl_common.rollup import merge_rollups, summarize
+
+REFRESH_INTERVAL = 30
+LATE_THRESHOLD_MIN = 5
+# Re-list this far behind the newest key, for rollups that land out of order
+OVERLAP = timedelta(minutes=2)
+READ_WORKERS = 8
+# Hours of gold a route drill-down covers
+DRILL_HOURS = 3
+
+
+class S3Source:
+    """Rollup objects in the gold bucket."""
+
+    def __init__(self, s3, bucket):
+        self.s3 = s3
+        self.bucket = bucket
+
+    def keys_after(self, prefix, start_after=None):
+        options = {"Bucket": self.bucket, "Prefix": prefix}
+        if start_after:
+            options["StartAfter"] = start_after
+        for page in self.s3.get_paginator("list_objects_v2").paginate(**options):
+            for item in page.get("Contents", []):
+                yield item["Key"]
+
+    def read(self, key):
+        body = self.s3.get_object(Bucket=self.bucket, Key=key)["Body"].read()
+        return pq.read_table(io.BytesIO(body))
+
+
+class LocalSource:
+    """Rollup files in a mirrored gold bucket ($HSL_LOCAL_DATA/gold)."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def keys_after(self, prefix, start_after=None):
+        keys = sorted(f"{prefix}{path.relative_to(self.root / prefix).as_posix()}"
+                      for path in (self.root / prefix).rglob("*.parquet"))
+        return [key for key in keys if not start_after or key > start_after]
+
+    def read(self, key):
+        return pq.read_table(self.root / key)
+
+
+class Results:
+    """What a render shows: one consistent view of the store, never mutated."""
+
+    def __init__(self, day, late_routes, first_snapshot=None, last_snapshot=None, objects=0,
+                 refreshed_at=None, error=None):
+        self.day = day                          # UTC partition date
+        self.late_routes = late_routes          # route_short_name, avg_delay_min (late routes only)
+        self.first_snapshot = first_snapshot    # UTC snapshot times of the first/newest rollup merged
+        self.last_snapshot = last_snapshot
+        self.objects = objects                  # flattened objects merged (a collector batch is one)
+        self.refreshed_at = refreshed_at        # last successful refresh (UTC)
+        self.error = error                      # last refresh failure, if it has not succeeded since
+
+
+def _snapshot_time(key, day):
+    """
+    UTC snapshot time from a rollup key (…/utc_hour=HH/HHMMSS.parquet).
+
+    An object that started in an earlier hour (or the day before) also
+    writes the rows of the next hour under its own filename; those rows
+    start at their partition's hour.
+    """
+    directory, filename = key.rsplit("/", 1)
+    hour = int(directory.rsplit("utc_hour=", 1)[1])
+    clock = datetime.strptime(filename[:6], "%H%M%S").time()
+    if clock.hour != hour:
+        clock = time(hour)
+    return datetime.combine(day, clock, tzinfo=timezone.utc)
+
+
+def _object_count(keys):
+    """
+    Flattened objects behind rollup keys. An object spanning two hours
+    writes one key per hour, under the same filename.
+    """
+    return len({key.rsplit("/", 1)[1] for key in keys})
+
+
+def late_routes(rollup):
+    """
+    Routes averaging more than LATE_THRESHOLD_MIN late, worst first (the
+    gold_rollups query, in memory), with the route_ids behind each name.
+    """
+    by_route = merge_rollups([rollup], keys=["route_short_name"])
+    avg, _ = summarize(by_route)
+    names = rollup.select(["route_short_name", "route_id"]).to_pandas().astype(str).drop_duplicates()
+    route_ids = names.groupby("route_short_name")["route_id"].apply(lambda ids: tuple(sorted(ids)))
+    short_names = by_route["route_short_name"].cast("string").to_pylist()
+    frame = pd.DataFrame({
+        "route_short_name": short_names,
+        "route_ids": [route_ids.get(name, ()) for name in short_names],
+        "avg_delay_min": avg / 60.0,
+    })
+    frame = frame[frame["avg_delay_min"] > LATE_THRESHOLD_MIN]
+    frame["avg_delay_min"] = frame["avg_delay_min"].round(1)
+    return frame.sort_values("avg_delay_min", ascending=False, ignore_index=True)
+
+
+def route_stops_query(route_ids, end, hours=DRILL_HOURS):
+    """
+    SQL for the average delay at each stop of routes over the hours before
+    end (a UTC datetime), by direction and stop_sequence.
+
+    Only those utc_hour partitions and the routes' route_bucket partitions
+    are read (hsl_common.partitions).
+    """
+    start = end - timedelta(hours=hours)
+    return f"""
+        SELECT
+            direction_id,
+            stop_sequence,
+            MAX(stop_name) AS stop_name,
+            AVG(delay_seconds) / 60.0 AS avg_delay_min,
+            COUNT(*) AS predictions
+        FROM hsl_transport.gold_realtime
+        WHERE {window_predicate(start, end + timedelta(hours=1))}
+          AND {route_predicate(route_ids)}
+          AND feed_timestamp >= {int(start.timestamp())}
+          AND delay_seconds IS NOT NULL
+        GROUP BY direction_id, stop_sequence
+        ORDER BY direction_id, stop_sequence
+    """
+
+
+class ResultStore:
+    """Today's late routes, kept current by one background worker."""
+
+    def __init__(self, source, interval=REFRESH_INTERVAL, clock=lambda: datetime.now(timezone.utc)):
+        self.source = source
+        self.interval = interval
+        self.clock = clock
+        self._lock = threading.Lock()  # one refresh at a time
+        self._stop = threading.Event()
+        self._ready = threading.Event()
+        self._thread = None
+        self._reset(clock().date())
+
+    def _reset(self, day):
+        self.day = day
+        self.rollup = merge_rollups([])
+        self.seen = set()
+        self.first = self.last = None
+        self.results = Results(day, late_routes(self.rollup))
+
+    def refresh(self):
+        """Merge rollups written since the watermark and publish new Results; returns how many were read."""
+        with self._lock:
+            day = self.clock().date()
+            if day != self.day:
+                self._reset(day)
+            prefix = f"rollups/year={day:%Y}/month={day:%m}/day={day:%d}/"
+            start_after = None
+            if self.last is not None and self.last - OVERLAP >= datetime.combine(day, datetime.min.time(), timezone.utc):
+                start_after = f"{prefix}utc_hour={self.last - OVERLAP:%H/%H%M%S}"
+
+            keys = [key for key in self.source.keys_after(prefix, start_after) if key not in self.seen]
+            if keys:
+                with ThreadPoolExecutor(READ_WORKERS) as pool:
+                    tables = list(pool.map(self.source.read, keys))
+                self.rollup = merge_rollups([self.rollup, *tables])
+                self.seen.update(keys)
+                times = [_snapshot_time(key, day) for key in keys]
+                self.first = min([self.first, *times] if self.first else times)
+                self.last = max([self.last, *times] if self.last else times)
+                table = late_routes(self.rollup)
+            else:
+                table = self.results.late_routes
+
+            self.results = Results(day, table, self.first, self.last, _object_count(self.seen),
+                                   refreshed_at=self.clock())
+            self._ready.set()
+            return len(keys)
+
+    def current(self):
+        """The latest Results; a plain attribute read, safe from any thread."""
+        return self.results
+
+    def wait_ready(self, timeout=None):
+        """Block until the first refresh has finished (or failed)."""
+        return self._ready.wait(timeout)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="result-store", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                # Keep serving the last good results; the page shows the error and their age
+                previous = self.results
+                self.results = Results(previous.day, previous.late_routes, previous.first_snapshot,
+                                       previous.last_snapshot, previous.objects, previous.refreshed_at, str(e))
+                self._ready.set()
+            self._stop.wait(self.interval)
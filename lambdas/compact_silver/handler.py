@@ -0,0 +1,186 @@
+"""
+Compact one day of silver snapshots into a few large sorted Parquet files.
+
+flatten_data writes a small object every 15 minutes into each hour and
+route bucket partition (hsl_common.partitions), ~4 per partition and ~770
+per day. Once a day is closed this job, for each
+parquet/year=/month=/day=/utc_hour=/route_bucket=/ directory:
+  1. reads every snapshot in it (plus the compacted files of an earlier run)
+  2. drops duplicate (feed_timestamp, trip_id, stop_id) rows
+  3. sorts by route_id, feed_timestamp and writes
+     compacted-<run id>-NNNNN.parquet into the same directory
+  4. deletes the inputs
+
+silver_realtime uses partition projection, so the files under a partition's
+prefix are what Athena reads; there is no Glue partition location to swap.
+Between steps 3 and 4 a query over that directory sees its rows twice, for
+the few seconds the deletes take. The run id is a hash of the input objects,
+so re-running after a crash converges (the dedupe drops the copies), and
+re-running a finished day is a no-op.
+
+All S3 access goes through the client passed to compact_partition, so it
+can be pointed at a local S3 stand-in (moto, MinIO).
+"""
+import hashlib
+import io
+import os
+from datetime import datetime, timedelta
+
+import boto3
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from hsl_common.metrics import Metrics
+from hsl_common.silver import SILVER_SCHEMA
+
+SILVER_BUCKET = os.environ.get("SILVER_BUCKET", "emkidev-silver-hsl")
+SNAPSHOT_PREFIX = "parquet"
+COMPACTED_NAME = "compacted-"
+
+DEDUPE_KEYS = ["feed_timestamp", "trip_id", "stop_id"]
+MAX_ROWS_PER_FILE = 5_000_000
+ROW_GROUP_SIZE = 500_000
+
+
+def partition_path(prefix, year, month, day):
+    return f"{prefix}/year={year}/month={month}/day={day}/"
+
+
+def by_directory(objects):
+    """{directory/: [(key, etag)]} for the hour and route bucket directories of a day."""
+    directories = {}
+    for key, etag in objects:
+        directories.setdefault(key.rsplit("/", 1)[0] + "/", []).append((key, etag))
+    return directories
+
+
+def is_compacted(key):
+    return key.rsplit("/", 1)[1].startswith(COMPACTED_NAME)
+
+
+def list_keys(s3, bucket, prefix):
+    paginator = s3.get_paginator("list_objects_v2")
+    objects = []
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            objects.append((obj["Key"], obj["ETag"]))
+    return sorted(objects)
+
+
+def read_silver(s3, bucket, keys, metrics):
+    tables = []
+    for key in keys:
+        with metrics.stage("s3_get"):
+            body = s3.get_object(Bucket=bucket, Key=key)["Body"].read()
+        metrics.add("bytes_in", len(body))
+        with metrics.stage("decode"):
+            tables.append(pq.read_table(io.BytesIO(body), schema=SILVER_SCHEMA))
+    return pa.concat_tables(tables).unify_dictionaries()
+
+
+def dedupe_and_sort(table):
+    """Keep the first row per (feed_timestamp, trip_id, stop_id), sorted by route and time."""
+    row = pa.array(np.arange(table.num_rows))
+    first = (
+        table.select(DEDUPE_KEYS)
+        .append_column("_row", row)
+        .group_by(DEDUPE_KEYS, use_threads=False)
+        .aggregate([("_row", "min")])
+        .column("_row_min")
+    )
+    table = table.take(np.sort(first.to_numpy()))
+
+    # Arrow can't sort dictionary columns directly; sort on the decoded strings
+    sort_keys = pa.table({
+        "route_id": table["route_id"].cast(pa.string()),
+        "feed_timestamp": table["feed_timestamp"],
+        "trip_id": table["trip_id"],
+        "stop_id": table["stop_id"].cast(pa.string()),
+    })
+    order = pc.sort_indices(sort_keys, sort_keys=[(name, "ascending") for name in sort_keys.column_names])
+    return table.take(order)
+
+
+def write_run(s3, bucket, table, run_prefix, metrics):
+    """Write table as run_prefix + NNNNN.parquet files; returns their keys."""
+    keys = []
+    for part, offset in enumerate(range(0, max(table.num_rows, 1), MAX_ROWS_PER_FILE)):
+        chunk = table.slice(offset, MAX_ROWS_PER_FILE)
+        buffer = io.BytesIO()
+        with metrics.stage("serialize"):
+            pq.write_table(chunk, buffer, row_group_size=ROW_GROUP_SIZE, compression="snappy")
+        key = f"{run_prefix}{part:05d}.parquet"
+        with metrics.stage("s3_put"):
+            s3.put_object(Bucket=bucket, Key=key, Body=buffer.getvalue(), ContentType="application/vnd.apache.parquet")
+        metrics.add("bytes_out", buffer.tell())
+        keys.append(key)
+    return keys
+
+
+def delete_keys(s3, bucket, keys):
+    for start in range(0, len(keys), 1000):
+        batch = keys[start:start + 1000]
+        s3.delete_objects(Bucket=bucket, Delete={"Objects": [{"Key": k} for k in batch], "Quiet": True})
+
+
+def compact_directory(s3, bucket, directory, objects, metrics):
+    """Compact one hour and route bucket directory; returns (input rows, output rows, output files)."""
+    run_id = hashlib.sha256(repr(objects).encode()).hexdigest()[:16]
+    run_prefix = f"{directory}{COMPACTED_NAME}{run_id}-"
+
+    table = read_silver(s3, bucket, [key for key, _ in objects], metrics)
+    input_rows = table.num_rows
+    with metrics.stage("dedupe_sort"):
+        table = dedupe_and_sort(table)
+    output_keys = write_run(s3, bucket, table, run_prefix, metrics)
+
+    # Written first, so the directory never lacks any of its rows
+    with metrics.stage("s3_delete"):
+        delete_keys(s3, bucket, [key for key, _ in objects if not key.startswith(run_prefix)])
+    return input_rows, table.num_rows, len(output_keys)
+
+
+def compact_partition(s3, bucket, year, month, day, metrics=None):
+    """Compact one silver day, directory by directory. Safe to re-run at any point."""
+    metrics = metrics or Metrics("compact_silver")
+    values = [year, month, day]
+    with metrics.stage("s3_list"):
+        objects = list_keys(s3, bucket, partition_path(SNAPSHOT_PREFIX, year, month, day))
+
+    result = dict.fromkeys(["directories", "input_files", "output_files", "input_rows", "output_rows"], 0)
+    for directory, directory_objects in sorted(by_directory(objects).items()):
+        keys = [key for key, _ in directory_objects]
+        if all(map(is_compacted, keys)) and len({key.rsplit("-", 1)[0] for key in keys}) == 1:
+            continue    # one run, and nothing new since
+        input_rows, output_rows, output_files = compact_directory(s3, bucket, directory, directory_objects, metrics)
+        result["directories"] += 1
+        result["input_files"] += len(directory_objects)
+        result["output_files"] += output_files
+        result["input_rows"] += input_rows
+        result["output_rows"] += output_rows
+    metrics.add("rows", result["output_rows"])
+
+    status = "compacted" if result["directories"] else "skipped"
+    return {"status": status, "partition": "/".join(values), **result}
+
+
+def lambda_handler(event, context):
+    # Compact yesterday (UTC, matching the flatten partition keys) unless told otherwise
+    if event and event.get("date"):
+        target = datetime.strptime(event["date"], "%Y-%m-%d")
+    else:
+        target = datetime.utcnow() - timedelta(days=1)
+
+    metrics = Metrics("compact_silver")
+    result = compact_partition(
+        boto3.client("s3"),
+        SILVER_BUCKET,
+        target.strftime("%Y"),
+        target.strftime("%m"),
+        target.strftime("%d"),
+        metrics,
+    )
+    print(result)
+    return {**result, "metrics": metrics.emit(partition=result["partition"])}
@@ -0,0 +1,294 @@
+"""
+Long-running trip-updates collector (high-frequency fetch mode).
+
+The scheduled pipeline takes one snapshot every 15 minutes. The collector
+instead polls the feed every few seconds:
+
+- one keep-alive requests.Session, so a poll costs a request, not a TLS
+  handshake;
+- conditional requests (If-None-Match / If-Modified-Since) when the server
+  sends ETag / Last-Modified, so an unchanged feed is a bodyless 304;
+- snapshots whose header.timestamp has not moved are dropped (the header is
+  parsed alone, not the whole feed);
+- new snapshots are buffered and written as one compressed, indexed bronze
+  container (.hslb, see hsl_common.bronze) per batch, with flatten started
+  asynchronously for each.
+
+A failed poll or a body that does not parse costs one sample; the loop goes
+on. A failed write keeps the batch for the next flush to retry. The final
+flush is retried a few times, and in Lambda whatever is still unwritten
+carries over to the next window of a warm container.
+
+It runs as the hsl-collect-realtime Lambda (one window per invocation,
+re-armed by its schedule) or as a plain process:
+
+    python lambdas/fetch_realtime/collector.py --interval 5 --bucket emkidev-bronze-hsl
+    python lambdas/fetch_realtime/collector.py --url http://localhost:8000/ --output-dir /tmp/bronze
+
+benchmarks/feed_stub.py serves recorded protobuf locally for the second form.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import requests
+from google.protobuf.message import DecodeError
+
+# Local runs; in Lambda the common layer provides hsl_common
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "layers" / "common" / "python"))
+
+from hsl_common.bronze import CONTENT_TYPE, encode_bronze  # noqa: E402
+from hsl_common.feed import header_timestamp  # noqa: E402
+from hsl_common.feeds import TRIP_UPDATES  # noqa: E402
+
+URL = TRIP_UPDATES.url
+BRONZE_BUCKET = os.environ.get("BRONZE_BUCKET")
+FLATTEN_FUNCTION = os.environ.get("FLATTEN_FUNCTION")
+POLL_INTERVAL = float(os.environ.get("POLL_INTERVAL", "10"))
+# A batch is written when it holds this many snapshots or is this old
+BATCH_SNAPSHOTS = int(os.environ.get("BATCH_SNAPSHOTS", "30"))
+BATCH_SECONDS = float(os.environ.get("BATCH_SECONDS", "300"))
+BRONZE_CODEC = os.environ.get("BRONZE_CODEC", "zstd")
+# Stop this long before the Lambda timeout so the last batch gets written
+SHUTDOWN_MARGIN = 20
+# Attempts at the final flush, with 1, 2, 4... seconds between them
+FINAL_FLUSH_ATTEMPTS = 3
+
+
+class FeedPoller:
+    """Conditional GETs over one session; poll() returns only new snapshots."""
+
+    def __init__(self, url, session=None, timeout=10):
+        self.url = url
+        self.session = session or requests.Session()
+        self.timeout = timeout
+        self.etag = None
+        self.last_modified = None
+        self.last_timestamp = None
+        self.stats = dict.fromkeys(["polls", "not_modified", "duplicates", "snapshots", "bytes"], 0)
+
+    def poll(self):
+        """Bytes of a new snapshot, or None if the feed has not changed."""
+        headers = {"Accept": "application/x-protobuf"}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+
+        response = self.session.get(self.url, headers=headers, timeout=self.timeout)
+        self.stats["polls"] += 1
+        if response.status_code == 304:
+            self.stats["not_modified"] += 1
+            return None
+        response.raise_for_status()
+
+        body = response.content
+        self.stats["bytes"] += len(body)
+        # Raises DecodeError before the validators are kept, so a corrupt
+        # body is fetched again rather than answered with a 304
+        timestamp = header_timestamp(body)
+        self.etag = response.headers.get("ETag")
+        self.last_modified = response.headers.get("Last-Modified")
+        if timestamp is not None and timestamp == self.last_timestamp:
+            self.stats["duplicates"] += 1
+            return None
+        self.last_timestamp = timestamp
+        self.stats["snapshots"] += 1
+        return body
+
+
+class S3Sink:
+    """Writes batches to the bronze bucket and starts flatten for each."""
+
+    def __init__(self, s3, bucket, lambda_client=None, flatten_function=None):
+        self.s3 = s3
+        self.bucket = bucket
+        self.lambda_client = lambda_client
+        self.flatten_function = flatten_function
+
+    def write(self, key, body, frames):
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=key,
+            Body=body,
+            ContentType=CONTENT_TYPE,
+            Metadata={"frames": str(frames)},
+        )
+        if self.flatten_function:
+            # Same payload the Step Functions pipeline passes to flatten. The
+            # batch is in bronze by now, so a failed invoke is only logged
+            # (replay.py can flatten it) rather than retried as a new object.
+            try:
+                self.lambda_client.invoke(
+                    FunctionName=self.flatten_function,
+                    InvocationType="Event",
+                    Payload=json.dumps({"bronze_bucket": self.bucket, "bronze_key": key}),
+                )
+            except Exception as e:
+                print(f"Could not start flatten for {key}: {e}")
+
+
+class LocalSink:
+    """Writes batches under a local directory, in the bronze key layout."""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+
+    def write(self, key, body, frames):
+        path = self.directory / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(body)
+
+
+class Collector:
+    """
+    Polls every interval seconds and writes new snapshots to sink in batches.
+
+    pending holds snapshots an earlier run could not write; they start the
+    first batch.
+    """
+
+    def __init__(self, poller, sink, interval=POLL_INTERVAL, batch_snapshots=BATCH_SNAPSHOTS,
+                 batch_seconds=BATCH_SECONDS, codec=BRONZE_CODEC, clock=time.monotonic, sleep=time.sleep,
+                 pending=None):
+        self.poller = poller
+        self.sink = sink
+        self.interval = interval
+        self.batch_snapshots = batch_snapshots
+        self.batch_seconds = batch_seconds
+        self.codec = codec
+        self.clock = clock
+        self.sleep = sleep
+        self.batch = list(pending or [])
+        self.batch_started = self.clock() if self.batch else None
+        self.keys = []
+        self.errors = 0
+        self.write_errors = 0
+
+    def step(self):
+        """One poll; flushes the batch when it is full or old enough."""
+        try:
+            snapshot = self.poller.poll()
+        except (requests.RequestException, DecodeError) as e:
+            # A failed poll or a corrupt body only costs one sample; keep the loop going
+            self.errors += 1
+            print(f"Poll failed: {e}")
+            snapshot = None
+        if snapshot is not None:
+            if not self.batch:
+                self.batch_started = self.clock()
+            self.batch.append(snapshot)
+        if self.batch and (len(self.batch) >= self.batch_snapshots
+                           or self.clock() - self.batch_started >= self.batch_seconds):
+            self.flush()
+
+    def flush(self):
+        """Write the batch; returns its key, or None if there was nothing to write or the write failed."""
+        if not self.batch:
+            return None
+        now = datetime.now(timezone.utc)
+        extension, body = encode_bronze(self.batch, self.codec)
+        key = TRIP_UPDATES.bronze_key(now, extension)
+        try:
+            self.sink.write(key, body, len(self.batch))
+        except Exception as e:
+            # Keep the batch; the next flush writes it (under a new key)
+            self.write_errors += 1
+            print(f"Write of {len(self.batch)} snapshots to {key} failed: {e}")
+            return None
+        print(f"Wrote {len(self.batch)} snapshots to {key}")
+        self.keys.append(key)
+        self.batch = []
+        return key
+
+    def run(self, duration=None):
+        """Poll on a fixed cadence until duration seconds pass (forever if None), then flush."""
+        deadline = None if duration is None else self.clock() + duration
+        next_poll = self.clock()
+        try:
+            while True:
+                self.step()
+                next_poll += self.interval
+                # Skip missed ticks rather than bursting to catch up
+                while next_poll <= self.clock():
+                    next_poll += self.interval
+                if deadline is not None and next_poll >= deadline:
+                    break
+                self.sleep(max(0.0, next_poll - self.clock()))
+        finally:
+            self.final_flush()
+        return self.summary()
+
+    def final_flush(self, attempts=FINAL_FLUSH_ATTEMPTS):
+        """Flush, retrying a failed write; whatever is still unwritten stays in self.batch."""
+        for attempt in range(attempts):
+            if attempt:
+                self.sleep(2 ** (attempt - 1))
+            self.flush()
+            if not self.batch:
+                return
+
+    def summary(self):
+        return {**self.poller.stats, "errors": self.errors, "write_errors": self.write_errors,
+                "unwritten": len(self.batch), "batches": len(self.keys), "bronze_keys": self.keys}
+
+
+# Survives between invocations in a warm container: the connection, the
+# validators and the last header timestamp carry over to the next window,
+# and so do snapshots the last window could not write
+_poller = None
+_pending = []
+
+
+def lambda_handler(event, context):
+    """Collect for one window: until shortly before the Lambda timeout, or event["duration"] seconds."""
+    import boto3
+
+    global _poller, _pending
+    if _poller is None:
+        _poller = FeedPoller(URL)
+    sink = S3Sink(boto3.client("s3"), BRONZE_BUCKET, boto3.client("lambda"), FLATTEN_FUNCTION)
+
+    duration = context.get_remaining_time_in_millis() / 1000 - SHUTDOWN_MARGIN
+    if "duration" in event:
+        duration = min(duration, float(event["duration"]))
+    collector = Collector(_poller, sink, interval=float(event.get("interval", POLL_INTERVAL)), pending=_pending)
+    try:
+        summary = collector.run(duration)
+    finally:
+        _pending = collector.batch
+    return {"status": "success", "bronze_bucket": BRONZE_BUCKET, **summary}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Poll GTFS-RT trip updates and write batched bronze objects.")
+    parser.add_argument("--url", default=URL)
+    parser.add_argument("--interval", type=float, default=POLL_INTERVAL, help="seconds between polls")
+    parser.add_argument("--duration", type=float, help="stop after this many seconds (default: run until Ctrl-C)")
+    parser.add_argument("--batch-snapshots", type=int, default=BATCH_SNAPSHOTS)
+    parser.add_argument("--batch-seconds", type=float, default=BATCH_SECONDS)
+    parser.add_argument("--codec", choices=["none", "gzip", "zstd"], default=BRONZE_CODEC)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--bucket", help="bronze bucket to write to")
+    target.add_argument("--output-dir", help="write batches here instead of S3")
+    parser.add_argument("--flatten-function", help="Lambda to invoke per batch (with --bucket)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.bucket:
+        import boto3
+        sink = S3Sink(boto3.client("s3"), args.bucket, boto3.client("lambda"), args.flatten_function)
+    else:
+        sink = LocalSink(args.output_dir)
+    collector = Collector(FeedPoller(args.url), sink, args.interval, args.batch_snapshots, args.batch_seconds, args.codec)
+    try:
+        summary = collector.run(args.duration)
+    except KeyboardInterrupt:
+        summary = collector.summary()
+    print(json.dumps({key: value for key, value in summary.items() if key != "bronze_keys"}))
@@ -1,48 +1,147 @@
-import json
 import os
+import time
 import boto3
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from google.transit import gtfs_realtime_pb2
-from google.protobuf.json_format import MessageToDict
+
+from hsl_common.bronze import CONTENT_TYPE, encode_bronze
+from hsl_common.feeds import TRIP_UPDATES, selected_feeds
+from hsl_common.metrics import Metrics
 
 s3 = boto3.client("s3")
 BRONZE_BUCKET = os.environ["BRONZE_BUCKET"]
-URL = "https://realtime.hsl.fi/realtime/trip-updates/v2/hsl"
+# none → raw .pb; gzip / zstd → compressed .hslb container (see hsl_common.bronze)
+BRONZE_CODEC = os.environ.get("BRONZE_CODEC", "zstd")
+# Comma-separated hsl_common.feeds names; empty fetches every feed
+FEEDS = selected_feeds(os.environ.get("FEEDS", ""))
+CONNECT_TIMEOUT = 5
+# Besides its request, a feed gets this long to be decoded, compressed and written
+WRITE_SECONDS = 5
+CHUNK_BYTES = 64 * 1024
+
+# Reused across warm invocations (keep-alive connections, one pool per host)
+session = requests.Session()
 
-def fetch_gtfs_realtime(url):
-    response = requests.get(
+def fetch_gtfs_realtime(url, timeout=30, deadline=None):
+    """
+    The feed's bytes. timeout bounds the connect and each socket read;
+    deadline (time.monotonic()) bounds the whole download, so a server that
+    trickles the body cannot keep it going.
+    """
+    with session.get(
         url,
         headers={"Accept": "application/x-protobuf"},
-        timeout=30,
-    )
-    response.raise_for_status()
-    return response.content
+        timeout=(CONNECT_TIMEOUT, timeout),
+        stream=True,
+    ) as response:
+        response.raise_for_status()
+        # read1 (urllib3 2) returns whatever has arrived, so the deadline is
+        # checked while a slow body trickles in; iter_content waits for full chunks
+        read1 = getattr(response.raw, "read1", None)
+        pieces = iter(lambda: read1(CHUNK_BYTES), b"") if read1 else response.iter_content(CHUNK_BYTES)
+        chunks = []
+        for chunk in pieces:
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"{url} took longer than its deadline")
+            chunks.append(chunk)
+    return b"".join(chunks)
+
+def feed_budget(feed):
+    """Seconds one feed may take in all: the request, then decode and write."""
+    return CONNECT_TIMEOUT + feed.timeout + WRITE_SECONDS
 
 def decode_protobuf(binary_data):
     feed = gtfs_realtime_pb2.FeedMessage()
     feed.ParseFromString(binary_data)
-    return MessageToDict(feed, preserving_proto_field_name=True)
+    return feed
+
+def fetch_feed(feed, now, metrics, deadline=None):
+    """
+    Fetch one feed, validate it and write it to its bronze prefix; returns its result.
+
+    Past deadline (time.monotonic()) the feed is abandoned: the download
+    stops and nothing is written.
+    """
+    started = time.perf_counter()
+    with metrics.stage("fetch"):
+        binary_data = fetch_gtfs_realtime(feed.url, feed.timeout, deadline - WRITE_SECONDS if deadline else None)
+    metrics.add("bytes_in", len(binary_data))
+
+    # Parse once to validate the feed; bronze keeps the original bytes so
+    # flatten can walk the protobuf directly instead of a JSON copy
+    with metrics.stage("decode"):
+        message = decode_protobuf(binary_data)
+    metrics.add("entities", len(message.entity))
+
+    with metrics.stage("compress"):
+        extension, body = encode_bronze([binary_data], BRONZE_CODEC)
+    s3_key = feed.bronze_key(now, extension)
+
+    if deadline is not None and time.monotonic() > deadline:
+        # The handler has stopped waiting for this feed
+        raise TimeoutError(f"{feed.name} took longer than {feed_budget(feed)}s")
+    with metrics.stage("s3_put"):
+        s3.put_object(
+            Bucket=BRONZE_BUCKET,
+            Key=s3_key,
+            Body=body,
+            ContentType="application/x-protobuf" if extension == ".pb" else CONTENT_TYPE
+        )
+    metrics.add("bytes_out", len(body))
+    return {
+        "feed": feed.name,
+        "bronze_bucket": BRONZE_BUCKET,
+        "bronze_key": s3_key,
+        "entity_count": len(message.entity),
+        "bytes": len(body),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
 
 def lambda_handler(event, context):
     now = datetime.utcnow()
-    binary_data = fetch_gtfs_realtime(URL)
-    decoded = decode_protobuf(binary_data)
+    metrics = Metrics("fetch_realtime")
 
-    # S3 key with date partitioning
-    s3_key = f"raw/year={now.year}/month={now.strftime('%m')}/day={now.strftime('%d')}/{now.strftime('%H%M%S')}.json"
+    # All feeds at once, so the invocation takes about as long as the
+    # slowest one. Each feed has a total budget (feed_budget): one that
+    # hangs is given up on when it runs out, without waiting for its thread
+    started = time.monotonic()
+    deadlines = {feed: started + feed_budget(feed) for feed in FEEDS}
+    pool = ThreadPoolExecutor(len(FEEDS))
+    futures = {feed: pool.submit(fetch_feed, feed, now, metrics, deadlines[feed]) for feed in FEEDS}
+    results = []
+    failed = {}
+    for feed, future in futures.items():
+        try:
+            results.append(future.result(timeout=max(0.0, deadlines[feed] - time.monotonic())))
+        except Exception as e:
+            if not future.done():
+                e = TimeoutError(f"no result within {feed_budget(feed)}s")
+            failed[feed.name] = f"{type(e).__name__}: {e}"
+            print(f"Feed {feed.name} failed: {failed[feed.name]}")
+    # An abandoned thread stops at its deadline checks; don't wait for it
+    pool.shutdown(wait=False, cancel_futures=True)
+    metrics.add("feeds", len(results))
+    metrics.add("feeds_failed", len(failed))
 
-    s3.put_object(
-        Bucket=BRONZE_BUCKET,
-        Key=s3_key,
-        Body=json.dumps(decoded),
-        ContentType="application/json"
-    )
+    # Without a required feed (trip updates) the run fails and Step Functions
+    # retries it. The optional feeds written meanwhile are written again, and
+    # silver keys come from the snapshot, so their flattens overwrite each other.
+    required = [feed.name for feed in FEEDS if feed.required and feed.name in failed]
+    if required:
+        raise RuntimeError(f"Required feeds failed: {', '.join(f'{name} ({failed[name]})' for name in required)}")
 
+    # Top-level keys stay the trip updates' for callers that predate feeds
+    trip_updates = next((result for result in results if result["feed"] == TRIP_UPDATES.name), {})
     return {
         "status": "success",
         "bronze_bucket": BRONZE_BUCKET,
-        "bronze_key": s3_key,
-        "entity_count": len(decoded.get("entity", [])),
-        "timestamp": now.isoformat()
+        "bronze_key": trip_updates.get("bronze_key"),
+        "entity_count": trip_updates.get("entity_count"),
+        "bytes": sum(result["bytes"] for result in results),
+        "feeds": results,
+        "failed": failed,
+        "timestamp": now.isoformat(),
+        "metrics": metrics.emit(bronze_keys=[result["bronze_key"] for result in results]),
     }
@@ -1,85 +1,254 @@
-import json
+import io
 import os
+import time
+import uuid
 import boto3
+import pyarrow.parquet as pq
 from datetime import datetime
 
+from hsl_common.bronze import key_time
+from hsl_common.delta import apply, split_by_day
+from hsl_common.feeds import FEEDS, TRIP_UPDATES
+from hsl_common.flatten import CHUNK_ROWS, bronze_chunks, feed_table, flatten_stream
+from hsl_common.metrics import Metrics
+from hsl_common.partitions import split_partitions
+from hsl_common.schedule_index import ScheduleIndex
+from hsl_common.silver import snapshot_key, write_parquet
+from hsl_common.upload import MultipartUpload
+
 s3 = boto3.client("s3")
 SILVER_BUCKET = os.environ["SILVER_BUCKET"]
-
-def flatten_entities(decoded_feed):
-    """Turn nested GTFS-RT into flat rows"""
-    rows = []
-    feed_timestamp = decoded_feed.get("header", {}).get("timestamp")
-
-    for entity in decoded_feed.get("entity", []):
-        trip_update = entity.get("trip_update")
-        if not trip_update:
+GOLD_BUCKET = os.environ.get("GOLD_BUCKET")
+REFERENCE_BUCKET = os.environ.get("REFERENCE_BUCKET")
+SCHEDULE_INDEX_KEY = os.environ.get("SCHEDULE_INDEX_KEY", "schedule_index/schedule_index.bin")
+SCHEDULE_INDEX_PATH = "/tmp/schedule_index.bin"
+SCHEDULE_INDEX_TTL = 3600  # how often a warm container checks for a new index
+# "snapshot": every snapshot in full under parquet/; "delta": only changes under delta/
+SILVER_MODE = os.environ.get("SILVER_MODE", "snapshot")
+DELTA_STATE_KEY = os.environ.get("DELTA_STATE_KEY", "delta_state/state.parquet")
+# Delta files wait here until the state that produced them is committed
+DELTA_STAGING_PREFIX = os.environ.get("DELTA_STAGING_PREFIX", "delta_staging/")
+
+# Survive between invocations in a warm container
+_schedule_index = {"index": None, "etag": None, "checked_at": 0.0}
+_delta_state = {"table": None, "etag": None, "published": None}
+
+def get_schedule_index():
+    """Return the cached schedule index, re-downloading only when the S3 object changed."""
+    cached = _schedule_index
+    if cached["index"] is not None and time.time() - cached["checked_at"] < SCHEDULE_INDEX_TTL:
+        return cached["index"]
+
+    try:
+        etag = s3.head_object(Bucket=REFERENCE_BUCKET, Key=SCHEDULE_INDEX_KEY)["ETag"]
+    except s3.exceptions.ClientError as e:
+        print(f"Schedule index unavailable ({e}); skipping gold")
+        return cached["index"]
+
+    if etag != cached["etag"]:
+        s3.download_file(REFERENCE_BUCKET, SCHEDULE_INDEX_KEY, SCHEDULE_INDEX_PATH)
+        cached["index"] = ScheduleIndex.load(SCHEDULE_INDEX_PATH)
+        cached["etag"] = etag
+    cached["checked_at"] = time.time()
+    return cached["index"]
+
+def load_delta_state():
+    """
+    (previous snapshot state, its ETag, (token, delta keys) it still has to
+    publish or None); the cached table if S3 still holds that version, and
+    no pending deltas if this container already published them.
+    """
+    cached = _delta_state
+    try:
+        head = s3.head_object(Bucket=SILVER_BUCKET, Key=DELTA_STATE_KEY)
+    except s3.exceptions.ClientError as e:
+        if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+            raise
+        return None, None, None
+
+    etag = head["ETag"]
+    if etag != cached["etag"]:
+        body = s3.get_object(Bucket=SILVER_BUCKET, Key=DELTA_STATE_KEY)["Body"].read()
+        cached["table"] = pq.read_table(io.BytesIO(body))
+        cached["etag"] = etag
+    metadata = head.get("Metadata", {})
+    token = metadata.get("staged")
+    if not token or token == cached["published"]:
+        return cached["table"], etag, None
+    return cached["table"], etag, (token, metadata["deltas"].split(","))
+
+def staged_key(token, delta_key):
+    return f"{DELTA_STAGING_PREFIX}{token}/{delta_key}"
+
+def publish_deltas(token, delta_keys):
+    """
+    Move a committed state's staged delta files to their delta/ keys.
+
+    Safe to repeat: a file already moved (by the flatten that committed it,
+    or one that loaded the state after it) has no staged copy left.
+    """
+    for delta_key in delta_keys:
+        staged = staged_key(token, delta_key)
+        try:
+            s3.copy_object(Bucket=SILVER_BUCKET, Key=delta_key, CopySource={"Bucket": SILVER_BUCKET, "Key": staged})
+        except s3.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+                raise
             continue
-
-        trip = trip_update.get("trip", {})
-
-        # Skip canceled trips — no stop predictions to flatten
-        if trip.get("schedule_relationship") == "CANCELED":
-            continue
-
-        # Base fields from the trip level
-        trip_info = {
-            "feed_timestamp": feed_timestamp,
-            "route_id": trip.get("route_id"),
-            "start_time": trip.get("start_time"),
-            "start_date": trip.get("start_date"),
-            "direction_id": trip.get("direction_id"),
-            "trip_id": entity.get("id"),
-        }
-
-        # One row per stop_time_update
-        for stu in trip_update.get("stop_time_update", []):
-
-            # Skip stops with no prediction data
-            if stu.get("schedule_relationship") == "NO_DATA":
-                continue
-
-            row = {
-                **trip_info,
-                "stop_id": stu.get("stop_id"),
-                "predicted_arrival": stu.get("arrival", {}).get("time"),
-                "arrival_uncertainty": stu.get("arrival", {}).get("uncertainty"),
-                "predicted_departure": stu.get("departure", {}).get("time"),
-                "departure_uncertainty": stu.get("departure", {}).get("uncertainty"),
-            }
-            rows.append(row)
-
-    return rows
+        s3.delete_object(Bucket=SILVER_BUCKET, Key=staged)
+
+def put_parquet(bucket, key, table, metrics):
+    """Serialize table and PUT it; serialize and s3_put are separate stages."""
+    with metrics.stage("serialize"):
+        body = write_parquet(table)
+    with metrics.stage("s3_put"):
+        response = s3.put_object(Bucket=bucket, Key=key, Body=body, ContentType="application/vnd.apache.parquet")
+    metrics.add("bytes_out", body.getbuffer().nbytes)
+    return response
+
+def write_delta(silver, filename, metrics):
+    """
+    Write the changes since the stored state under delta/, one file per UTC
+    day; returns the keys.
+
+    The conditional state PUT is the commit. Delta files are first written
+    under DELTA_STAGING_PREFIX, which silver_delta does not read, and the
+    state names them in its metadata. They are moved to delta/ only once
+    the state is in: by this flatten, or by the next one to load the state
+    if this one dies first. A flatten that loses the state race deletes its
+    staged files, so a delta diffed against a stale state is never read.
+    """
+    with metrics.stage("delta_state"):
+        state, etag, pending = load_delta_state()
+        if pending:
+            publish_deltas(*pending)
+            _delta_state["published"] = pending[0]
+    with metrics.stage("delta_diff"):
+        state, delta = apply(state, silver)
+    days = split_by_day(delta)
+    if not days:
+        return []
+
+    token = uuid.uuid4().hex
+    delta_keys = []
+    for (year, month, day), rows in days.items():
+        delta_key = f"delta/year={year}/month={month}/day={day}/{filename}"
+        put_parquet(SILVER_BUCKET, staged_key(token, delta_key), rows, metrics)
+        delta_keys.append(delta_key)
+
+    # Only replace the state we diffed against: if another flatten moved it
+    # on meanwhile this fails, and the retry diffs against the new state
+    condition = {"IfMatch": etag} if etag else {"IfNoneMatch": "*"}
+    with metrics.stage("serialize"):
+        body = write_parquet(state)
+    with metrics.stage("s3_put"):
+        try:
+            response = s3.put_object(
+                Bucket=SILVER_BUCKET,
+                Key=DELTA_STATE_KEY,
+                Body=body,
+                ContentType="application/vnd.apache.parquet",
+                Metadata={"staged": token, "deltas": ",".join(delta_keys)},
+                **condition
+            )
+        except s3.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] in ("PreconditionFailed", "ConditionalRequestConflict"):
+                for delta_key in delta_keys:
+                    s3.delete_object(Bucket=SILVER_BUCKET, Key=staged_key(token, delta_key))
+            raise
+    metrics.add("bytes_out", body.getbuffer().nbytes)
+    _delta_state.update(table=state, etag=response["ETag"])
+    with metrics.stage("s3_put"):
+        publish_deltas(token, delta_keys)
+    _delta_state["published"] = token
+    return delta_keys
+
+def get_bronze(bronze_bucket, bronze_key, metrics):
+    """Body of one bronze object (.json, .pb, .pbd or .hslb)."""
+    with metrics.stage("s3_get"):
+        body = s3.get_object(Bucket=bronze_bucket, Key=bronze_key)["Body"].read()
+    metrics.add("bytes_in", len(body))
+    return body
+
+def load_gold_index(metrics):
+    """The schedule index, or None if gold is off or the index is unavailable."""
+    if not (GOLD_BUCKET and REFERENCE_BUCKET):
+        return None
+    with metrics.stage("schedule_index"):
+        return get_schedule_index()
+
+def open_upload(target, key):
+    bucket = SILVER_BUCKET if target == "silver" else GOLD_BUCKET
+    return MultipartUpload(s3, bucket, key, "application/vnd.apache.parquet")
+
+def flatten_feed(feed, body, bronze_key, metrics):
+    """
+    Vehicle positions or service alerts: silver only, under the feed's own
+    prefix, one file per UTC hour. Returns (silver keys, rows, snapshots).
+    """
+    silver, timestamps = feed_table(feed, bronze_key, body, metrics)
+    first, filename = snapshot_key(timestamps, fallback=key_time(bronze_key))
+    silver_keys = []
+    for partition, rows in split_partitions(silver, "feed_timestamp", first):
+        silver_key = f"{feed.silver_prefix}/{partition}/{filename}"
+        put_parquet(SILVER_BUCKET, silver_key, rows, metrics)
+        silver_keys.append(silver_key)
+    return silver_keys, silver.num_rows, len(timestamps)
 
 def lambda_handler(event, context):
-    # Step Functions passes these from Lambda A's output
+    # Step Functions passes these from Lambda A's output, one feed per call
     bronze_bucket = event["bronze_bucket"]
     bronze_key = event["bronze_key"]
-
-    # Read the nested JSON from bronze
-    response = s3.get_object(Bucket=bronze_bucket, Key=bronze_key)
-    decoded_feed = json.loads(response["Body"].read())
-
-    # Flatten
-    rows = flatten_entities(decoded_feed)
-
-    # Write to silver as newline-delimited JSON
+    feed = FEEDS[event.get("feed", TRIP_UPDATES.name)]
+    metrics = Metrics("flatten_data")
     now = datetime.utcnow()
-    silver_key = f"flat/year={now.year}/month={now.strftime('%m')}/day={now.strftime('%d')}/{now.strftime('%H%M%S')}.json"
-
-    body = "\n".join(json.dumps(row) for row in rows)
+    body = get_bronze(bronze_bucket, bronze_key, metrics)
+
+    if feed is not TRIP_UPDATES:
+        silver_keys, row_count, snapshot_count = flatten_feed(feed, body, bronze_key, metrics)
+        metrics.add("rows", row_count)
+        metrics.add("snapshots", snapshot_count)
+        return {
+            "status": "success",
+            "feed": feed.name,
+            "silver_bucket": SILVER_BUCKET,
+            "silver_keys": silver_keys,
+            "row_count": row_count,
+            "snapshot_count": snapshot_count,
+            "timestamp": now.isoformat(),
+            "metrics": metrics.emit(bronze_key=bronze_key, feed=feed.name),
+        }
 
-    s3.put_object(
-        Bucket=SILVER_BUCKET,
-        Key=silver_key,
-        Body=body,
-        ContentType="application/json"
-    )
+    # The delta diff needs the whole object as one table
+    chunk_rows = None if SILVER_MODE == "delta" else CHUNK_ROWS
+    tables, timestamps = bronze_chunks(bronze_key, body, chunk_rows, metrics)
+    snapshot_count = len(timestamps)
+    metrics.add("snapshots", snapshot_count)
+
+    # Keyed by the snapshot's feed time so reprocessing the same bronze
+    # object overwrites instead of duplicating; known before any row is read
+    first, filename = snapshot_key(timestamps, fallback=key_time(bronze_key))
+    # Materialized gold: same partition layout, delays precomputed
+    index = load_gold_index(metrics)
+
+    if SILVER_MODE == "delta":
+        silver = next(tables)
+        delta_keys = write_delta(silver, filename, metrics)
+        keys, row_count = flatten_stream([silver], open_upload, first, filename, index, metrics, silver=False)
+    else:
+        # Typed Parquet, streamed chunk by chunk as it is flattened
+        keys, row_count = flatten_stream(tables, open_upload, first, filename, index, metrics)
+        delta_keys = []
+    metrics.add("rows", row_count)
 
     return {
         "status": "success",
+        "feed": feed.name,
         "silver_bucket": SILVER_BUCKET,
-        "silver_key": silver_key,
-        "row_count": len(rows),
-        "timestamp": now.isoformat()
+        "delta_keys": delta_keys,
+        **keys,
+        "row_count": row_count,
+        "snapshot_count": snapshot_count,
+        "timestamp": now.isoformat(),
+        "metrics": metrics.emit(bronze_key=bronze_key, feed=feed.name),
     }
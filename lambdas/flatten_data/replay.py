@@ -0,0 +1,249 @@
+"""
+Replay archived bronze into silver (and gold) for a range of days.
+
+When the flatten logic changes, for example the CANCELED / NO_DATA filters
+in hsl_common.feed, the silver already written keeps the old behaviour.
+This re-flattens the bronze objects of the given days instead of invoking
+the flatten Lambda once per key:
+
+    python lambdas/flatten_data/replay.py 2026-02-01 2026-02-28 \\
+        --bronze s3://emkidev-bronze-hsl --silver s3://emkidev-silver-hsl
+    python lambdas/flatten_data/replay.py 2026-02-13 --bronze ./data/bronze --silver /tmp/silver \\
+        --gold /tmp/gold --schedule-index schedule_index.bin
+
+Locations are s3://bucket[/prefix] or a local directory laid out like the
+bucket (a mirror). --endpoint-url sends the S3 ones to a stand-in such as
+MinIO or LocalStack.
+
+- Objects are flattened in a pool of --workers processes; parsing is
+  CPU-bound and does not scale on threads.
+- At most --max-inflight objects are between their read and their last
+  write at any time. That bounds the S3 reads in flight and the bytes held
+  in memory.
+- Output keys come from the snapshot, not the clock
+  (hsl_common.silver.snapshot_key), exactly as the flatten Lambda writes
+  them. A replay overwrites what flatten wrote for the same object, and
+  replaying twice writes identical objects.
+
+Only snapshot-mode silver (parquet/) is replayed; delta silver depends on the
+order of the live run. Replaying days written before the hour and route
+bucket layout (hsl_common.partitions) rewrites them in it; the old
+parquet/year=/month=/day=/HHMMSS.parquet objects can be deleted afterwards.
+Gold (performance/, rollups/, sketches/) is written when --gold and
+--schedule-index are given.
+
+The report gives objects, snapshots, rows, bytes and snapshots per second.
+"""
+import argparse
+import io
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Local runs; the common layer is not installed outside Lambda
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "layers" / "common" / "python"))
+
+from hsl_common.bronze import EXTENSIONS, key_time  # noqa: E402
+from hsl_common.flatten import bronze_chunks, flatten_stream  # noqa: E402
+from hsl_common.schedule_index import ScheduleIndex  # noqa: E402
+from hsl_common.silver import snapshot_key  # noqa: E402
+
+WORKERS = 4
+MAX_INFLIGHT = 16
+PROGRESS_EVERY = 100  # objects
+
+
+class LocalStore:
+    """A directory laid out like a bucket."""
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def list(self, prefix):
+        directory = self.root / prefix
+        if not directory.is_dir():
+            return []
+        return sorted(str(path.relative_to(self.root)) for path in directory.rglob("*") if path.is_file())
+
+    def get(self, key):
+        return (self.root / key).read_bytes()
+
+    def put(self, key, body):
+        path = self.root / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.with_name(path.name + ".tmp").write_bytes(body)
+        path.with_name(path.name + ".tmp").replace(path)
+
+
+class S3Store:
+    """A bucket, optionally under a key prefix."""
+
+    def __init__(self, s3, bucket, prefix=""):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def list(self, prefix):
+        keys = []
+        for page in self.s3.get_paginator("list_objects_v2").paginate(Bucket=self.bucket, Prefix=self.prefix + prefix):
+            keys.extend(item["Key"][len(self.prefix):] for item in page.get("Contents", []))
+        return keys
+
+    def get(self, key):
+        return self.s3.get_object(Bucket=self.bucket, Key=self.prefix + key)["Body"].read()
+
+    def put(self, key, body):
+        self.s3.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=body,
+                           ContentType="application/vnd.apache.parquet")
+
+
+def open_store(location, endpoint_url=None):
+    """LocalStore or S3Store for a directory or s3://bucket[/prefix]."""
+    if not location.startswith("s3://"):
+        return LocalStore(location)
+    import boto3
+    bucket, _, prefix = location.removeprefix("s3://").partition("/")
+    s3 = boto3.client("s3", endpoint_url=endpoint_url)
+    return S3Store(s3, bucket, prefix.rstrip("/") + "/" if prefix else "")
+
+
+# Loaded once per worker process
+_schedule_index = None
+
+
+def _init_worker(schedule_index_path):
+    global _schedule_index
+    if schedule_index_path:
+        _schedule_index = ScheduleIndex.load(schedule_index_path)
+
+
+class _Output(io.BytesIO):
+    """In-memory sink for flatten_stream; its bytes land in outputs when it is closed."""
+
+    def __init__(self, outputs, name):
+        super().__init__()
+        self.outputs = outputs
+        self.name = name
+
+    def close(self):
+        if not self.closed:
+            self.outputs[self.name] = self.getvalue()
+        super().close()
+
+
+def flatten_object(key, body):
+    """
+    Flatten one bronze object the way the flatten Lambda does.
+
+    Returns ({(target, key): Parquet bytes}, snapshots, rows), with target
+    "silver" or "gold".
+    """
+    tables, timestamps = bronze_chunks(key, body)
+    first, filename = snapshot_key(timestamps, fallback=key_time(key))
+
+    outputs = {}
+    _, rows = flatten_stream(tables, lambda target, output_key: _Output(outputs, (target, output_key)),
+                             first, filename, _schedule_index)
+    return outputs, len(timestamps), rows
+
+
+def bronze_keys(bronze, start, end):
+    """Bronze object keys of every day from start to end (inclusive), in key order."""
+    keys = []
+    day = start
+    while day <= end:
+        keys.extend(key for key in bronze.list(f"raw/year={day:%Y}/month={day:%m}/day={day:%d}/")
+                    if key.endswith(EXTENSIONS))
+        day += timedelta(days=1)
+    return keys
+
+
+def replay(bronze, targets, keys, workers=WORKERS, max_inflight=MAX_INFLIGHT, schedule_index=None,
+           clock=time.perf_counter):
+    """Re-flatten keys from bronze into targets ({"silver": store, "gold": store}); returns the report."""
+    report = dict.fromkeys(["objects", "snapshots", "rows", "bytes_read", "bytes_written"], 0)
+    failed = {}
+    started = clock()
+
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(schedule_index,)) as processes, \
+            ThreadPoolExecutor(max_inflight) as readers:
+
+        def one(key):
+            # Runs on one of max_inflight threads: read, flatten in a process, write
+            body = bronze.get(key)
+            outputs, snapshots, rows = processes.submit(flatten_object, key, body).result()
+            for (target, output_key), data in outputs.items():
+                targets[target].put(output_key, data)
+            return len(body), sum(len(data) for data in outputs.values()), snapshots, rows
+
+        futures = {readers.submit(one, key): key for key in keys}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                bytes_read, bytes_written, snapshots, rows = future.result()
+            except Exception as e:
+                failed[key] = f"{type(e).__name__}: {e}"
+                print(f"{key} failed: {failed[key]}")
+                continue
+            report["objects"] += 1
+            report["snapshots"] += snapshots
+            report["rows"] += rows
+            report["bytes_read"] += bytes_read
+            report["bytes_written"] += bytes_written
+            if report["objects"] % PROGRESS_EVERY == 0:
+                elapsed = clock() - started
+                print(f"{report['objects']}/{len(keys)} objects, {report['snapshots'] / elapsed:.1f} snapshots/s")
+
+    elapsed = clock() - started
+    report.update(
+        seconds=round(elapsed, 2),
+        snapshots_per_second=round(report["snapshots"] / elapsed, 1) if elapsed else None,
+        rows_per_second=round(report["rows"] / elapsed) if elapsed else None,
+        failed=failed,
+    )
+    return report
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Re-flatten archived bronze into silver (and gold).")
+    parser.add_argument("start", help="first day, YYYY-MM-DD")
+    parser.add_argument("end", nargs="?", help="last day, YYYY-MM-DD (default: start)")
+    parser.add_argument("--bronze", required=True, help="s3://bucket[/prefix] or directory holding raw/")
+    parser.add_argument("--silver", required=True, help="where parquet/ is written")
+    parser.add_argument("--gold", help="where performance/, rollups/ and sketches/ are written")
+    parser.add_argument("--schedule-index", help="schedule_index.bin for gold (see covertToPaquet.py)")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="flatten processes")
+    parser.add_argument("--max-inflight", type=int, default=MAX_INFLIGHT,
+                        help="objects read but not yet written, at most")
+    parser.add_argument("--endpoint-url", help="S3 stand-in for s3:// locations")
+    args = parser.parse_args()
+    if bool(args.gold) != bool(args.schedule_index):
+        parser.error("--gold and --schedule-index go together")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    start = datetime.strptime(args.start, "%Y-%m-%d")
+    end = datetime.strptime(args.end or args.start, "%Y-%m-%d")
+
+    bronze = open_store(args.bronze, args.endpoint_url)
+    targets = {"silver": open_store(args.silver, args.endpoint_url)}
+    if args.gold:
+        targets["gold"] = open_store(args.gold, args.endpoint_url)
+
+    keys = bronze_keys(bronze, start, end)
+    print(f"Replaying {len(keys)} bronze objects from {start:%Y-%m-%d} to {end:%Y-%m-%d} "
+          f"({args.workers} workers, {args.max_inflight} in flight)")
+    report = replay(bronze, targets, keys, args.workers, args.max_inflight, args.schedule_index)
+
+    mb = 1024 * 1024
+    print(f"\n  {report['objects']} objects, {report['snapshots']} snapshots, {report['rows']:,} rows "
+          f"in {report['seconds']:.1f}s")
+    print(f"  {report['snapshots_per_second']} snapshots/s, {report['rows_per_second']:,} rows/s")
+    print(f"  read {report['bytes_read'] / mb:.1f} MB, wrote {report['bytes_written'] / mb:.1f} MB")
+    if report["failed"]:
+        print(f"  {len(report['failed'])} objects failed")
+        sys.exit(1)
@@ -0,0 +1,195 @@
+"""
+Regenerate the daily stats for a range of days.
+
+    python lambdas/generate_stats/backfill.py 2026-02-01 2026-02-28 [--concurrency 4] [--force]
+    aws lambda invoke --function-name hsl-backfill-stats --payload '{"from": "2026-02-01", "to": "2026-02-28"}' out.json
+
+Each day gets its own public/daily/YYYY-MM-DD.json (the latest.json shape
+for that day), has its stop delays started (stop_delays.py) and is merged
+into the dashboard history files. It is then recorded in
+public/daily/index.json, with a signature of the gold objects it
+was computed from and the version of the stats queries. A day whose entry
+matches both is skipped. This means:
+
+- a run that was interrupted continues where it stopped when started again.
+  The index entry is written last, so a day is either recorded complete or
+  redone;
+- after gold is re-materialized (schedule fixes) or a query changes, only
+  the days affected are redone; --force redoes every day in range.
+
+Days run CONCURRENCY at a time, each as one batch of five Athena queries.
+A batch of days stays under Athena's default limit on concurrent queries.
+Stop delays go to STOP_DELAYS_FUNCTION asynchronously, one invocation per
+day, as generate_stats does; run locally without it they are computed in
+the day's worker. Days that are redone skip the result cache, whose
+closed-day entries would be stale. Results are written from the main
+thread; the history files and the index are updated with conditional PUTs
+(handler.update_object), so a scheduled run writing at the same time keeps
+its day too. latest.json is left alone.
+
+The Lambda stops starting new days TIME_MARGIN seconds (QUERY_TIMEOUT
+plus time to write) before its timeout, so every day it starts finishes,
+and returns the days it did not reach under "remaining"; invoke it again
+with the same range to continue.
+"""
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import boto3
+from botocore.config import Config
+
+# Local runs; in Lambda the common layer provides hsl_common
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "layers" / "common" / "python"))
+
+from handler import (  # noqa: E402
+    GOLD_READ_CONCURRENCY,
+    QUERY_TIMEOUT,
+    REGION,
+    build_output,
+    build_queries,
+    day_entry,
+    input_signature,
+    is_current,
+    partition_filter,
+    read_daily_index,
+    record_days,
+    stats_runner,
+    start_propagation,
+    update_history,
+    write_day,
+)
+from hsl_common.metrics import Metrics  # noqa: E402
+
+CONCURRENCY = int(os.environ.get("BACKFILL_CONCURRENCY", "4"))
+# Writing a finished day's files and index entry (with conflict retries)
+WRITE_SECONDS = 60
+# Stop starting days this long before the Lambda timeout: a day started just
+# before then still has its whole query budget and its writes
+TIME_MARGIN = QUERY_TIMEOUT + WRITE_SECONDS
+
+
+def days_between(start, end):
+    days = []
+    day = start
+    while day <= end:
+        days.append(day)
+        day += timedelta(days=1)
+    return days
+
+
+def plan(s3, days, index, force=False, concurrency=CONCURRENCY):
+    """[(day, input signature, redo)] for the days that are not current."""
+    with ThreadPoolExecutor(concurrency) as pool:
+        signatures = list(pool.map(lambda day: input_signature(s3, day), days))
+    todo = []
+    for day, inputs in zip(days, signatures):
+        entry = index["days"].get(f"{day:%Y-%m-%d}")
+        if force or not is_current(entry, inputs):
+            todo.append((day, inputs, force or entry is not None))
+    return todo
+
+
+def run_day(s3, athena, day, redo, metrics):
+    """All stats queries for one day, then start its stop delays; returns (output, results)."""
+    results = athena.run_many(build_queries(partition_filter(day, day)), refresh=redo)
+    start_propagation(s3, day, metrics)
+    return build_output(results, day, day), results
+
+
+def s3_client(concurrency=CONCURRENCY):
+    # Without STOP_DELAYS_FUNCTION each day in flight downloads GOLD_READ_CONCURRENCY gold objects at once
+    return boto3.client("s3", region_name=REGION,
+                        config=Config(max_pool_connections=concurrency * GOLD_READ_CONCURRENCY))
+
+
+def backfill(s3, athena, start, end, concurrency=CONCURRENCY, force=False, should_stop=lambda: False):
+    """Regenerate every day from start to end that is not current; returns a summary."""
+    days = days_between(start, end)
+    index = read_daily_index(s3)
+    pending = plan(s3, days, index, force, concurrency)
+    skipped = len(days) - len(pending)
+    print(f"{len(pending)} of {len(days)} days to generate")
+    metrics = Metrics("backfill_stats")
+
+    done, failed = [], {}
+    with ThreadPoolExecutor(concurrency) as pool:
+        running = {}
+        while pending or running:
+            while pending and len(running) < concurrency and not should_stop():
+                day, inputs, redo = pending.pop(0)
+                running[pool.submit(run_day, s3, athena, day, redo, metrics)] = (day, inputs)
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                day, inputs = running.pop(future)
+                date = f"{day:%Y-%m-%d}"
+                try:
+                    output, results = future.result()
+                except Exception as e:
+                    # Left out of the index, so the next run retries it
+                    failed[date] = str(e)
+                    print(f"{date} failed: {e}")
+                    continue
+                # History and the day file first, the index entry last
+                update_history(s3, {"daily": results["daily"], "hourly": results["hourly"]})
+                key = write_day(s3, day, output)
+                record_days(s3, {date: day_entry(key, inputs, output)})
+                done.append(date)
+                print(f"{date}: {len(output['late_routes'])} late routes")
+
+    return {
+        "done": sorted(done),
+        "skipped": skipped,
+        "failed": failed,
+        "remaining": [f"{day:%Y-%m-%d}" for day, _, _ in pending],
+        "metrics": metrics.emit(days=len(done)),
+    }
+
+
+def lambda_handler(event, context):
+    """Backfill event["from"]..event["to"] (inclusive); event["force"] redoes current days too."""
+    concurrency = int(event.get("concurrency", CONCURRENCY))
+    s3 = s3_client(concurrency)
+    start = datetime.strptime(event["from"], "%Y-%m-%d")
+    end = datetime.strptime(event.get("to", event["from"]), "%Y-%m-%d")
+    summary = backfill(
+        s3,
+        stats_runner(s3),
+        start,
+        end,
+        concurrency=concurrency,
+        force=bool(event.get("force")),
+        should_stop=lambda: context.get_remaining_time_in_millis() / 1000 < TIME_MARGIN,
+    )
+    return {"statusCode": 200, "body": json.dumps(summary)}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Regenerate daily stats for a range of days.")
+    parser.add_argument("start", help="first day, YYYY-MM-DD")
+    parser.add_argument("end", nargs="?", help="last day, YYYY-MM-DD (default: start)")
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY, help="days in flight at once")
+    parser.add_argument("--force", action="store_true", help="redo days that are already current")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    s3 = s3_client(args.concurrency)
+    summary = backfill(
+        s3,
+        stats_runner(s3),
+        datetime.strptime(args.start, "%Y-%m-%d"),
+        datetime.strptime(args.end or args.start, "%Y-%m-%d"),
+        concurrency=args.concurrency,
+        force=args.force,
+    )
+    print(json.dumps(summary, indent=2))
+    sys.exit(1 if summary["failed"] else 0)
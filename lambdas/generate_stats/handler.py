@@ -1,105 +1,281 @@
 """
 Generate daily stats JSON for public dashboard.
-Queries Athena once and writes results to S3.
+Queries Athena once (all queries in parallel) and writes results to S3.
+The window's per-route daily and hourly stats are also added to the
+dashboard's history files (see hsl_common.history).
+
+The window defaults to yesterday; pass {"from": "YYYY-MM-DD", "to": "YYYY-MM-DD"}
+(inclusive) in the event for any other range of days. A one-day window is
+also recorded as public/daily/YYYY-MM-DD.json in the daily index that
+backfill.py maintains. Adding "hours": "HH-HH" (UTC, inclusive) limits each
+day to those hours; the queries then read only those utc_hour partitions
+and the result goes to public/windows/ instead.
+
+A one-day window also starts its stop delays (stop_delays.py).
 """
 import boto3
+import hashlib
+import io
 import json
-import time
 import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from hsl_common import history, propagation
+from hsl_common.athena import ResultCache, S3CacheStore, create_runner
+from hsl_common.metrics import Metrics
+from hsl_common.partitions import day_predicate
+
 REGION = "eu-north-1"
 DATABASE = "hsl_transport"
 WORKGROUP = "primary"
 OUTPUT_BUCKET = os.environ.get("OUTPUT_BUCKET", "emkidev-results-hsl")
 RESULTS_BUCKET = os.environ.get("RESULTS_BUCKET", "emkidev-results-hsl")
+GOLD_BUCKET = os.environ.get("GOLD_BUCKET", "emkidev-gold-hsl")
+# Lambda that writes a day's stop delays (stop_delays.py); unset computes them inline
+STOP_DELAYS_FUNCTION = os.environ.get("STOP_DELAYS_FUNCTION")
+# Gold objects downloaded at once for stop delays
+GOLD_READ_CONCURRENCY = int(os.environ.get("GOLD_READ_CONCURRENCY", "16"))
+# Whole-batch budget, kept below the Lambda timeout so we fail cleanly
+QUERY_TIMEOUT = float(os.environ.get("QUERY_TIMEOUT", "90"))
+# Results of closed days are kept here and never queried again
+RESULT_CACHE_PREFIX = os.environ.get("RESULT_CACHE_PREFIX", "cache/")
+# Routes whose average / percentile delay is above this are listed as late
+LATE_THRESHOLD_MIN = 5
+PERCENTILES = {"p50": 0.5, "p90": 0.9, "p99": 0.99}
+# One stats file per day, and the index of what each was built from
+DAILY_PREFIX = "public/daily/"
+DAILY_INDEX_KEY = f"{DAILY_PREFIX}index.json"
+# Stats of part of each day (the "hours" event option)
+WINDOW_PREFIX = "public/windows/"
+# Attempts at a conditional read-modify-write of a shared file (history, indexes)
+UPDATE_ATTEMPTS = 5
+# S3 errors for a conditional PUT that lost to another writer
+CONFLICT_CODES = ("PreconditionFailed", "ConditionalRequestConflict")
+# Gold prefixes the stats are computed from; a day is current while these are unchanged
+INPUT_PREFIXES = ["rollups/", "sketches/"]
 
 
-def run_athena_query(client, query: str) -> list[dict]:
-    """Execute Athena query and return results as list of dicts."""
-    response = client.start_query_execution(
-        QueryString=query,
-        QueryExecutionContext={"Database": DATABASE},
-        WorkGroup=WORKGROUP,
-        ResultConfiguration={"OutputLocation": f"s3://{RESULTS_BUCKET}/"},
-    )
-    query_id = response["QueryExecutionId"]
-
-    # Wait for completion
-    while True:
-        result = client.get_query_execution(QueryExecutionId=query_id)
-        state = result["QueryExecution"]["Status"]["State"]
-        if state == "SUCCEEDED":
-            break
-        elif state in ("FAILED", "CANCELLED"):
-            raise Exception(f"Query {state}: {result['QueryExecution']['Status'].get('StateChangeReason')}")
-        time.sleep(1)
-
-    # Get results
-    paginator = client.get_paginator("get_query_results")
-    rows = []
-    headers = None
-
-    for page in paginator.paginate(QueryExecutionId=query_id):
-        for i, row in enumerate(page["ResultSet"]["Rows"]):
-            values = [col.get("VarCharValue", "") for col in row["Data"]]
-            if headers is None:
-                headers = values
+def partition_filter(start, end, hours=None):
+    """
+    Partition predicate covering every day from start to end (inclusive).
+
+    hours (UTC hours 0-23) narrows each day to those hours, so only their
+    utc_hour partitions are read.
+    """
+    days = []
+    day = start
+    while day <= end:
+        days.append(day_predicate(day, hours))
+        day += timedelta(days=1)
+    return "(" + " OR ".join(days) + ")"
+
+
+def parse_hours(value):
+    """UTC hours of an "HH-HH" range (inclusive), or None for whole days."""
+    if not value:
+        return None
+    first, _, last = value.partition("-")
+    hours = range(int(first), int(last or first) + 1)
+    if not hours or hours.start < 0 or hours.stop > 24:
+        raise ValueError(f"Bad hours {value!r}; expected HH-HH within 00-23")
+    return list(hours)
+
+
+def read_object(s3, key):
+    """Body of key in the output bucket, or None if it does not exist yet."""
+    return read_versioned(s3, key)[0]
+
+
+def read_versioned(s3, key):
+    """(body, ETag) of key in the output bucket, or (None, None) if it does not exist yet."""
+    try:
+        response = s3.get_object(Bucket=OUTPUT_BUCKET, Key=key)
+    except s3.exceptions.NoSuchKey:
+        return None, None
+    return response["Body"].read(), response["ETag"]
+
+
+def update_object(s3, key, change, content_type, attempts=UPDATE_ATTEMPTS):
+    """
+    Read-modify-write key in the output bucket: change(body or None) returns
+    (new body, value), and update_object returns value.
+
+    The PUT only succeeds if key is unchanged since it was read (IfMatch,
+    or IfNoneMatch for a new key). If another writer (the scheduled run, a
+    backfill) got there first, change is applied again to their version,
+    so neither drops the other's days.
+    """
+    for attempt in range(attempts):
+        body, etag = read_versioned(s3, key)
+        new_body, value = change(body)
+        condition = {"IfMatch": etag} if etag else {"IfNoneMatch": "*"}
+        try:
+            s3.put_object(Bucket=OUTPUT_BUCKET, Key=key, Body=new_body, ContentType=content_type, **condition)
+            return value
+        except s3.exceptions.ClientError as e:
+            if e.response["Error"]["Code"] not in CONFLICT_CODES or attempt == attempts - 1:
+                raise
+            print(f"{key} changed while it was updated; retrying")
+            time.sleep(random.uniform(0, 2 ** attempt))
+
+
+def update_history(s3, rows):
+    """Merge the window's rows ({grain: query rows}) into the monthly history files; returns the months touched."""
+    daily = {}
+    for grain, grain_rows in rows.items():
+        if not grain_rows:
+            continue
+        for month, table in history.split_by_month(history.from_rows(grain_rows, grain)).items():
+
+            def merge(existing, table=table, grain=grain):
+                merged = history.append(pq.read_table(io.BytesIO(existing)) if existing else None, table, grain)
+                return history.write(merged), merged
+
+            merged = update_object(s3, history.month_key(grain, month), merge, "application/vnd.apache.parquet")
+            if grain == "daily":
+                daily[month] = merged
             else:
-                rows.append(dict(zip(headers, values)))
+                daily.setdefault(month, None)
 
-    return rows
+    if daily:
 
+        def index_months(body):
+            index = json.loads(body or "{}")
+            for month, merged in daily.items():
+                if merged is not None:
+                    index = history.update_index(index, month, merged)
+            index["updated_at"] = datetime.now().isoformat()
+            return json.dumps(index, indent=2), index
 
-def lambda_handler(event, context):
-    """Generate stats JSON for public dashboard."""
-    athena = boto3.client("athena", region_name=REGION)
-    s3 = boto3.client("s3", region_name=REGION)
+        update_object(s3, history.INDEX_KEY, index_months, "application/json")
+    return sorted(daily)
 
-    # Use yesterday's date (full 24h of data) or today if specified
-    target_date = datetime.now() - timedelta(days=1)
-    year = target_date.strftime("%Y")
-    month = target_date.strftime("%m")
-    day = target_date.strftime("%d")
 
-    # Query 1: Routes more than 5 minutes late
+def build_queries(window):
+    """{name: SQL} of every stats query over window (a partition_filter predicate)."""
+    # Query 1: Routes more than 5 minutes late, merged from the hourly rollups
     routes_query = f"""
     SELECT
         route_short_name,
-        ROUND(AVG(delay_seconds) / 60.0, 1) as avg_delay_min
-    FROM gold_performance
-    WHERE year = '{year}' AND month = '{month}' AND day = '{day}'
-      AND scheduled_arrival IS NOT NULL
-      AND route_short_name IS NOT NULL
+        ROUND(SUM(delay_sum) / CAST(SUM(delay_count) AS double) / 60.0, 1) as avg_delay_min
+    FROM gold_rollups
+    WHERE {window}
     GROUP BY route_short_name
-    HAVING AVG(delay_seconds) / 60.0 > 5
+    HAVING SUM(delay_sum) / CAST(SUM(delay_count) AS double) / 60.0 > {LATE_THRESHOLD_MIN}
     ORDER BY avg_delay_min DESC
     """
 
-    # Query 2: Time range metadata
+    # Query 3: Delay percentiles per route, merged from the histogram sketches.
+    # A percentile is the first bin whose running count reaches q × total
+    # (the same rule as hsl_common.sketch.quantiles).
+    percentile_columns = ",\n        ".join(
+        f"MIN(CASE WHEN reached >= {q} * total THEN bin_delay END) AS {name}"
+        for name, q in PERCENTILES.items()
+    )
+    percentiles_query = f"""
+    WITH bins AS (
+        SELECT dimension_value AS route_short_name, bin_delay, SUM(bin_count) AS n
+        FROM gold_sketches
+        WHERE dimension = 'route' AND {window}
+        GROUP BY dimension_value, bin_delay
+    ),
+    running AS (
+        SELECT
+            route_short_name,
+            bin_delay,
+            SUM(n) OVER (PARTITION BY route_short_name ORDER BY bin_delay) AS reached,
+            SUM(n) OVER (PARTITION BY route_short_name) AS total
+        FROM bins
+    )
+    SELECT
+        route_short_name,
+        {percentile_columns}
+    FROM running
+    GROUP BY route_short_name
+    """
+
+    # Query 2: Time range metadata. Gold rows keep their snapshot's
+    # feed_timestamp and are written in either SILVER_MODE (the rollups are
+    # hourly sums without snapshot times)
     meta_query = f"""
     SELECT
         MIN(from_unixtime(CAST(feed_timestamp AS bigint) + 7200)) as first_feed,
         MAX(from_unixtime(CAST(feed_timestamp AS bigint) + 7200)) as last_feed,
         COUNT(DISTINCT feed_timestamp) as feed_count
-    FROM silver_realtime
-    WHERE year = '{year}' AND month = '{month}' AND day = '{day}'
+    FROM gold_realtime
+    WHERE {window}
+    """
+
+    # Queries 4 and 5: per-route daily and hourly sums for the history files
+    daily_query = f"""
+    SELECT
+        year, month, day, route_short_name,
+        SUM(delay_count) AS delay_count,
+        SUM(delay_sum) AS delay_sum,
+        SUM(delay_sum_sq) AS delay_sum_sq,
+        MIN(delay_min) AS delay_min,
+        MAX(delay_max) AS delay_max
+    FROM gold_rollups
+    WHERE {window}
+    GROUP BY year, month, day, route_short_name
+    """
+
+    hourly_query = f"""
+    SELECT
+        year, month, day, route_short_name, hour,
+        SUM(delay_count) AS delay_count,
+        SUM(delay_sum) AS delay_sum
+    FROM gold_rollups
+    WHERE {window}
+    GROUP BY year, month, day, route_short_name, hour
     """
 
-    print(f"Generating stats for {year}-{month}-{day}")
+    return {
+        "routes": routes_query,
+        "meta": meta_query,
+        "percentiles": percentiles_query,
+        "daily": daily_query,
+        "hourly": hourly_query,
+    }
+
+
+# Changes whenever a query changes, so days built by older queries are redone
+QUERY_VERSION = hashlib.sha256(json.dumps(build_queries("{window}"), sort_keys=True).encode()).hexdigest()[:12]
 
-    # Run queries
-    routes = run_athena_query(athena, routes_query)
-    meta = run_athena_query(athena, meta_query)
 
-    # Build output
-    output = {
+def build_output(results, start, end, hours=None):
+    """The stats JSON (latest.json / daily file) for results of build_queries over start..end."""
+    routes = results["routes"]
+    meta = results["meta"]
+    dates = f"{start:%Y-%m-%d}" if start == end else f"{start:%Y-%m-%d} – {end:%Y-%m-%d}"
+
+    # One late-route list per percentile, worst first
+    late_by_percentile = {}
+    for name in PERCENTILES:
+        late = [r for r in results["percentiles"] if r[name] / 60.0 > LATE_THRESHOLD_MIN]
+        late.sort(key=lambda r: r[name], reverse=True)
+        late_by_percentile[name] = [
+            {"route": r["route_short_name"], "delay_min": round(r[name] / 60.0, 1)}
+            for r in late
+        ]
+
+    # A window without gold rows still returns one row, of NULLs
+    has_meta = bool(meta) and meta[0]["first_feed"] is not None
+    return {
         "generated_at": datetime.now().isoformat(),
-        "date": f"{year}-{month}-{day}",
+        "date": dates,
+        "window": {"from": f"{start:%Y-%m-%d}", "to": f"{end:%Y-%m-%d}",
+                   **({} if hours is None else {"hours": f"{hours[0]:02d}-{hours[-1]:02d}"})},
         "time_range": {
-            "from": meta[0]["first_feed"][:16] if meta else None,  # YYYY-MM-DD HH:MM
-            "to": meta[0]["last_feed"][:16] if meta else None,
-            "feed_count": int(meta[0]["feed_count"]) if meta else 0,
+            "from": meta[0]["first_feed"][:16] if has_meta else None,  # YYYY-MM-DD HH:MM
+            "to": meta[0]["last_feed"][:16] if has_meta else None,
+            "feed_count": int(meta[0]["feed_count"]) if has_meta else 0,
         },
         "late_routes": [
             {
@@ -107,24 +283,209 @@ def lambda_handler(event, context):
                 "avg_delay_min": float(r["avg_delay_min"])
             }
             for r in routes
-        ]
+        ],
+        "late_routes_by_percentile": late_by_percentile,
     }
 
-    # Write to S3
+
+def read_gold_hours(s3, day, concurrency=GOLD_READ_CONCURRENCY):
+    """
+    The day's gold rows (propagation.COLUMNS), one table per utc_hour
+    partition. An hour's objects are downloaded concurrently, and the next
+    hour's downloads start before this hour is yielded.
+    """
+    paginator = s3.get_paginator("list_objects_v2")
+
+    def read(key):
+        body = s3.get_object(Bucket=GOLD_BUCKET, Key=key)["Body"].read()
+        return pq.read_table(io.BytesIO(body), columns=propagation.COLUMNS)
+
+    def start(pool, hour):
+        partition = f"performance/year={day:%Y}/month={day:%m}/day={day:%d}/utc_hour={hour:02d}/"
+        return [pool.submit(read, item["Key"])
+                for page in paginator.paginate(Bucket=GOLD_BUCKET, Prefix=partition)
+                for item in page.get("Contents", [])]
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        pending = start(pool, 0)
+        for hour in range(24):
+            following = start(pool, hour + 1) if hour < 23 else []
+            tables = [future.result() for future in pending]
+            pending = following
+            if tables:
+                yield pa.concat_tables(tables, promote_options="permissive")
+
+
+def write_propagation(s3, day, metrics):
+    """Compute and write one day's stop delays; returns their key, or None if the day has no gold rows."""
+    with metrics.stage("propagation"):
+        stops = propagation.stop_delays_for_day(read_gold_hours(s3, day))
+    if stops.num_rows == 0:
+        return None
+    key = propagation.day_key(day)
+    body = io.BytesIO()
+    pq.write_table(stops, body, compression="zstd")
+    with metrics.stage("s3_put"):
+        s3.put_object(
+            Bucket=OUTPUT_BUCKET,
+            Key=key,
+            Body=body.getvalue(),
+            ContentType="application/vnd.apache.parquet",
+        )
+    metrics.add("bytes_out", body.tell())
+    return key
+
+
+def start_propagation(s3, day, metrics):
+    """
+    Stop delays for day: handed to STOP_DELAYS_FUNCTION (stop_delays.py)
+    when set, so they get that Lambda's time budget; computed here otherwise.
+    """
+    if not STOP_DELAYS_FUNCTION:
+        key = write_propagation(s3, day, metrics)
+        print(f"Wrote stop delays to s3://{OUTPUT_BUCKET}/{key}" if key else "No gold rows for stop delays")
+        return
+    boto3.client("lambda", region_name=REGION).invoke(
+        FunctionName=STOP_DELAYS_FUNCTION,
+        InvocationType="Event",
+        Payload=json.dumps({"day": f"{day:%Y-%m-%d}"}),
+    )
+    print(f"Started {STOP_DELAYS_FUNCTION} for {day:%Y-%m-%d}")
+
+
+def input_signature(s3, day):
+    """Digest of the gold objects (key, ETag) a day's stats are computed from."""
+    digest = hashlib.sha256()
+    paginator = s3.get_paginator("list_objects_v2")
+    for prefix in INPUT_PREFIXES:
+        partition = f"{prefix}year={day:%Y}/month={day:%m}/day={day:%d}/"
+        for page in paginator.paginate(Bucket=GOLD_BUCKET, Prefix=partition):
+            for item in page.get("Contents", []):
+                digest.update(f"{item['Key']}|{item['ETag']}\n".encode())
+    return digest.hexdigest()[:16]
+
+
+def read_daily_index(s3):
+    return json.loads(read_object(s3, DAILY_INDEX_KEY) or '{"days": {}}')
+
+
+def is_current(entry, inputs):
+    """Whether an index entry was built from these inputs by the current queries."""
+    return entry is not None and entry.get("inputs") == inputs and entry.get("version") == QUERY_VERSION
+
+
+def write_day(s3, day, output):
+    """Write one day's stats file; returns its key."""
+    key = f"{DAILY_PREFIX}{day:%Y-%m-%d}.json"
     s3.put_object(
         Bucket=OUTPUT_BUCKET,
-        Key="public/latest.json",
+        Key=key,
         Body=json.dumps(output, indent=2),
         ContentType="application/json",
     )
+    return key
 
-    print(f"Wrote stats to s3://{OUTPUT_BUCKET}/public/latest.json")
+
+def record_days(s3, entries):
+    """Add {YYYY-MM-DD: entry} to the daily index and write it; the index marks those days done. Returns the index."""
+
+    def add(body):
+        index = json.loads(body or '{"days": {}}')
+        index.setdefault("days", {}).update(entries)
+        index["days"] = dict(sorted(index["days"].items()))
+        index["updated_at"] = datetime.now().isoformat()
+        return json.dumps(index, indent=2), index
+
+    return update_object(s3, DAILY_INDEX_KEY, add, "application/json")
+
+
+def day_entry(key, inputs, output):
+    return {
+        "key": key,
+        "inputs": inputs,
+        "version": QUERY_VERSION,
+        "generated_at": output["generated_at"],
+        "late_routes": len(output["late_routes"]),
+        "feed_count": output["time_range"]["feed_count"],
+    }
+
+
+def stats_runner(s3, timeout=QUERY_TIMEOUT, metrics=None):
+    return create_runner(
+        REGION,
+        output_location=f"s3://{RESULTS_BUCKET}/",
+        database=DATABASE,
+        workgroup=WORKGROUP,
+        timeout=timeout,
+        s3=s3,
+        cache=ResultCache(S3CacheStore(s3, RESULTS_BUCKET, RESULT_CACHE_PREFIX)),
+        metrics=metrics,
+    )
+
+
+def lambda_handler(event, context):
+    """Generate stats JSON for public dashboard."""
+    s3 = boto3.client("s3", region_name=REGION)
+    metrics = Metrics("generate_stats")
+    athena = stats_runner(s3, metrics=metrics)
+
+    # Yesterday (full 24h of data) unless the event asks for another window
+    yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+    start = datetime.strptime(event.get("from", yesterday), "%Y-%m-%d")
+    end = datetime.strptime(event.get("to", event.get("from", yesterday)), "%Y-%m-%d")
+    # {"hours": "06-09"}: only those UTC hours of each day, written apart
+    # from latest.json and left out of the whole-day history and index
+    hours = parse_hours(event.get("hours"))
+    with metrics.stage("s3_list"):
+        inputs = input_signature(s3, start) if start == end and hours is None else None
+
+    print(f"Generating stats for {start:%Y-%m-%d}" + ("" if start == end else f" – {end:%Y-%m-%d}")
+          + ("" if hours is None else f", {hours[0]:02d}-{hours[-1]:02d} UTC"))
+
+    # Run all queries concurrently
+    with metrics.stage("queries"):
+        results = athena.run_many(build_queries(partition_filter(start, end, hours)))
+    metrics.add("rows", sum(len(rows) for rows in results.values()))
+    with metrics.stage("build_output"):
+        output = build_output(results, start, end, hours)
+        body = json.dumps(output, indent=2)
+    routes = output["late_routes"]
+
+    # Write to S3
+    if hours is None:
+        key = "public/latest.json"
+    else:
+        key = f"{WINDOW_PREFIX}{start:%Y-%m-%d}_{end:%Y-%m-%d}_{hours[0]:02d}-{hours[-1]:02d}.json"
+    with metrics.stage("s3_put"):
+        s3.put_object(
+            Bucket=OUTPUT_BUCKET,
+            Key=key,
+            Body=body,
+            ContentType="application/json",
+        )
+    metrics.add("bytes_out", len(body))
+
+    print(f"Wrote stats to s3://{OUTPUT_BUCKET}/{key}")
     print(f"Found {len(routes)} routes >5min late")
 
+    months = []
+    if hours is None:
+        with metrics.stage("history"):
+            months = update_history(s3, {"daily": results["daily"], "hourly": results["hourly"]})
+        print(f"Updated history for {', '.join(months) or 'no months'}")
+
+    if inputs is not None:
+        with metrics.stage("daily_index"):
+            key = write_day(s3, start, output)
+            record_days(s3, {f"{start:%Y-%m-%d}": day_entry(key, inputs, output)})
+        start_propagation(s3, start, metrics)
+
     return {
         "statusCode": 200,
         "body": json.dumps({
             "message": "Stats generated",
-            "late_routes_count": len(routes)
-        })
+            "late_routes_count": len(routes),
+            "history_months": months,
+        }),
+        "metrics": metrics.emit(window=output["window"]),
     }
@@ -0,0 +1,48 @@
+"""
+Write one day's stop delays (hsl_common.propagation) from its gold rows.
+
+    python lambdas/generate_stats/stop_delays.py 2026-02-01
+    aws lambda invoke --function-name hsl-stop-delays --payload '{"day": "2026-02-01"}' out.json
+
+generate_stats and backfill.py hand each day they finish to this Lambda
+asynchronously, so reading a day of gold has its own timeout and memory
+rather than what Athena leaves of theirs.
+"""
+import json
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import boto3
+from botocore.config import Config
+
+# Local runs; in Lambda the common layer provides hsl_common
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "layers" / "common" / "python"))
+
+from handler import GOLD_READ_CONCURRENCY, OUTPUT_BUCKET, REGION, write_propagation  # noqa: E402
+from hsl_common.metrics import Metrics  # noqa: E402
+
+
+def s3_client():
+    # One connection per concurrent gold download
+    return boto3.client("s3", region_name=REGION, config=Config(max_pool_connections=GOLD_READ_CONCURRENCY))
+
+
+def lambda_handler(event, context):
+    """Stop delays for event["day"] (YYYY-MM-DD), yesterday by default."""
+    metrics = Metrics("stop_delays")
+    yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+    day = datetime.strptime(event.get("day", yesterday), "%Y-%m-%d")
+    key = write_propagation(s3_client(), day, metrics)
+    print(f"Wrote stop delays to s3://{OUTPUT_BUCKET}/{key}" if key else f"No gold rows for {day:%Y-%m-%d}")
+    return {
+        "statusCode": 200,
+        "body": json.dumps({"day": f"{day:%Y-%m-%d}", "key": key}),
+        "metrics": metrics.emit(day=f"{day:%Y-%m-%d}"),
+    }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("usage: stop_delays.py YYYY-MM-DD")
+    print(json.dumps(lambda_handler({"day": sys.argv[1]}, None), indent=2))
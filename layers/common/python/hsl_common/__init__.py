@@ -0,0 +1,6 @@
+"""
+Shared code for the HSL pipeline Lambdas, deployed as the hsl-common layer.
+
+Lambda layers are unpacked under /opt/python, so handlers import this as a
+normal package. Local scripts add layers/common/python to sys.path instead.
+"""
@@ -0,0 +1,448 @@
+"""
+Athena query runner shared by generate_stats and the dashboard scripts.
+
+Queries are submitted together and waited on together. One
+batch_get_query_execution call polls every pending query, so two queries
+take as long as the slower one, not the sum of both.
+
+Polling backs off adaptively. It starts fast, because most of our queries
+finish in a second or two, and slows down while nothing changes. The
+interval snaps back whenever a query finishes. A single timeout budget
+covers the whole batch; on expiry the queries still running are stopped
+(so they don't keep scanning) and QueryTimeout is raised.
+
+Results come back as typed row dicts. Given an S3 client, the runner
+reads the result CSV Athena already wrote to the OutputLocation. That is
+one GET instead of a get_query_results call per 1000 rows. Column types come
+from a single MaxResults=1 call. With a ResultCache, queries over closed
+day partitions are answered from the cache without touching Athena. With a
+hsl_common.metrics.Metrics, run_many records its wait and result reads as
+stages, plus the bytes Athena scanned and the cache hits.
+
+The Athena/S3 clients, sleep and clock are all injected, so the runner can
+be driven by stubbed clients in tests without real waiting.
+
+create_runner picks the backend. It returns AthenaRunner by default, or
+hsl_common.local_engine.LocalRunner (DuckDB over local files) when
+HSL_QUERY_BACKEND=duckdb.
+"""
+import hashlib
+import json
+import os
+import re
+import time
+from contextlib import nullcontext
+from datetime import datetime, timedelta, timezone
+
+DATABASE = "hsl_transport"
+WORKGROUP = "primary"
+
+TERMINAL_STATES = ("SUCCEEDED", "FAILED", "CANCELLED")
+
+# batch_get_query_execution accepts at most 50 ids per call
+BATCH_SIZE = 50
+
+INTEGER_TYPES = ("tinyint", "smallint", "integer", "int", "bigint")
+FLOAT_TYPES = ("float", "real", "double", "decimal")
+
+# Partition filters as our queries write them: year = '2026' AND month = '02' AND day = '10'
+PARTITION_PATTERN = re.compile(
+    r"year\s*=\s*'(\d{4})'\s+and\s+(?:\w+\.)?month\s*=\s*'(\d{2})'\s+and\s+(?:\w+\.)?day\s*=\s*'(\d{2})'",
+    re.IGNORECASE,
+)
+
+# Part of every cache key; bump when the shape of cached rows changes
+# (2: NULL strings as None rather than "")
+CACHE_VERSION = 2
+
+# Silver/gold partitions are keyed by UTC snapshot time; a day stops changing
+# once its last snapshot (flattened just after midnight) has landed
+SETTLE_TIME = timedelta(hours=1)
+
+
+class QueryError(Exception):
+    def __init__(self, query_id, state, reason=None):
+        super().__init__(f"Query {query_id} {state}: {reason}" if reason else f"Query {query_id} {state}")
+        self.query_id = query_id
+        self.state = state
+        self.reason = reason
+
+
+class QueryTimeout(QueryError):
+    pass
+
+
+def _converter(athena_type):
+    athena_type = athena_type.lower()
+    if athena_type in INTEGER_TYPES:
+        return int
+    if athena_type in FLOAT_TYPES:
+        return float
+    if athena_type == "boolean":
+        return lambda value: value == "true"
+    return None
+
+
+def convert_row(values, converters):
+    """
+    Typed values for one result row. NULLs come in as None, whatever the
+    type; an empty non-string value is NULL too.
+    """
+    return [
+        None if value is None else value if convert is None else (None if value == "" else convert(value))
+        for value, convert in zip(values, converters)
+    ]
+
+
+# Bytes read from the result CSV at a time
+CSV_CHUNK_BYTES = 64 * 1024
+# One result CSV field: quoted ("" escapes a quote) or bare
+_CSV_FIELD = re.compile(r'"((?:[^"]|"")*)"|([^,\r\n]*)')
+
+
+def parse_csv(lines):
+    """
+    Records of an Athena result CSV, NULLs as None, from its lines (with
+    their line endings) or the whole text.
+
+    Athena quotes every value it writes, an empty string included, and
+    leaves NULLs as empty unquoted fields; csv.reader reads both as "".
+    A quoted value may span lines: a record ends at a line ending outside
+    quotes, i.e. once the record holds an even number of quote characters.
+    """
+    if isinstance(lines, str):
+        lines = lines.splitlines(keepends=True)
+    pending, quotes = [], 0
+    for line in lines:
+        pending.append(line)
+        quotes += line.count('"')
+        if quotes % 2:
+            continue
+        text = "".join(pending)
+        pending, quotes = [], 0
+        yield _csv_record(text.removesuffix("\n").removesuffix("\r"))
+    if pending:
+        yield _csv_record("".join(pending))
+
+
+def _csv_record(text):
+    """Fields of one CSV record (text without its line ending)."""
+    record = []
+    pos = 0
+    while True:
+        match = _CSV_FIELD.match(text, pos)
+        quoted, bare = match.groups()
+        record.append(quoted.replace('""', '"') if quoted is not None else (bare or None))
+        pos = match.end()
+        if pos >= len(text) or text[pos] != ",":
+            return record
+        pos += 1
+
+
+def normalize_sql(query):
+    return " ".join(query.split())
+
+
+def query_partitions(query):
+    """Dates (YYYY-MM-DD) of the year/month/day partitions a query filters on."""
+    return sorted({f"{y}-{m}-{d}" for y, m, d in PARTITION_PATTERN.findall(query)})
+
+
+class LocalCacheStore:
+    """Cache entries as files under a local directory (dashboard)."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def get(self, key):
+        try:
+            with open(os.path.join(self.directory, key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, body):
+        path = os.path.join(self.directory, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            f.write(body)
+        os.replace(path + ".tmp", path)
+
+
+class S3CacheStore:
+    """Cache entries as objects under bucket/prefix (Lambdas)."""
+
+    def __init__(self, s3, bucket, prefix="cache/"):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def get(self, key):
+        try:
+            return self.s3.get_object(Bucket=self.bucket, Key=self.prefix + key)["Body"].read()
+        except self.s3.exceptions.NoSuchKey:
+            return None
+
+    def put(self, key, body):
+        self.s3.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=body, ContentType="application/json")
+
+
+class ResultCache:
+    """
+    Persistent query result cache keyed by normalized SQL and partition.
+
+    Results for queries whose partitions are all closed days never change,
+    so they are kept forever. Anything else (today, no partition filter) is
+    only cached when ttl > 0, and then only for ttl seconds.
+    Entries live at <first partition or "_">/<sha256 of the SQL>.json.
+    """
+
+    def __init__(self, store, ttl=0, settle_time=SETTLE_TIME, now=None):
+        self.store = store
+        self.ttl = ttl
+        self.settle_time = settle_time
+        self.now = now or (lambda: datetime.now(timezone.utc))
+
+    def key(self, query):
+        query = normalize_sql(query)
+        partitions = query_partitions(query)
+        digest = hashlib.sha256(f"{CACHE_VERSION}|{query}|{','.join(partitions)}".encode()).hexdigest()
+        return f"{partitions[0] if partitions else '_'}/{digest}.json"
+
+    def is_closed(self, query):
+        partitions = query_partitions(query)
+        if not partitions:
+            return False
+        last = datetime.strptime(partitions[-1], "%Y-%m-%d").replace(tzinfo=timezone.utc)
+        return self.now() >= last + timedelta(days=1) + self.settle_time
+
+    def get(self, query):
+        body = self.store.get(self.key(query))
+        if body is None:
+            return None
+        entry = json.loads(body)
+        if entry["expires_at"] is not None and entry["expires_at"] < self.now().timestamp():
+            return None
+        return entry["rows"]
+
+    def put(self, query, rows):
+        if self.is_closed(query):
+            expires_at = None
+        elif self.ttl > 0:
+            expires_at = self.now().timestamp() + self.ttl
+        else:
+            return
+        entry = {
+            "query": normalize_sql(query),
+            "partitions": query_partitions(query),
+            "created_at": self.now().isoformat(),
+            "expires_at": expires_at,
+            "rows": rows,
+        }
+        self.store.put(self.key(query), json.dumps(entry).encode())
+
+
+class AthenaRunner:
+    def __init__(self, client, output_location, database=DATABASE, workgroup=WORKGROUP, timeout=90.0,
+                 initial_delay=0.2, max_delay=2.0, backoff=1.5, sleep=time.sleep, clock=time.monotonic,
+                 s3=None, cache=None, metrics=None):
+        self.client = client
+        self.s3 = s3
+        self.cache = cache
+        self.metrics = metrics
+        self.output_location = output_location
+        self.database = database
+        self.workgroup = workgroup
+        self.timeout = timeout
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.backoff = backoff
+        self.sleep = sleep
+        self.clock = clock
+
+    def start(self, query):
+        response = self.client.start_query_execution(
+            QueryString=query,
+            QueryExecutionContext={"Database": self.database},
+            WorkGroup=self.workgroup,
+            ResultConfiguration={"OutputLocation": self.output_location},
+        )
+        return response["QueryExecutionId"]
+
+    def stop(self, query_ids):
+        for query_id in query_ids:
+            try:
+                self.client.stop_query_execution(QueryExecutionId=query_id)
+            except Exception as e:
+                print(f"Could not stop query {query_id}: {e}")
+
+    def poll(self, query_ids):
+        """Current QueryExecution for each id, in batches of BATCH_SIZE."""
+        executions = {}
+        for start in range(0, len(query_ids), BATCH_SIZE):
+            response = self.client.batch_get_query_execution(QueryExecutionIds=query_ids[start:start + BATCH_SIZE])
+            for execution in response.get("QueryExecutions", []):
+                executions[execution["QueryExecutionId"]] = execution
+            for failure in response.get("UnprocessedQueryExecutionIds", []):
+                print(f"Could not poll query {failure['QueryExecutionId']}: {failure.get('ErrorMessage')}")
+        return executions
+
+    def wait(self, query_ids, timeout=None):
+        """
+        Block until every query has succeeded; returns {query_id: QueryExecution}.
+
+        Raises QueryError as soon as any query fails or is cancelled, and
+        QueryTimeout when the budget runs out. Either way the queries that
+        are still running get stopped.
+        """
+        deadline = self.clock() + (self.timeout if timeout is None else timeout)
+        pending = list(query_ids)
+        finished = {}
+        delay = self.initial_delay
+
+        while pending:
+            executions = self.poll(pending)
+            progressed = False
+            for query_id in list(pending):
+                execution = executions.get(query_id)
+                if execution is None:
+                    continue
+                status = execution["Status"]
+                if status["State"] not in TERMINAL_STATES:
+                    continue
+                pending.remove(query_id)
+                progressed = True
+                if status["State"] != "SUCCEEDED":
+                    self.stop(pending)
+                    raise QueryError(query_id, status["State"], status.get("StateChangeReason"))
+                finished[query_id] = execution
+
+            if not pending:
+                break
+
+            remaining = deadline - self.clock()
+            if remaining <= 0:
+                self.stop(pending)
+                raise QueryTimeout(pending[0], "TIMEOUT", f"{len(pending)} queries still running")
+
+            # Poll quickly again after progress, back off while nothing changes
+            delay = self.initial_delay if progressed else min(delay * self.backoff, self.max_delay)
+            self.sleep(min(delay, remaining))
+
+        return finished
+
+    def results(self, query_id, execution=None):
+        """
+        Rows of a finished query as a list of typed dicts.
+
+        SELECTs are read from the result CSV when the runner has an S3
+        client; anything else pages through get_query_results.
+        """
+        if self.s3 is not None and execution is not None and execution.get("StatementType") == "DML":
+            return self.read_csv_results(query_id, execution["ResultConfiguration"]["OutputLocation"])
+
+        paginator = self.client.get_paginator("get_query_results")
+        rows = []
+        headers = None
+        converters = None
+        for page in paginator.paginate(QueryExecutionId=query_id):
+            if converters is None:
+                column_info = page["ResultSet"]["ResultSetMetadata"]["ColumnInfo"]
+                converters = [_converter(column["Type"]) for column in column_info]
+            for row in page["ResultSet"]["Rows"]:
+                # NULLs have no VarCharValue
+                values = [col.get("VarCharValue") for col in row["Data"]]
+                if headers is None:
+                    headers = values
+                else:
+                    rows.append(dict(zip(headers, convert_row(values, converters))))
+        return rows
+
+    def column_types(self, query_id):
+        """[(name, athena type)] for a finished query; one small API call."""
+        response = self.client.get_query_results(QueryExecutionId=query_id, MaxResults=1)
+        return [(column["Name"], column["Type"]) for column in response["ResultSet"]["ResultSetMetadata"]["ColumnInfo"]]
+
+    def read_csv_results(self, query_id, output_location):
+        """Stream <OutputLocation> (the result CSV) from S3 into typed row dicts."""
+        columns = self.column_types(query_id)
+        names = [name for name, _ in columns]
+        converters = [_converter(athena_type) for _, athena_type in columns]
+
+        bucket, key = output_location.removeprefix("s3://").split("/", 1)
+        body = self.s3.get_object(Bucket=bucket, Key=key)["Body"]
+        # Line by line, so the CSV is never in memory whole; lines split at
+        # a newline byte, which never falls inside a UTF-8 character
+        lines = (line.decode("utf-8") for line in body.iter_lines(CSV_CHUNK_BYTES, keepends=True))
+        records = parse_csv(lines)
+        next(records, None)  # header row
+        return [dict(zip(names, convert_row(values, converters))) for values in records]
+
+    def run_many(self, queries, timeout=None, refresh=False):
+        """
+        Run several queries concurrently.
+
+        queries is a list of SQL strings or a {name: sql} dict; the results
+        (lists of row dicts) come back in the same shape. Cached results are
+        used where available and only the rest is sent to Athena. refresh
+        sends everything to Athena and overwrites the cached results (for
+        closed days whose data was rebuilt).
+        """
+        named = queries if isinstance(queries, dict) else dict(enumerate(queries))
+        results = {}
+        if self.cache is not None and not refresh:
+            for name, query in named.items():
+                rows = self.cache.get(query)
+                if rows is not None:
+                    results[name] = rows
+
+        query_ids = {}
+        try:
+            for name, query in named.items():
+                if name not in results:
+                    query_ids[name] = self.start(query)
+        except Exception:
+            self.stop(list(query_ids.values()))
+            raise
+
+        with self._stage("athena_wait"):
+            executions = self.wait(list(query_ids.values()), timeout)
+        with self._stage("athena_results"):
+            for name, query_id in query_ids.items():
+                results[name] = self.results(query_id, executions[query_id])
+                if self.cache is not None:
+                    self.cache.put(named[name], results[name])
+        if self.metrics is not None:
+            self.metrics.add("queries", len(query_ids))
+            self.metrics.add("cache_hits", len(named) - len(query_ids))
+            self.metrics.add("bytes_scanned", sum(
+                execution.get("Statistics", {}).get("DataScannedInBytes", 0) for execution in executions.values()
+            ))
+        return results if isinstance(queries, dict) else [results[i] for i in range(len(queries))]
+
+    def run(self, query, timeout=None):
+        return self.run_many([query], timeout)[0]
+
+    def _stage(self, name):
+        return self.metrics.stage(name) if self.metrics is not None else nullcontext()
+
+
+def create_runner(region, output_location, backend=None, data_root=None, **options):
+    """
+    Query runner for the configured backend.
+
+    backend defaults to $HSL_QUERY_BACKEND ("athena" or "duckdb"). The
+    DuckDB backend reads mirrored buckets under data_root
+    ($HSL_LOCAL_DATA, default ./data). options go to AthenaRunner; an S3
+    client is created for it unless one is passed.
+    """
+    backend = backend or os.environ.get("HSL_QUERY_BACKEND", "athena")
+    if backend == "duckdb":
+        from hsl_common.local_engine import LocalRunner
+        return LocalRunner(data_root or os.environ.get("HSL_LOCAL_DATA", "data"))
+    if backend != "athena":
+        raise ValueError(f"Unknown query backend: {backend}")
+
+    import boto3
+    options.setdefault("s3", boto3.client("s3", region_name=region))
+    return AthenaRunner(boto3.client("athena", region_name=region), output_location, **options)
@@ -0,0 +1,228 @@
+"""
+Bronze object formats: compression codecs and the indexed snapshot container.
+
+Bronze keeps the protobuf bytes HSL served. Objects come in three shapes,
+told apart by extension:
+
+- .pb    one uncompressed snapshot (fetch with BRONZE_CODEC=none)
+- .pbd   length-delimited snapshots, uncompressed (early collector batches)
+- .hslb  the container below: one or more snapshots, each compressed on its
+         own, with an index at the end
+
+Container layout (little-endian):
+
+    header   "HSLB", version u8, codec u8
+    frames   compressed snapshots, back to back
+    index    per frame: header.timestamp i64 (-1 if unset), offset u64,
+             stored length u32, raw length u32
+    footer   index offset u64, frame count u32, "HSLB"
+
+Frames are compressed independently, so one snapshot can be read with two
+range GETs (footer + index, then the frame) and a single decompression
+(Container.from_s3). Readers never need to know the codec in advance.
+
+Codecs: none, gzip (stdlib, readable by any tool) and zstd. zstd goes through
+pyarrow, which is already in the dependencies layer. It compresses about 10x
+faster than gzip at a similar ratio.
+
+read_snapshots() turns any bronze object except legacy .json into a list of
+serialized FeedMessages; read_columns() flattens any bronze object, .json
+included, into silver columns. open_snapshots() is the lazy form for
+streaming: container frames are decompressed only as they are iterated.
+"""
+import gzip
+import json
+import re
+import struct
+from contextlib import nullcontext
+from datetime import datetime, timezone
+
+from hsl_common.feed import (
+    empty_columns,
+    feed_to_columns,
+    flatten_entities,
+    header_timestamp,
+    iter_frames,
+    parse_feed,
+    rows_to_columns,
+)
+
+MAGIC = b"HSLB"
+VERSION = 1
+EXTENSION = ".hslb"
+CONTENT_TYPE = "application/octet-stream"
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# Bronze formats flatten can read, legacy .json included
+EXTENSIONS = (".json", ".pb", ".pbd", EXTENSION)
+_KEY_TIME = re.compile(r"year=(\d{4})/month=(\d{2})/day=(\d{2})/(\d{6})")
+
+_HEADER = struct.Struct("<4sBB")
+_ENTRY = struct.Struct("<qQII")
+_FOOTER = struct.Struct("<QI4s")
+
+
+def _zstd_codec():
+    import pyarrow as pa
+    return pa.Codec("zstd", compression_level=ZSTD_LEVEL)
+
+
+def _zstd_compress(raw):
+    return _zstd_codec().compress(raw, asbytes=True)
+
+
+def _zstd_decompress(data, raw_length):
+    return _zstd_codec().decompress(data, decompressed_size=raw_length, asbytes=True)
+
+
+# name → (id stored in the container, compress(raw), decompress(data, raw_length))
+CODECS = {
+    "none": (0, bytes, lambda data, raw_length: bytes(data)),
+    "gzip": (1, lambda raw: gzip.compress(raw, GZIP_LEVEL, mtime=0), lambda data, raw_length: gzip.decompress(data)),
+    "zstd": (2, _zstd_compress, _zstd_decompress),
+}
+_CODEC_NAMES = {codec_id: name for name, (codec_id, _, _) in CODECS.items()}
+
+
+def encode_container(snapshots, codec="zstd"):
+    """Container bytes holding snapshots (serialized FeedMessages) in order."""
+    codec_id, compress, _ = CODECS[codec]
+    parts = [_HEADER.pack(MAGIC, VERSION, codec_id)]
+    offset = _HEADER.size
+    index = []
+    for snapshot in snapshots:
+        frame = compress(snapshot)
+        timestamp = header_timestamp(snapshot)
+        index.append(_ENTRY.pack(-1 if timestamp is None else timestamp, offset, len(frame), len(snapshot)))
+        parts.append(frame)
+        offset += len(frame)
+    parts.extend(index)
+    parts.append(_FOOTER.pack(offset, len(snapshots), MAGIC))
+    return b"".join(parts)
+
+
+def encode_bronze(snapshots, codec="zstd"):
+    """(extension, body) for a bronze object holding snapshots."""
+    if codec == "none" and len(snapshots) == 1:
+        return ".pb", snapshots[0]
+    return EXTENSION, encode_container(snapshots, codec)
+
+
+class Container:
+    """Index of a container; snapshots are read and decompressed one at a time."""
+
+    def __init__(self, read_range, size):
+        """read_range(start, end) returns bytes [start, end) of an object of size bytes."""
+        self.read_range = read_range
+        header = _HEADER.unpack(read_range(0, _HEADER.size))
+        footer = _FOOTER.unpack(read_range(size - _FOOTER.size, size))
+        if header[0] != MAGIC or footer[2] != MAGIC:
+            raise ValueError("Not an HSLB bronze container")
+        if header[1] != VERSION:
+            raise ValueError(f"Unsupported HSLB container version {header[1]}")
+        self.codec = _CODEC_NAMES[header[2]]
+        index_offset, count = footer[0], footer[1]
+        index = read_range(index_offset, index_offset + count * _ENTRY.size)
+        self.entries = [_ENTRY.unpack_from(index, i * _ENTRY.size) for i in range(count)]
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(lambda start, end: data[start:end], len(data))
+
+    @classmethod
+    def from_s3(cls, s3, bucket, key):
+        """Reads only the footer and index now, and each frame when it is asked for."""
+        size = s3.head_object(Bucket=bucket, Key=key)["ContentLength"]
+
+        def read_range(start, end):
+            response = s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end - 1}")
+            return response["Body"].read()
+
+        return cls(read_range, size)
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def timestamps(self):
+        """header.timestamp per snapshot (None if unset), without reading any frame."""
+        return [None if timestamp < 0 else timestamp for timestamp, _, _, _ in self.entries]
+
+    def snapshot(self, i):
+        """Serialized FeedMessage i."""
+        _, offset, length, raw_length = self.entries[i]
+        return CODECS[self.codec][2](self.read_range(offset, offset + length), raw_length)
+
+    def __iter__(self):
+        return (self.snapshot(i) for i in range(len(self)))
+
+
+def read_snapshots(key, body):
+    """Serialized FeedMessages in a bronze object (.pb, .pbd or .hslb)."""
+    if key.endswith(EXTENSION):
+        return list(Container.from_bytes(body))
+    if key.endswith(".pbd"):
+        return [bytes(frame) for frame in iter_frames(body)]
+    if key.endswith(".pb"):
+        return [body]
+    raise ValueError(f"Unknown bronze format: {key}")
+
+
+def open_snapshots(key, body):
+    """
+    (snapshots, header timestamps) for a .pb, .pbd or .hslb body.
+
+    Nothing is decompressed or copied up front. A container yields its frames
+    one at a time as it is iterated, and .pbd frames are views into body.
+    """
+    if key.endswith(EXTENSION):
+        container = Container.from_bytes(body)
+        return container, container.timestamps
+    if key.endswith(".pbd"):
+        snapshots = list(iter_frames(body))
+    elif key.endswith(".pb"):
+        snapshots = [body]
+    else:
+        raise ValueError(f"Unknown bronze format: {key}")
+    return snapshots, [header_timestamp(snapshot) for snapshot in snapshots]
+
+
+def read_columns(key, body, metrics=None):
+    """
+    (silver columns, snapshot count) for a bronze object of any format.
+
+    With a hsl_common.metrics.Metrics, decompress, decode and flatten are
+    timed as separate stages.
+    """
+    stage = metrics.stage if metrics is not None else lambda name: nullcontext()
+
+    # Bronze objects written before the protobuf switch hold MessageToDict JSON
+    if key.endswith(".json"):
+        with stage("decode"):
+            decoded = json.loads(body)
+        with stage("flatten"):
+            return rows_to_columns(flatten_entities(decoded)), 1
+
+    with stage("decompress"):
+        snapshots = read_snapshots(key, body)
+    columns = empty_columns()
+    for snapshot in snapshots:
+        with stage("decode"):
+            feed = parse_feed(snapshot)
+        with stage("flatten"):
+            if len(snapshots) == 1:
+                return feed_to_columns(feed), 1
+            for name, values in feed_to_columns(feed).items():
+                columns[name].extend(values)
+    return columns, len(snapshots)
+
+
+def key_time(key):
+    """UTC time in a bronze key (raw/year=/month=/day=/HHMMSS.ext), or None."""
+    match = _KEY_TIME.search(key)
+    if match is None:
+        return None
+    year, month, day, clock = match.groups()
+    return datetime.strptime(f"{year}{month}{day}{clock}", "%Y%m%d%H%M%S").replace(tzinfo=timezone.utc)
@@ -0,0 +1,205 @@
+"""
+Change-data-capture silver: store only the stop predictions that changed.
+
+Consecutive snapshots are mostly identical, so in delta mode (SILVER_MODE=delta
+in flatten_data) silver stores changes instead of whole snapshots. The
+previous snapshot is kept as state, one row per (trip_id, stop_id,
+occurrence). occurrence numbers repeat visits of a stop within one trip (loop
+lines); it is 0 for almost every row. Each new snapshot is diffed against it:
+
+- I  a prediction that was not there before
+- U  a prediction whose values changed (trip fields, arrival, departure)
+- D  a prediction that disappeared (the row carries its last values)
+- S  checkpoint: the whole state, written for the first snapshot of each UTC
+     day (or when there is no state)
+
+Every change is stamped valid_from = the snapshot's feed_timestamp. A row is
+valid until the next change for the same key, or until the next checkpoint.
+Because of the checkpoints, a day's partition is enough to rebuild any moment
+of that day. as_of(deltas, t) does that: take the latest checkpoint at or
+before t and the changes after it, keep the latest change per key, and drop
+deletions. The result equals the latest silver snapshot at or before t,
+feed_timestamp included: it is the newest valid_from, the snapshot's own
+time. (A snapshot identical to the one before it leaves no rows, so it
+reads as that earlier one.)
+
+Missing trip_id/stop_id are stored as "" (they are join keys); as_of turns
+them back into nulls.
+
+Keep DELTA_SCHEMA in sync with the silver_delta table in terraform/athena.tf.
+"""
+import sys
+from datetime import datetime, timezone
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from hsl_common.feed import SILVER_COLUMNS
+from hsl_common.silver import SILVER_SCHEMA
+
+KEY = ["trip_id", "stop_id", "occurrence"]
+
+# Compared between snapshots; a difference in any of them is an update
+VALUE_COLUMNS = [name for name in SILVER_COLUMNS if name not in ("feed_timestamp", "trip_id", "stop_id")]
+
+INSERT, UPDATE, DELETE, CHECKPOINT = "I", "U", "D", "S"
+
+DELTA_SCHEMA = pa.schema([
+    ("valid_from", pa.int64()),
+    ("op", pa.dictionary(pa.int32(), pa.string())),
+    ("trip_id", pa.string()),
+    ("stop_id", pa.dictionary(pa.int32(), pa.string())),
+    ("occurrence", pa.int32()),
+    *[SILVER_SCHEMA.field(name) for name in VALUE_COLUMNS],
+])
+
+# Previous snapshot, as stored between invocations: silver plus occurrence
+STATE_SCHEMA = SILVER_SCHEMA.append(pa.field("occurrence", pa.int32()))
+
+
+def _plain(table):
+    """Dictionary columns decoded to their value type (joins and comparisons need it)."""
+    for i, field in enumerate(table.schema):
+        if pa.types.is_dictionary(field.type):
+            table = table.set_column(i, field.name, table[field.name].cast(field.type.value_type))
+    return table
+
+
+def to_state(snapshot):
+    """One silver snapshot → state rows: plain types, keys filled, occurrence numbered."""
+    snapshot = _plain(snapshot.select(list(SILVER_COLUMNS)))
+    for name in ("trip_id", "stop_id"):
+        snapshot = snapshot.set_column(snapshot.schema.get_field_index(name), name,
+                                       pc.fill_null(snapshot[name], ""))
+
+    # n-th appearance of the same (trip_id, stop_id), in feed order
+    trips = pc.dictionary_encode(snapshot["trip_id"]).combine_chunks().indices.to_numpy()
+    stops = pc.dictionary_encode(snapshot["stop_id"]).combine_chunks().indices.to_numpy()
+    pair = trips.astype(np.int64) << 32 | stops.astype(np.int64)
+    order = np.argsort(pair, kind="stable")
+    sorted_pair = pair[order]
+    starts = np.r_[True, sorted_pair[1:] != sorted_pair[:-1]]
+    position = np.arange(len(order))
+    group_start = np.maximum.accumulate(np.where(starts, position, 0))
+    occurrence = np.empty(len(order), dtype=np.int32)
+    occurrence[order] = position - group_start
+    return snapshot.append_column("occurrence", pa.array(occurrence, pa.int32()))
+
+
+def _differs(old, new):
+    """Null-aware inequality."""
+    equal = pc.equal(old, new)
+    both_null = pc.and_(pc.is_null(old), pc.is_null(new))
+    return pc.invert(pc.or_(pc.fill_null(equal, False), both_null))
+
+
+def _delta_rows(table, op, valid_from):
+    n = table.num_rows
+    columns = {
+        "valid_from": pa.array(np.full(n, valid_from, dtype=np.int64)),
+        "op": pa.array(op) if not isinstance(op, str) else pa.array([op] * n),
+    }
+    columns.update({name: table[name] for name in KEY + VALUE_COLUMNS})
+    return pa.table(columns)
+
+
+def diff(previous, current, checkpoint=False):
+    """
+    Changes from state previous to state current (both from to_state, current
+    not empty), stamped with current's feed_timestamp. A checkpoint (or no
+    previous state) emits every current row as S.
+    """
+    valid_from = current["feed_timestamp"][0].as_py()
+    if previous is None or checkpoint:
+        return _delta_rows(current, CHECKPOINT, valid_from)
+
+    old = previous.select(KEY + VALUE_COLUMNS).append_column("present", pa.array(np.ones(previous.num_rows, bool)))
+    new = current.select(KEY + VALUE_COLUMNS).append_column("present", pa.array(np.ones(current.num_rows, bool)))
+    joined = old.join(new, keys=KEY, join_type="full outer", left_suffix="_old", right_suffix="_new",
+                      coalesce_keys=True)
+
+    in_old = pc.is_valid(joined["present_old"]).to_numpy(zero_copy_only=False)
+    in_new = pc.is_valid(joined["present_new"]).to_numpy(zero_copy_only=False)
+    changed = np.zeros(joined.num_rows, dtype=bool)
+    for name in VALUE_COLUMNS:
+        changed |= _differs(joined[f"{name}_old"], joined[f"{name}_new"]).to_numpy(zero_copy_only=False)
+
+    deleted = in_old & ~in_new
+    op = np.select([~in_old & in_new, deleted, in_old & in_new & changed], [INSERT, DELETE, UPDATE], "")
+    keep = op != ""
+    deleted_mask = pa.array(deleted)
+    values = {name: pc.if_else(deleted_mask, joined[f"{name}_old"], joined[f"{name}_new"]) for name in VALUE_COLUMNS}
+    rows = pa.table({**{name: joined[name] for name in KEY}, **values}).filter(pa.array(keep))
+    return _delta_rows(rows, op[keep].tolist(), valid_from)
+
+
+def _utc_day(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).date()
+
+
+def apply(state, silver):
+    """
+    Advance state through every snapshot in silver (several for collector
+    batches), oldest first. Returns (new state, delta table in DELTA_SCHEMA).
+
+    Snapshots not newer than the state are skipped, so re-running a bronze
+    object changes nothing.
+    """
+    deltas = []
+    state_time = state["feed_timestamp"][0].as_py() if state is not None and state.num_rows else None
+    for timestamp in sorted(pc.unique(silver["feed_timestamp"]).drop_null().to_pylist()):
+        if state_time is not None and timestamp <= state_time:
+            continue
+        current = to_state(silver.filter(pc.equal(silver["feed_timestamp"], timestamp)))
+        new_day = state_time is None or _utc_day(timestamp) != _utc_day(state_time)
+        deltas.append(diff(state, current, checkpoint=new_day))
+        state, state_time = current, timestamp
+
+    if not deltas:
+        return state, DELTA_SCHEMA.empty_table()
+    return state, pa.concat_tables(deltas).cast(DELTA_SCHEMA)
+
+
+def split_by_day(delta):
+    """{(year, month, day): rows} by the UTC day of valid_from; a day's rows start with its checkpoint."""
+    days = {}
+    valid_from = delta["valid_from"].to_numpy()
+    day_numbers = valid_from // 86400
+    for day_number in np.unique(day_numbers):
+        day = _utc_day(int(day_number) * 86400)
+        days[(f"{day.year}", f"{day.month:02d}", f"{day.day:02d}")] = delta.filter(pa.array(day_numbers == day_number))
+    return days
+
+
+def as_of(deltas, timestamp):
+    """Silver snapshot (SILVER_SCHEMA) at timestamp, rebuilt from delta tables of that day."""
+    tables = [table.select(DELTA_SCHEMA.names) for table in deltas if table.num_rows]
+    table = _plain(pa.concat_tables(tables, promote_options="permissive")) if tables else _plain(DELTA_SCHEMA.empty_table())
+    table = table.filter(pc.less_equal(table["valid_from"], timestamp))
+
+    checkpoints = table.filter(pc.equal(table["op"], CHECKPOINT))["valid_from"]
+    if len(checkpoints):
+        table = table.filter(pc.greater_equal(table["valid_from"], pc.max(checkpoints)))
+
+    latest = table.group_by(KEY, use_threads=False).aggregate([("valid_from", "max")])
+    latest = latest.rename_columns([*KEY, "valid_from"])
+    current = table.join(latest, keys=KEY + ["valid_from"], join_type="inner")
+    current = current.filter(pc.not_equal(current["op"], DELETE)).sort_by([(name, "ascending") for name in KEY])
+
+    columns = {name: current[name] for name in SILVER_COLUMNS if name != "feed_timestamp"}
+    for name in ("trip_id", "stop_id"):
+        columns[name] = pc.if_else(pc.equal(columns[name], ""), pa.scalar(None, pa.string()), columns[name])
+    # The snapshot current is from, not the time asked for
+    snapshot_time = pc.max(table["valid_from"]).as_py() if table.num_rows else timestamp
+    columns["feed_timestamp"] = pa.array(np.full(current.num_rows, snapshot_time, dtype=np.int64))
+    return pa.table({name: columns[name] for name in SILVER_COLUMNS}).cast(SILVER_SCHEMA)
+
+
+if __name__ == "__main__":
+    # python -m hsl_common.delta <day directory of delta Parquet> <unix timestamp> [out.parquet]
+    snapshot = as_of([pq.read_table(sys.argv[1])], int(sys.argv[2]))
+    print(f"{snapshot.num_rows:,} predictions as of {datetime.fromtimestamp(int(sys.argv[2]), timezone.utc):%Y-%m-%d %H:%M:%S} UTC")
+    if len(sys.argv) > 3:
+        pq.write_table(snapshot, sys.argv[3])
@@ -0,0 +1,310 @@
+"""
+GTFS-RT trip updates → flat silver rows.
+
+There are two ways in:
+- feed_to_columns walks the gtfs_realtime_pb2 objects once and fills one list
+  per silver column. This is the normal path for protobuf bronze objects.
+- flatten_entities walks the MessageToDict form. It is kept for the JSON
+  bronze objects written before bronze switched to raw protobuf.
+
+Both apply the same filters (skip CANCELED trips and NO_DATA stops) and
+produce the same rows. Columns hold native Python values; MessageToDict
+renders int64 fields as strings, so rows_to_columns converts those back.
+
+The collector batches many snapshots into one bronze object (.pbd): each
+FeedMessage prefixed with its varint length, the standard protobuf
+length-delimited framing (see encode_frames / iter_frames).
+
+iter_entities reads a serialized FeedMessage one entity at a time, straight
+off the wire format, and column_chunks uses it to flatten any number of
+snapshots in pieces of about chunk_rows rows. Only one chunk of Python values
+exists at a time, whatever the size of the feed.
+"""
+import json
+from google.protobuf.message import DecodeError
+from google.transit import gtfs_realtime_pb2
+
+SILVER_COLUMNS = (
+    "feed_timestamp",
+    "route_id",
+    "start_time",
+    "start_date",
+    "direction_id",
+    "trip_id",
+    "stop_id",
+    "predicted_arrival",
+    "arrival_uncertainty",
+    "predicted_departure",
+    "departure_uncertainty",
+)
+
+# int64 fields in the GTFS-RT proto (strings in MessageToDict output)
+INT64_COLUMNS = ("feed_timestamp", "predicted_arrival", "predicted_departure")
+
+TRIP_COLUMNS = SILVER_COLUMNS[:6]
+
+_CANCELED = gtfs_realtime_pb2.TripDescriptor.CANCELED
+_NO_DATA = gtfs_realtime_pb2.TripUpdate.StopTimeUpdate.NO_DATA
+
+
+def parse_feed(binary_data):
+    """Parse raw GTFS-RT bytes into a FeedMessage."""
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.ParseFromString(binary_data)
+    return feed
+
+
+def _varint(value):
+    out = bytearray()
+    while value > 0x7F:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _read_varint(data, position):
+    """(value, position after it) for the varint starting at position."""
+    value = shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, position
+        shift += 7
+
+
+def encode_frames(payloads):
+    """Length-delimited concatenation of serialized messages."""
+    return b"".join(_varint(len(payload)) + payload for payload in payloads)
+
+
+def iter_frames(data):
+    """Yield each serialized message of a length-delimited buffer."""
+    view = memoryview(data)
+    position = 0
+    while position < len(view):
+        length, position = _read_varint(view, position)
+        yield view[position:position + length]
+        position += length
+
+
+def header_timestamp(binary_data):
+    """
+    header.timestamp of a serialized FeedMessage, or None if unset.
+
+    Serializers write fields in order, so the header (field 1) normally comes
+    first and is parsed alone without decoding the entities. Anything else
+    falls back to a full parse. A corrupt or truncated body raises
+    DecodeError.
+    """
+    if binary_data[:1] == b"\x0a":
+        try:
+            length, position = _read_varint(binary_data, 1)
+        except IndexError:
+            raise DecodeError("Truncated FeedMessage header") from None
+        header = gtfs_realtime_pb2.FeedHeader()
+        header.ParseFromString(bytes(binary_data[position:position + length]))
+    else:
+        header = parse_feed(binary_data).header
+    return _optional(header, "timestamp")
+
+
+def empty_columns():
+    return {name: [] for name in SILVER_COLUMNS}
+
+
+def _optional(message, field):
+    return getattr(message, field) if message.HasField(field) else None
+
+
+def _skip_field(data, position, wire_type):
+    """Position after the value of a field of wire_type starting at position."""
+    if wire_type == 0:
+        return _read_varint(data, position)[1]
+    if wire_type == 1:
+        return position + 8
+    if wire_type == 2:
+        length, position = _read_varint(data, position)
+        return position + length
+    if wire_type == 5:
+        return position + 4
+    raise ValueError(f"Unsupported protobuf wire type {wire_type}")
+
+
+def iter_entities(binary_data):
+    """
+    Yield the FeedEntities of a serialized FeedMessage one at a time.
+
+    The message is walked at the wire level and each entity (field 2) is
+    parsed on its own, so the whole FeedMessage is never materialized.
+    """
+    data = memoryview(binary_data)
+    position = 0
+    while position < len(data):
+        tag, position = _read_varint(data, position)
+        field, wire_type = tag >> 3, tag & 7
+        if field == 2 and wire_type == 2:
+            length, position = _read_varint(data, position)
+            entity = gtfs_realtime_pb2.FeedEntity()
+            entity.ParseFromString(data[position:position + length])
+            position += length
+            yield entity
+        else:
+            position = _skip_field(data, position, wire_type)
+
+
+def column_chunks(snapshots, chunk_rows):
+    """
+    Silver columns for serialized FeedMessages, in chunks of about chunk_rows rows.
+
+    A chunk ends on an entity boundary once it holds chunk_rows rows, so
+    chunks can span snapshots. Concatenated, they equal feed_to_columns
+    applied to each snapshot in turn. With chunk_rows None everything is
+    one chunk.
+    """
+    columns = empty_columns()
+    for snapshot in snapshots:
+        feed_timestamp = header_timestamp(snapshot)
+        for entity in iter_entities(snapshot):
+            entities_to_columns((entity,), feed_timestamp, columns)
+            if chunk_rows is not None and len(columns["trip_id"]) >= chunk_rows:
+                yield columns
+                columns = empty_columns()
+    if columns["trip_id"]:
+        yield columns
+
+
+def feed_to_columns(feed):
+    """Flatten a FeedMessage into {column: [values]}, one entry per stop prediction."""
+    return entities_to_columns(feed.entity, _optional(feed.header, "timestamp"))
+
+
+def entities_to_columns(entities, feed_timestamp, columns=None):
+    """Append the stop predictions of entities (FeedEntity messages) to columns; returns them."""
+    columns = columns if columns is not None else empty_columns()
+    stop_id = columns["stop_id"].append
+    predicted_arrival = columns["predicted_arrival"].append
+    arrival_uncertainty = columns["arrival_uncertainty"].append
+    predicted_departure = columns["predicted_departure"].append
+    departure_uncertainty = columns["departure_uncertainty"].append
+    trip_columns = [columns[name] for name in TRIP_COLUMNS]
+
+    for entity in entities:
+        if not entity.HasField("trip_update"):
+            continue
+
+        trip_update = entity.trip_update
+        trip = trip_update.trip
+
+        # Skip canceled trips — no stop predictions to flatten
+        if trip.schedule_relationship == _CANCELED:
+            continue
+
+        kept = 0
+        for stu in trip_update.stop_time_update:
+
+            # Skip stops with no prediction data
+            if stu.schedule_relationship == _NO_DATA:
+                continue
+
+            stop_id(_optional(stu, "stop_id"))
+            if stu.HasField("arrival"):
+                predicted_arrival(_optional(stu.arrival, "time"))
+                arrival_uncertainty(_optional(stu.arrival, "uncertainty"))
+            else:
+                predicted_arrival(None)
+                arrival_uncertainty(None)
+            if stu.HasField("departure"):
+                predicted_departure(_optional(stu.departure, "time"))
+                departure_uncertainty(_optional(stu.departure, "uncertainty"))
+            else:
+                predicted_departure(None)
+                departure_uncertainty(None)
+            kept += 1
+
+        if not kept:
+            continue
+
+        # Trip-level fields repeat once per kept stop
+        trip_values = (
+            feed_timestamp,
+            _optional(trip, "route_id"),
+            _optional(trip, "start_time"),
+            _optional(trip, "start_date"),
+            _optional(trip, "direction_id"),
+            entity.id,
+        )
+        for column, value in zip(trip_columns, trip_values):
+            column.extend([value] * kept)
+
+    return columns
+
+
+def flatten_entities(decoded_feed):
+    """Turn nested GTFS-RT (MessageToDict form) into flat rows"""
+    rows = []
+    feed_timestamp = decoded_feed.get("header", {}).get("timestamp")
+
+    for entity in decoded_feed.get("entity", []):
+        trip_update = entity.get("trip_update")
+        if not trip_update:
+            continue
+
+        trip = trip_update.get("trip", {})
+
+        # Skip canceled trips — no stop predictions to flatten
+        if trip.get("schedule_relationship") == "CANCELED":
+            continue
+
+        # Base fields from the trip level
+        trip_info = {
+            "feed_timestamp": feed_timestamp,
+            "route_id": trip.get("route_id"),
+            "start_time": trip.get("start_time"),
+            "start_date": trip.get("start_date"),
+            "direction_id": trip.get("direction_id"),
+            "trip_id": entity.get("id"),
+        }
+
+        # One row per stop_time_update
+        for stu in trip_update.get("stop_time_update", []):
+
+            # Skip stops with no prediction data
+            if stu.get("schedule_relationship") == "NO_DATA":
+                continue
+
+            row = {
+                **trip_info,
+                "stop_id": stu.get("stop_id"),
+                "predicted_arrival": stu.get("arrival", {}).get("time"),
+                "arrival_uncertainty": stu.get("arrival", {}).get("uncertainty"),
+                "predicted_departure": stu.get("departure", {}).get("time"),
+                "departure_uncertainty": stu.get("departure", {}).get("uncertainty"),
+            }
+            rows.append(row)
+
+    return rows
+
+
+def rows_to_columns(rows):
+    """Convert flatten_entities rows into the columnar form used by feed_to_columns."""
+    columns = empty_columns()
+    for name in SILVER_COLUMNS:
+        values = [row.get(name) for row in rows]
+        if name in INT64_COLUMNS:
+            values = [None if v is None else int(v) for v in values]
+        columns[name] = values
+    return columns
+
+
+def columns_to_ndjson(columns):
+    """Serialize columns as NDJSON in the silver layout (int64 fields as strings)."""
+    values = []
+    for name in SILVER_COLUMNS:
+        column = columns[name]
+        if name in INT64_COLUMNS:
+            column = [None if v is None else str(v) for v in column]
+        values.append(column)
+    return "\n".join(json.dumps(dict(zip(SILVER_COLUMNS, row))) for row in zip(*values))
@@ -0,0 +1,215 @@
+"""
+The GTFS-RT feeds the pipeline ingests, and silver for the two besides trip updates.
+
+HSL publishes three realtime feeds. Each one has its own bronze prefix,
+silver prefix and Athena table:
+
+  feed               bronze             silver             table
+  trip_updates       raw/               parquet/           silver_realtime
+  vehicle_positions  vehicle_positions/ vehicle_positions/ silver_vehicle_positions
+  service_alerts     service_alerts/    service_alerts/    silver_service_alerts
+
+Trip updates keep the prefixes they had before the other feeds were added.
+Their flatten (hsl_common.feed, hsl_common.flatten) also feeds gold.
+
+Vehicle positions flatten to one row per vehicle. Service alerts flatten to
+one row per informed entity (route, stop or trip), or one row for an alert
+that names none. Both are small (a few thousand rows), so a snapshot is
+flattened whole.
+
+Rows of all three join on (route_id, direction_id, start_date, start_time),
+the trip key the schedule index also uses. HSL leaves trip_id out of
+TripDescriptor, so it is often empty outside trip updates.
+
+Keep VEHICLE_SCHEMA and ALERT_SCHEMA in sync with silver_vehicle_positions
+and silver_service_alerts in terraform/athena.tf.
+"""
+import pyarrow as pa
+from google.transit import gtfs_realtime_pb2
+
+from hsl_common.feed import feed_to_columns
+from hsl_common.silver import SILVER_SCHEMA
+
+BASE_URL = "https://realtime.hsl.fi/realtime"
+# Alert texts come in fi, sv and en; silver keeps one
+ALERT_LANGUAGE = "en"
+
+VEHICLE_SCHEMA = pa.schema([
+    ("feed_timestamp", pa.int64()),
+    ("vehicle_timestamp", pa.int64()),     # when the vehicle reported its position
+    ("vehicle_id", pa.string()),
+    ("vehicle_label", pa.string()),
+    ("route_id", pa.dictionary(pa.int32(), pa.string())),
+    ("direction_id", pa.int32()),
+    ("start_time", pa.string()),
+    ("start_date", pa.string()),
+    ("trip_id", pa.string()),
+    ("latitude", pa.float32()),
+    ("longitude", pa.float32()),
+    ("bearing", pa.float32()),
+    ("speed", pa.float32()),               # metres per second
+    ("current_stop_sequence", pa.int32()),
+    ("stop_id", pa.dictionary(pa.int32(), pa.string())),
+    ("current_status", pa.dictionary(pa.int32(), pa.string())),    # INCOMING_AT | STOPPED_AT | IN_TRANSIT_TO
+    ("occupancy_status", pa.dictionary(pa.int32(), pa.string())),
+])
+
+ALERT_SCHEMA = pa.schema([
+    ("feed_timestamp", pa.int64()),
+    ("alert_id", pa.string()),
+    ("cause", pa.dictionary(pa.int32(), pa.string())),
+    ("effect", pa.dictionary(pa.int32(), pa.string())),
+    ("severity_level", pa.dictionary(pa.int32(), pa.string())),
+    ("active_start", pa.int64()),          # earliest active period start; null if open
+    ("active_end", pa.int64()),            # latest active period end; null if open
+    ("route_id", pa.dictionary(pa.int32(), pa.string())),
+    ("direction_id", pa.int32()),
+    ("stop_id", pa.dictionary(pa.int32(), pa.string())),
+    ("trip_id", pa.string()),
+    ("start_time", pa.string()),
+    ("start_date", pa.string()),
+    ("header_text", pa.string()),
+    ("description_text", pa.string()),
+])
+
+_VehiclePosition = gtfs_realtime_pb2.VehiclePosition
+_Alert = gtfs_realtime_pb2.Alert
+
+
+def _optional(message, field):
+    return getattr(message, field) if message.HasField(field) else None
+
+
+def _enum(message, field, enum):
+    return enum.Name(getattr(message, field)) if message.HasField(field) else None
+
+
+def _translation(translated, language=ALERT_LANGUAGE):
+    """The text in language, else the first one given (None if there is none)."""
+    texts = translated.translation
+    for text in texts:
+        if text.language == language:
+            return text.text
+    return texts[0].text if texts else None
+
+
+def _period_bounds(periods):
+    """(earliest start, latest end) of active periods; a missing bound is open (None)."""
+    if not periods:
+        return None, None
+    starts = [period.start for period in periods if period.HasField("start")]
+    ends = [period.end for period in periods if period.HasField("end")]
+    return (min(starts) if len(starts) == len(periods) else None,
+            max(ends) if len(ends) == len(periods) else None)
+
+
+def vehicle_positions_to_columns(feed):
+    """Flatten a vehicle positions FeedMessage into {column: [values]}, one entry per vehicle."""
+    columns = {name: [] for name in VEHICLE_SCHEMA.names}
+    feed_timestamp = _optional(feed.header, "timestamp")
+    for entity in feed.entity:
+        if not entity.HasField("vehicle"):
+            continue
+        vehicle = entity.vehicle
+        trip = vehicle.trip
+        position = vehicle.position if vehicle.HasField("position") else None
+        row = (
+            feed_timestamp,
+            _optional(vehicle, "timestamp"),
+            _optional(vehicle.vehicle, "id") or entity.id,
+            _optional(vehicle.vehicle, "label"),
+            _optional(trip, "route_id"),
+            _optional(trip, "direction_id"),
+            _optional(trip, "start_time"),
+            _optional(trip, "start_date"),
+            _optional(trip, "trip_id"),
+            position.latitude if position else None,
+            position.longitude if position else None,
+            _optional(position, "bearing") if position else None,
+            _optional(position, "speed") if position else None,
+            _optional(vehicle, "current_stop_sequence"),
+            _optional(vehicle, "stop_id"),
+            _enum(vehicle, "current_status", _VehiclePosition.VehicleStopStatus),
+            _enum(vehicle, "occupancy_status", _VehiclePosition.OccupancyStatus),
+        )
+        for name, value in zip(VEHICLE_SCHEMA.names, row):
+            columns[name].append(value)
+    return columns
+
+
+def alerts_to_columns(feed):
+    """Flatten a service alerts FeedMessage into {column: [values]}, one entry per informed entity."""
+    columns = {name: [] for name in ALERT_SCHEMA.names}
+    feed_timestamp = _optional(feed.header, "timestamp")
+    for entity in feed.entity:
+        if not entity.HasField("alert"):
+            continue
+        alert = entity.alert
+        active_start, active_end = _period_bounds(alert.active_period)
+        common = (
+            feed_timestamp,
+            entity.id,
+            _enum(alert, "cause", _Alert.Cause),
+            _enum(alert, "effect", _Alert.Effect),
+            _enum(alert, "severity_level", _Alert.SeverityLevel),
+            active_start,
+            active_end,
+        )
+        texts = (_translation(alert.header_text), _translation(alert.description_text))
+        # An alert without informed entities still gets its row
+        for informed in alert.informed_entity or [gtfs_realtime_pb2.EntitySelector()]:
+            trip = informed.trip
+            row = common + (
+                _optional(informed, "route_id"),
+                _optional(informed, "direction_id"),
+                _optional(informed, "stop_id"),
+                _optional(trip, "trip_id"),
+                _optional(trip, "start_time"),
+                _optional(trip, "start_date"),
+            ) + texts
+            for name, value in zip(ALERT_SCHEMA.names, row):
+                columns[name].append(value)
+    return columns
+
+
+class Feed:
+    """One GTFS-RT feed: where it is fetched from and where its bronze and silver go."""
+
+    def __init__(self, name, url, bronze_prefix, silver_prefix, schema, to_columns, timeout, required=False):
+        self.name = name
+        self.url = url
+        self.bronze_prefix = bronze_prefix
+        self.silver_prefix = silver_prefix
+        self.schema = schema
+        self.to_columns = to_columns    # FeedMessage → {column: [values]}
+        self.timeout = timeout          # seconds, per request
+        self.required = required        # a failed fetch fails the invocation
+
+    def bronze_key(self, moment, extension):
+        return f"{self.bronze_prefix}/year={moment.year}/month={moment:%m}/day={moment:%d}/{moment:%H%M%S}{extension}"
+
+    def to_table(self, feed):
+        return pa.Table.from_pydict(self.to_columns(feed), schema=self.schema)
+
+
+FEEDS = {
+    feed.name: feed for feed in (
+        Feed("trip_updates", f"{BASE_URL}/trip-updates/v2/hsl", "raw", "parquet",
+             SILVER_SCHEMA, feed_to_columns, timeout=20, required=True),
+        Feed("vehicle_positions", f"{BASE_URL}/vehicle-positions/v2/hsl", "vehicle_positions", "vehicle_positions",
+             VEHICLE_SCHEMA, vehicle_positions_to_columns, timeout=10),
+        Feed("service_alerts", f"{BASE_URL}/service-alerts/v2/hsl", "service_alerts", "service_alerts",
+             ALERT_SCHEMA, alerts_to_columns, timeout=10),
+    )
+}
+TRIP_UPDATES = FEEDS["trip_updates"]
+
+
+def selected_feeds(names):
+    """Feeds for a comma-separated list of names ("" or None: all of them)."""
+    if not names:
+        return list(FEEDS.values())
+    unknown = [name for name in names.split(",") if name.strip() not in FEEDS]
+    if unknown:
+        raise ValueError(f"Unknown feeds {unknown}; known: {sorted(FEEDS)}")
+    return [FEEDS[name.strip()] for name in names.split(",")]
@@ -0,0 +1,235 @@
+"""
+Streaming flatten: bronze snapshots → silver (and gold) Parquet in chunks.
+
+A batched bronze object holds several snapshots. Flattening it whole keeps
+the decompressed snapshots, every parsed FeedMessage, the Python column
+lists and the Arrow tables in memory at the same time, and the Parquet body
+on top of that. Here the data moves through in chunks instead:
+
+- snapshots are decompressed one at a time (bronze.open_snapshots) and
+  parsed one FeedEntity at a time (feed.column_chunks)
+- every CHUNK_ROWS rows become one silver Arrow table, split by hour and
+  route bucket (hsl_common.partitions) into one row group per partition,
+  each written to its partition's sink as soon as it is flattened
+- with a schedule index, each chunk's gold rows are written the same way;
+  rollups and sketches are merged over the chunks (exact, see rollup.py
+  and sketch.py) and written at the end
+
+A sink is any writable file object, usually an upload.MultipartUpload, so
+memory holds one chunk plus at most one part per open object, whatever the
+size of the bronze object. A partition's file from an object of one chunk
+(a 15-minute snapshot) is byte-for-byte what flattening its rows whole
+produces.
+
+Legacy .json bronze is still flattened whole, as a single chunk, and so are
+vehicle positions and service alerts (feed_table), which are small.
+"""
+import os
+from contextlib import nullcontext
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from hsl_common.bronze import open_snapshots, read_columns
+from hsl_common.feed import column_chunks, empty_columns, parse_feed
+from hsl_common.gold import GOLD_SCHEMA, compute_gold
+from hsl_common.partitions import split_partitions
+from hsl_common.rollup import compute_rollup, merge_rollups
+from hsl_common.silver import COMPRESSION, SILVER_SCHEMA, columns_to_table
+from hsl_common.sketch import SKETCH_SCHEMA, compute_sketches, merge_sketches
+
+CHUNK_ROWS = int(os.environ.get("FLATTEN_CHUNK_ROWS", "50000"))
+
+# Result names of the keys written, by prefix
+KEY_NAMES = {"parquet": "silver_keys", "performance": "gold_keys", "rollups": "rollup_keys", "sketches": "sketch_keys"}
+
+
+def _stage(metrics):
+    return metrics.stage if metrics is not None else lambda name: nullcontext()
+
+
+def silver_chunks(snapshots, chunk_rows=CHUNK_ROWS, metrics=None):
+    """
+    Silver Arrow tables of about chunk_rows rows (None: a single table) for
+    serialized FeedMessages.
+
+    At least one table is yielded, empty if nothing survived the filters.
+    "flatten" covers decompressing and parsing too: they happen entity by
+    entity, interleaved with it.
+    """
+    stage = _stage(metrics)
+    chunks = column_chunks(snapshots, chunk_rows)
+    yielded = False
+    while True:
+        with stage("flatten"):
+            columns = next(chunks, None)
+        if columns is None:
+            break
+        with stage("to_arrow"):
+            table = columns_to_table(columns)
+        yielded = True
+        yield table
+    if not yielded:
+        yield columns_to_table(empty_columns())
+
+
+def bronze_chunks(key, body, chunk_rows=CHUNK_ROWS, metrics=None):
+    """
+    (silver tables, feed timestamps) for a bronze object of any format.
+
+    The timestamps (one per snapshot) are known before the tables, which
+    are produced lazily, are iterated; silver.snapshot_key takes them.
+    """
+    if key.endswith(".json"):
+        columns, _ = read_columns(key, body, metrics)
+        with _stage(metrics)("to_arrow"):
+            table = columns_to_table(columns)
+        # One snapshot
+        first = min((timestamp for timestamp in columns["feed_timestamp"] if timestamp is not None), default=None)
+        return iter([table]), [first]
+    snapshots, timestamps = open_snapshots(key, body)
+    return silver_chunks(snapshots, chunk_rows, metrics), timestamps
+
+
+def feed_table(feed, key, body, metrics=None):
+    """
+    (silver table, feed timestamps) for a bronze object of a feed other than
+    trip updates (an hsl_common.feeds.Feed), flattened whole.
+    """
+    stage = _stage(metrics)
+    snapshots, timestamps = open_snapshots(key, body)
+    tables = []
+    for snapshot in snapshots:
+        with stage("decode"):
+            message = parse_feed(snapshot)
+        with stage("flatten"):
+            tables.append(feed.to_table(message))
+    if len(tables) == 1:
+        return tables[0], timestamps
+    return (pa.concat_tables(tables) if tables else feed.schema.empty_table()), timestamps
+
+
+def _merge_sketches(sketches):
+    merged = merge_sketches(sketches, keys=("dimension", "dimension_value", "hour"))
+    return merged.cast(SKETCH_SCHEMA)
+
+
+class _PartitionedOutput:
+    """
+    One output prefix: a ParquetWriter per partition, each opened when the
+    first rows for its partition arrive (with their schema if schema is None).
+    """
+
+    def __init__(self, open_sink, target, prefix, schema, filename, stage):
+        self.open_sink = open_sink
+        self.target = target
+        self.prefix = prefix
+        self.schema = schema
+        self.filename = filename
+        self.stage = stage
+        self.sinks = {}
+        self.writers = {}
+
+    def write(self, parts):
+        """Append [(partition, rows)] (split_partitions) as one row group per partition."""
+        for partition, rows in parts:
+            if partition not in self.writers:
+                sink = self.open_sink(self.target, f"{self.prefix}/{partition}/{self.filename}")
+                self.sinks[partition] = sink
+                schema = self.schema or rows.schema
+                self.writers[partition] = pq.ParquetWriter(sink, schema, compression=COMPRESSION)
+            with self.stage("serialize"):
+                self.writers[partition].write_table(rows)
+            _send_full_parts(self.sinks[partition], self.stage)
+
+    def close(self, metrics=None):
+        """Finish every file; returns their keys, in partition order."""
+        with self.stage("serialize"):
+            for writer in self.writers.values():
+                writer.close()
+        for sink in self.sinks.values():
+            if metrics is not None:
+                metrics.add("bytes_out", sink.tell())
+            with self.stage("s3_put"):
+                sink.close()
+        return [f"{self.prefix}/{partition}/{self.filename}" for partition in sorted(self.sinks)]
+
+    def abort(self):
+        for sink in self.sinks.values():
+            if hasattr(sink, "abort"):
+                sink.abort()
+
+
+def flatten_stream(tables, open_sink, first, filename, index=None, metrics=None, silver=True):
+    """
+    Write silver tables as row groups of parquet/{partition}/{filename}, one
+    file per hour and route bucket partition the rows fall in
+    (partitions.split_partitions; rows without a feed_timestamp go to the
+    hour of first, unix seconds).
+
+    With a ScheduleIndex, gold rows go to performance/ the same way, and the
+    rollup and sketches of all chunks to rollups/ and sketches/, by hour.
+    silver=False writes gold only (delta mode writes its own silver).
+    open_sink(target, key) returns the file object to write ("silver" or
+    "gold", key) to. Sinks are closed here, or aborted (if they can be) when
+    anything fails.
+
+    Returns ({silver_keys, gold_keys, rollup_keys, sketch_keys}, rows); a
+    list is empty when nothing was written to that prefix.
+    """
+    stage = _stage(metrics)
+    outputs = {}
+    if silver:
+        outputs["parquet"] = _PartitionedOutput(open_sink, "silver", "parquet", SILVER_SCHEMA, filename, stage)
+    summaries = {}
+    if index is not None:
+        outputs["performance"] = _PartitionedOutput(open_sink, "gold", "performance", GOLD_SCHEMA, filename, stage)
+        # Written once, from the rollup and sketches merged over every chunk
+        summaries = {
+            "rollups": _PartitionedOutput(open_sink, "gold", "rollups", None, filename, stage),
+            "sketches": _PartitionedOutput(open_sink, "gold", "sketches", None, filename, stage),
+        }
+
+    rows = 0
+    rollups = []
+    sketches = []
+    try:
+        for table in tables:
+            rows += table.num_rows
+            chunk = {"parquet": table}
+            if index is not None:
+                with stage("delay_join"):
+                    gold = compute_gold(table, index)
+                    rollups.append(compute_rollup(gold))
+                    sketches.append(compute_sketches(gold))
+                chunk["performance"] = gold
+            for prefix, output in outputs.items():
+                with stage("partition"):
+                    parts = split_partitions(chunk[prefix], "feed_timestamp", first, "route_id")
+                output.write(parts)
+
+        if index is not None:
+            # One chunk keeps its rollup and sketches as computed
+            merged = {
+                "rollups": rollups[0] if len(rollups) == 1 else merge_rollups(rollups),
+                "sketches": sketches[0] if len(sketches) == 1 else _merge_sketches(sketches),
+            }
+            for prefix, output in summaries.items():
+                with stage("partition"):
+                    parts = split_partitions(merged[prefix], "hour", first)
+                output.write(parts)
+
+        keys = {name: [] for name in KEY_NAMES.values()}
+        for prefix, output in {**outputs, **summaries}.items():
+            keys[KEY_NAMES[prefix]] = output.close(metrics)
+    except BaseException:
+        for output in {**outputs, **summaries}.values():
+            output.abort()
+        raise
+    return keys, rows
+
+
+def _send_full_parts(sink, stage):
+    if hasattr(sink, "send_full_parts"):
+        with stage("s3_put"):
+            sink.send_full_parts()
@@ -0,0 +1,124 @@
+"""
+Materialized gold rows: silver snapshot + schedule index → delay per prediction.
+
+This is the gold_performance view computed once per snapshot instead of on
+every query. Everything is vectorized over the snapshot's columns:
+- scheduled arrival and stop_sequence come from one ScheduleIndex.lookup
+- route_short_name / stop_name are resolved per dictionary value, not per row
+- delay is predicted_arrival minus the scheduled time on the trip's service
+  day (start_date), so trips running past midnight come out right
+
+Keep GOLD_SCHEMA in sync with the gold_realtime table in terraform/athena.tf.
+"""
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from hsl_common.rollup import compute_rollup
+from hsl_common.sketch import compute_sketches
+
+try:
+    HELSINKI = ZoneInfo("Europe/Helsinki")
+except ZoneInfoNotFoundError:
+    # Minimal runtimes may ship without tzdata; fall back to the winter offset
+    HELSINKI = timezone(timedelta(hours=2))
+
+GOLD_SCHEMA = pa.schema([
+    ("feed_timestamp", pa.int64()),
+    ("route_id", pa.dictionary(pa.int32(), pa.string())),
+    ("route_short_name", pa.dictionary(pa.int32(), pa.string())),
+    ("trip_id", pa.string()),
+    ("direction_id", pa.int32()),
+    ("stop_id", pa.dictionary(pa.int32(), pa.string())),
+    ("stop_name", pa.dictionary(pa.int32(), pa.string())),
+    ("stop_sequence", pa.int32()),
+    ("scheduled_arrival", pa.int32()),   # seconds after service-day midnight
+    ("predicted_arrival", pa.int64()),   # unix seconds (UTC)
+    ("delay_seconds", pa.int32()),
+    ("arrival_uncertainty", pa.int32()),
+])
+
+
+def service_day_start(start_date):
+    """Unix time of a GTFS service day's "midnight" (noon minus 12h, local time)."""
+    try:
+        day = datetime.strptime(start_date, "%Y%m%d")
+    except (TypeError, ValueError):
+        return None
+    noon = datetime(day.year, day.month, day.day, 12, tzinfo=HELSINKI)
+    return int(noon.timestamp()) - 12 * 3600
+
+
+def _dictionary(column):
+    column = column.combine_chunks() if isinstance(column, pa.ChunkedArray) else column
+    if not pa.types.is_dictionary(column.type):
+        column = pc.dictionary_encode(column)
+    return column
+
+
+def _rename_dictionary(column, names):
+    """Replace each dictionary value with names[value], keeping the original where unknown (COALESCE)."""
+    column = _dictionary(column)
+    values = column.dictionary.to_pylist()
+    renamed = pa.array([names.get(value) or value for value in values], type=pa.string())
+    return pa.DictionaryArray.from_arrays(column.indices, renamed)
+
+
+def _numpy(column, fill, dtype):
+    column = column.combine_chunks() if isinstance(column, pa.ChunkedArray) else column
+    valid = column.is_valid().to_numpy(zero_copy_only=False)
+    values = column.fill_null(fill).to_numpy(zero_copy_only=False).astype(dtype)
+    return values, valid
+
+
+def compute_gold(silver, index):
+    """Turn a silver table (SILVER_SCHEMA) into gold rows (GOLD_SCHEMA)."""
+    arrival_seconds, stop_sequence, found = index.lookup(
+        silver["route_id"], silver["direction_id"], silver["start_time"], silver["stop_id"]
+    )
+
+    # Service day start per distinct start_date, then gathered per row
+    start_dates = _dictionary(silver["start_date"])
+    day_starts = [service_day_start(value) for value in start_dates.dictionary.to_pylist()]
+    day_start_table = np.array([-1 if v is None else v for v in day_starts] + [-1], dtype=np.int64)
+    day_start = day_start_table[start_dates.indices.fill_null(-1).to_numpy(zero_copy_only=False).astype(np.int64)]
+
+    predicted, has_prediction = _numpy(silver["predicted_arrival"], 0, np.int64)
+    has_delay = found & has_prediction & (day_start >= 0)
+    delay = np.where(has_delay, predicted - (day_start + arrival_seconds), 0)
+
+    route_names = dict(zip(index.routes, index.route_names))
+    stop_names = dict(zip(index.stops, index.stop_names))
+
+    return pa.Table.from_arrays(
+        [
+            silver["feed_timestamp"],
+            silver["route_id"],
+            _rename_dictionary(silver["route_id"], route_names),
+            silver["trip_id"],
+            silver["direction_id"],
+            silver["stop_id"],
+            _rename_dictionary(silver["stop_id"], stop_names),
+            pa.array(stop_sequence, type=pa.int32(), mask=~found),
+            pa.array(arrival_seconds, type=pa.int32(), mask=~found),
+            silver["predicted_arrival"],
+            pa.array(delay, type=pa.int32(), mask=~has_delay),
+            silver["arrival_uncertainty"],
+        ],
+        schema=GOLD_SCHEMA,
+    )
+
+
+def gold_outputs(silver, index):
+    """{gold bucket prefix: table} for one snapshot: gold rows, their rollup and sketches."""
+    gold = compute_gold(silver, index)
+    return {
+        "performance": gold,
+        # Per route/direction/hour sums, so aggregates don't rescan gold
+        "rollups": compute_rollup(gold),
+        # Per route/stop delay histograms, for percentiles
+        "sketches": compute_sketches(gold),
+    }
@@ -0,0 +1,146 @@
+"""
+Append-only per-route delay history for the public dashboard.
+
+latest.json only holds generate_stats' current window. Each run also adds
+its days to monthly Parquet files under the results bucket:
+
+    public/history/daily/month=YYYY-MM.parquet   one row per (date, route)
+    public/history/hourly/month=YYYY-MM.parquet  one row per (date, route, UTC hour)
+    public/history/index.json                    months, date range, routes
+
+Rows hold rollup sums (count, sum, ...), not averages, so any range of days
+or hours merges exactly: avg = SUM(delay_sum) / SUM(delay_count). date is
+the gold partition day, the same day latest.json reports.
+
+A month file only grows. A run replaces the rows of the days it covers and
+leaves every other day alone, so re-running a day is safe. Files are sorted
+by route, then date, with small row groups. A reader filtering on a few
+routes therefore decodes only their row groups, and one filtering on a date
+range opens only the months it spans. A year of history is twelve files
+per grain of a few hundred KB each.
+"""
+import io
+from datetime import date
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+PREFIX = "public/history"
+INDEX_KEY = f"{PREFIX}/index.json"
+
+_ROUTE_STATS = [
+    ("date", pa.date32()),
+    ("route_short_name", pa.dictionary(pa.int32(), pa.string())),
+]
+
+SCHEMAS = {
+    "daily": pa.schema(_ROUTE_STATS + [
+        ("delay_count", pa.int64()),
+        ("delay_sum", pa.int64()),
+        ("delay_sum_sq", pa.int64()),
+        ("delay_min", pa.int32()),
+        ("delay_max", pa.int32()),
+    ]),
+    "hourly": pa.schema(_ROUTE_STATS + [
+        ("hour", pa.int64()),           # unix seconds, start of the UTC hour
+        ("delay_count", pa.int64()),
+        ("delay_sum", pa.int64()),
+    ]),
+}
+
+# Small groups so a route filter skips most of a month
+ROW_GROUP_SIZE = 8192
+
+
+def month_key(grain, month):
+    """Object key of one month file; month is "YYYY-MM"."""
+    return f"{PREFIX}/{grain}/month={month}.parquet"
+
+
+def from_rows(rows, grain):
+    """Table for grain from query rows with year/month/day partition columns."""
+    schema = SCHEMAS[grain]
+    columns = {name: [row.get(name) for row in rows] for name in schema.names if name != "date"}
+    columns["date"] = [date(int(row["year"]), int(row["month"]), int(row["day"])) for row in rows]
+    return pa.Table.from_pydict(columns, schema=schema)
+
+
+def split_by_month(table):
+    """{"YYYY-MM": rows of that month}."""
+    months = pc.strftime(table["date"].cast(pa.timestamp("s")), "%Y-%m")
+    return {month: table.filter(pc.equal(months, month)) for month in pc.unique(months).to_pylist()}
+
+
+def _sort_keys(grain):
+    keys = [("route_short_name", "ascending"), ("date", "ascending")]
+    return keys + [("hour", "ascending")] if grain == "hourly" else keys
+
+
+def append(existing, new, grain):
+    """existing with new's days replaced by new, sorted for route pruning."""
+    schema = SCHEMAS[grain]
+    tables = [new.cast(schema)]
+    if existing is not None:
+        replaced = pc.is_in(existing["date"], value_set=pc.unique(new["date"]))
+        tables.insert(0, existing.cast(schema).filter(pc.invert(replaced)))
+    table = pa.concat_tables(tables).unify_dictionaries()
+    # Arrow sorts dictionaries by index, not value; sort on the decoded names
+    decoded = table.set_column(1, "route_short_name", table["route_short_name"].cast(pa.string()))
+    order = pc.sort_indices(decoded, sort_keys=_sort_keys(grain))
+    return table.take(order).combine_chunks()
+
+
+def write(table):
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression="zstd", row_group_size=ROW_GROUP_SIZE)
+    return buffer.getvalue()
+
+
+def update_index(index, month, daily):
+    """index.json contents after month's daily file became daily."""
+    index = dict(index or {})
+    dates = daily["date"]
+    months = dict(index.get("months", {}))
+    months[month] = {
+        "from": pc.min(dates).as_py().isoformat(),
+        "to": pc.max(dates).as_py().isoformat(),
+        "days": len(pc.unique(dates)),
+        "routes": len(pc.unique(daily["route_short_name"].cast(pa.string()))),
+    }
+    index["months"] = dict(sorted(months.items()))
+    routes = set(index.get("routes", [])) | set(pc.unique(daily["route_short_name"].cast(pa.string())).to_pylist())
+    index["routes"] = sorted(routes)
+    return index
+
+
+def months_between(start, end):
+    """"YYYY-MM" of every month from start to end (dates, inclusive)."""
+    months = []
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        months.append(f"{year:04d}-{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def read(source, grain, start, end, routes=None, columns=None):
+    """
+    Rows of grain from start to end (inclusive), optionally only routes.
+
+    source(key) returns a path or file-like for an object key, or None if
+    it does not exist. Only the months in range are opened, and the route and
+    date filters are pushed into the Parquet reader.
+    """
+    filters = [("date", ">=", start), ("date", "<=", end)]
+    if routes is not None:
+        filters.append(("route_short_name", "in", list(routes)))
+    tables = []
+    for month in months_between(start, end):
+        file = source(month_key(grain, month))
+        if file is not None:
+            table = pq.read_table(file, columns=columns, filters=filters)
+            tables.append(table.cast(pa.schema([SCHEMAS[grain].field(name) for name in table.column_names])))
+    if not tables:
+        return SCHEMAS[grain].empty_table().select(columns or SCHEMAS[grain].names)
+    return pa.concat_tables(tables).unify_dictionaries()
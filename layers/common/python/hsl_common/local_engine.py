@@ -0,0 +1,176 @@
+"""
+In-process DuckDB stand-in for Athena, for offline runs, benchmarks and CI.
+
+The catalog is reproduced from terraform/athena.tf rather than written out a
+second time. Every aws_glue_catalog_table becomes a DuckDB view over the
+local files at its location, with the declared column and partition types.
+The gold_performance view is created from the named query's own SQL. A
+table or view added in terraform therefore shows up here with no changes.
+
+Buckets are mirrored into one directory per bucket under the data root
+(aws s3 sync s3://emkidev-silver-hsl <root>/silver, ...; see BUCKET_DIRS).
+Tables with no files yet are empty.
+
+The Presto functions our SQL uses that DuckDB spells differently
+(from_unixtime, date_format, date_parse, with_timezone, to_unixtime) are
+defined as macros. Results come back in the
+same shape as AthenaRunner's: a list of typed row dicts, with timestamps
+formatted the way Athena writes them.
+
+duckdb is only needed when this backend is selected (HSL_QUERY_BACKEND=duckdb,
+see hsl_common.athena.create_runner).
+"""
+import datetime
+import decimal
+import glob
+import os
+import re
+import sys
+from pathlib import Path
+
+import duckdb
+
+DATABASE = "hsl_transport"
+
+# data_bucket[i] in terraform → directory under the data root
+BUCKET_DIRS = {0: "bronze", 1: "silver", 2: "gold", 3: "reference", 4: "results"}
+
+CATALOG_PATH = Path(__file__).resolve().parents[4] / "terraform" / "athena.tf"
+
+GLUE_TYPES = {"string": "VARCHAR", "bigint": "BIGINT", "int": "INTEGER", "double": "DOUBLE"}
+
+MACROS = [
+    # Athena: unix seconds → timestamp (UTC)
+    "CREATE OR REPLACE MACRO from_unixtime(x) AS make_timestamp(CAST(x * 1000000 AS BIGINT))",
+    # Athena uses MySQL format specifiers: %i = minutes, %s = seconds
+    "CREATE OR REPLACE MACRO date_format(ts, fmt) AS strftime(ts, replace(replace(fmt, '%s', '%S'), '%i', '%M'))",
+    "CREATE OR REPLACE MACRO date_parse(text, fmt) AS strptime(text, fmt)",
+    # Athena: wall-clock timestamp in zone → timestamp with time zone
+    "CREATE OR REPLACE MACRO with_timezone(ts, zone) AS timezone(zone, ts)",
+    "CREATE OR REPLACE MACRO to_unixtime(ts) AS epoch(ts)",
+]
+
+_TABLE = re.compile(r'resource\s+"aws_glue_catalog_table"\s+"\w+"\s*\{')
+_NAMED_QUERY = re.compile(r'resource\s+"aws_athena_named_query"\s+"\w+"\s*\{')
+_COLUMN = re.compile(r'(columns|partition_keys)\s*\{([^}]*)\}')
+_ATTRIBUTE = re.compile(r'(\w+)\s*=\s*"([^"]*)"')
+_LOCATION = re.compile(r'location\s*=\s*"s3://\$\{aws_s3_bucket\.data_bucket\[(\d+)\]\.id\}/([^"]*)"')
+_HEREDOC = re.compile(r"<<-EOT\n(.*?)\n\s*EOT", re.DOTALL)
+
+
+def _block(text, start):
+    """Text of the {...} block whose opening brace ends the match at start."""
+    depth = 1
+    position = start
+    while depth:
+        depth += {"{": 1, "}": -1}.get(text[position], 0)
+        position += 1
+    return text[start:position - 1]
+
+
+def load_catalog(path=CATALOG_PATH):
+    """
+    Parse athena.tf into ([table specs], [view SQL]).
+
+    Each table spec is {name, bucket, prefix, format, columns, partitions},
+    with columns/partitions as [(name, glue type)].
+    """
+    text = Path(path).read_text()
+    tables = []
+    for match in _TABLE.finditer(text):
+        body = _block(text, match.end())
+        bucket, prefix = _LOCATION.search(body).groups()
+        fields = [(block, dict(_ATTRIBUTE.findall(attributes))) for block, attributes in _COLUMN.findall(body)]
+        columns = [(field["name"], field["type"]) for block, field in fields if block == "columns"]
+        partitions = [(field["name"], field["type"]) for block, field in fields if block == "partition_keys"]
+        tables.append({
+            "name": re.search(r'^\s*name\s*=\s*"(\w+)"', body, re.MULTILINE).group(1),
+            "bucket": int(bucket),
+            "prefix": prefix.strip("/"),
+            "format": "json" if "JsonSerDe" in body else "parquet",
+            "columns": columns,
+            "partitions": partitions,
+        })
+
+    views = []
+    for match in _NAMED_QUERY.finditer(text):
+        body = _block(text, match.end())
+        query = _HEREDOC.search(body).group(1)
+        if re.search(r"CREATE\s+(OR\s+REPLACE\s+)?VIEW", query, re.IGNORECASE):
+            views.append(query)
+    return tables, views
+
+
+def _duck_type(glue_type):
+    return GLUE_TYPES.get(glue_type.lower(), glue_type.upper())
+
+
+def _table_sql(table, data_root):
+    """SELECT for one Glue table over its files, cast to the declared types."""
+    location = os.path.join(str(data_root), BUCKET_DIRS[table["bucket"]], table["prefix"])
+    extension = "json" if table["format"] == "json" else "parquet"
+    pattern = os.path.join(location, "**", f"*.{extension}")
+    select = [f"CAST({name} AS {_duck_type(kind)}) AS {name}" for name, kind in table["columns"]]
+    select += [f"CAST({name} AS VARCHAR) AS {name}" for name, _ in table["partitions"]]
+
+    if not glob.glob(pattern, recursive=True):
+        # No data yet: an empty relation with the right columns
+        empty = [f"CAST(NULL AS {_duck_type(kind)}) AS {name}" for name, kind in table["columns"] + table["partitions"]]
+        return f"SELECT {', '.join(empty)} WHERE false"
+
+    hive_types = ", ".join(f"'{name}': 'VARCHAR'" for name, _ in table["partitions"])
+    options = f"hive_partitioning = true, hive_types = {{{hive_types}}}" if table["partitions"] else "hive_partitioning = false"
+    if table["format"] == "json":
+        columns = ", ".join(f"'{name}': '{_duck_type(kind)}'" for name, kind in table["columns"])
+        source = f"read_json('{pattern}', format = 'newline_delimited', columns = {{{columns}}}, {options})"
+    else:
+        source = f"read_parquet('{pattern}', union_by_name = true, {options})"
+    return f"SELECT {', '.join(select)} FROM {source}"
+
+
+def _python_value(value):
+    """Match AthenaRunner's typed values (floats for decimals, Athena-style timestamp text)."""
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, datetime.datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return value
+
+
+class LocalRunner:
+    """Runs our Athena SQL against local Parquet/NDJSON with DuckDB (AthenaRunner's interface)."""
+
+    def __init__(self, data_root, catalog_path=CATALOG_PATH, connection=None):
+        self.data_root = data_root
+        self.connection = connection or duckdb.connect()
+        self.connection.execute(f"CREATE SCHEMA IF NOT EXISTS {DATABASE}")
+        self.connection.execute(f"SET schema = '{DATABASE}'")
+        for macro in MACROS:
+            self.connection.execute(macro)
+        self.refresh(catalog_path)
+
+    def refresh(self, catalog_path=CATALOG_PATH):
+        """(Re)create the table views; call after new files land under the data root."""
+        tables, views = load_catalog(catalog_path)
+        for table in tables:
+            self.connection.execute(f"CREATE OR REPLACE VIEW {table['name']} AS {_table_sql(table, self.data_root)}")
+        for view in views:
+            self.connection.execute(view)
+
+    def run(self, query, timeout=None):
+        cursor = self.connection.execute(query)
+        names = [column[0] for column in cursor.description]
+        return [dict(zip(names, map(_python_value, row))) for row in cursor.fetchall()]
+
+    def run_many(self, queries, timeout=None, refresh=False):
+        named = queries if isinstance(queries, dict) else dict(enumerate(queries))
+        results = {name: self.run(query) for name, query in named.items()}
+        return results if isinstance(queries, dict) else [results[i] for i in range(len(queries))]
+
+
+if __name__ == "__main__":
+    # python -m hsl_common.local_engine <data root> "<sql>"
+    for row in LocalRunner(sys.argv[1]).run(sys.argv[2]):
+        print(" | ".join(str(value) for value in row.values()))
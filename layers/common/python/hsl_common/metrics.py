@@ -0,0 +1,172 @@
+"""
+Per-stage timings, byte and row counts and memory high-water marks for one
+handler invocation.
+
+    metrics = Metrics("flatten_data")
+    with metrics.stage("s3_get"):
+        body = s3.get_object(...)["Body"].read()
+    metrics.add("bytes_in", len(body))
+    ...
+    return {..., "metrics": metrics.emit(bronze_key=key)}
+
+A stage costs two perf_counter calls and a getrusage. A name entered more
+than once adds up, and its calls are counted. Stages and counts may be
+recorded from several threads (fetch_realtime fetches its feeds at once);
+time spent in parallel then adds up past duration_ms.
+
+emit() prints one JSON log line in CloudWatch Embedded Metric Format.
+CloudWatch turns it into metrics (namespace HSL/Pipeline, dimension
+Service) without a PutMetricData call, and Logs Insights can query the same
+line. emit() also returns the summary; the handlers put it in their output,
+so it shows up in the Step Functions execution history.
+
+Memory is ru_maxrss, the process high-water mark. Lambda reuses warm
+containers, so the mark also covers earlier invocations. Each stage records
+the mark as it ends, so the stage where it jumps is the one that allocated.
+
+With HSL_PROFILE_INTERVAL_MS set, a Sampler thread records the handler
+thread's Python stack at that interval. emit() then logs the most frequent
+stacks in collapsed form, the input flamegraph.pl and speedscope take. It is
+off by default. The sampler needs the GIL, so time spent in C code that holds
+it is charged to the next Python frame.
+"""
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+NAMESPACE = os.environ.get("HSL_METRICS_NAMESPACE", "HSL/Pipeline")
+PROFILE_INTERVAL_MS = float(os.environ.get("HSL_PROFILE_INTERVAL_MS", "0"))
+PROFILE_TOP = 30
+
+
+def max_rss_mb():
+    """Peak resident set size of this process so far."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def _unit(name):
+    if name.startswith("bytes"):
+        return "Bytes"
+    if name.endswith("_ms"):
+        return "Milliseconds"
+    if name.endswith("_mb"):
+        return "Megabytes"
+    return "Count"
+
+
+class Sampler:
+    """Samples one thread's Python stack every interval seconds and counts the collapsed stacks."""
+
+    def __init__(self, interval, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id or threading.get_ident()
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="hsl-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    def top(self, count=PROFILE_TOP):
+        """The most frequent stacks as "frame;frame;... samples" lines."""
+        return [f"{stack} {samples}" for stack, samples in self.stacks.most_common(count)]
+
+
+class Metrics:
+    def __init__(self, service, profile_interval_ms=PROFILE_INTERVAL_MS, clock=time.perf_counter):
+        self.service = service
+        self.clock = clock
+        self.started = clock()
+        self.stages = {}  # name: [seconds, calls, max_rss_mb when it last ended]
+        self.counts = {}
+        self._lock = threading.Lock()
+        self.sampler = Sampler(profile_interval_ms / 1000).start() if profile_interval_ms > 0 else None
+
+    @contextmanager
+    def stage(self, name):
+        start = self.clock()
+        try:
+            yield
+        finally:
+            elapsed = self.clock() - start
+            rss = max_rss_mb()
+            with self._lock:
+                entry = self.stages.setdefault(name, [0.0, 0, 0.0])
+                entry[0] += elapsed
+                entry[1] += 1
+                entry[2] = rss
+
+    def add(self, name, value):
+        """Add value to a count (bytes_in, bytes_out, rows, ...)."""
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def summary(self):
+        return {
+            "duration_ms": round((self.clock() - self.started) * 1000, 1),
+            "max_rss_mb": round(max_rss_mb(), 1),
+            "stages": {
+                name: {"ms": round(seconds * 1000, 1), "calls": calls, "max_rss_mb": round(rss, 1)}
+                for name, (seconds, calls, rss) in self.stages.items()
+            },
+            **self.counts,
+        }
+
+    def emit(self, **properties):
+        """Log the EMF line (plus the profile, if sampling) and return the summary."""
+        summary = self.summary()
+        values = {"duration_ms": summary["duration_ms"], "max_rss_mb": summary["max_rss_mb"]}
+        values.update({f"{name}_ms": stage["ms"] for name, stage in summary["stages"].items()})
+        values.update(self.counts)
+
+        print(json.dumps({
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": NAMESPACE,
+                    "Dimensions": [["Service"]],
+                    "Metrics": [{"Name": name, "Unit": _unit(name)} for name in values],
+                }],
+            },
+            "Service": self.service,
+            **values,
+            "stages": summary["stages"],
+            **properties,
+        }, default=str))
+
+        if self.sampler is not None:
+            self.sampler.stop()
+            print(json.dumps({
+                "Service": self.service,
+                "profile": {
+                    "interval_ms": self.sampler.interval * 1000,
+                    "samples": self.sampler.samples,
+                    "stacks": self.sampler.top(),
+                },
+            }))
+        return summary
@@ -0,0 +1,126 @@
+"""
+Hive partition layout of silver and gold, and the predicates that prune it.
+
+Row-level data (parquet/, performance/) is partitioned by UTC day, UTC hour
+and a hashed route bucket:
+
+    parquet/year=2026/month=02/day=13/utc_hour=05/route_bucket=3/054500.parquet
+
+Rollups, sketches, vehicle positions and service alerts are small and are
+partitioned by day and hour only. The hour column is utc_hour because
+gold_rollups and gold_sketches already have an hour column (unix seconds).
+
+Rows are placed by their own feed_timestamp, not by the object they came
+in: a batched bronze object that crosses an hour (or midnight) writes into
+both hours, under the same filename. route_bucket is crc32(route_id) mod
+ROUTE_BUCKETS, so a query for one route only has to read one bucket in each
+hour; rows without a route_id go to bucket 0.
+
+The tables in terraform/athena.tf use partition projection: Athena derives
+the partitions from the predicates and storage.location.template instead of
+the Glue catalog, so nothing has to be registered (no MSCK REPAIR), and a
+query that constrains year/month/day/utc_hour/route_bucket lists only those
+prefixes. Keep ROUTE_BUCKETS in sync with projection.route_bucket.range
+there.
+
+day_predicate, window_predicate and route_predicate build those constraints
+for the query builders. Whole days keep the (year = .. AND month = .. AND day = ..) form
+athena.ResultCache recognises.
+"""
+import zlib
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+ROUTE_BUCKETS = 8
+
+
+def route_bucket(route_id, buckets=ROUTE_BUCKETS):
+    """The route bucket of one route_id."""
+    return zlib.crc32(route_id.encode()) % buckets
+
+
+def route_buckets(column, buckets=ROUTE_BUCKETS):
+    """route_bucket of every row of a route_id column (numpy int64; 0 where null)."""
+    column = column.combine_chunks() if isinstance(column, pa.ChunkedArray) else column
+    if not pa.types.is_dictionary(column.type):
+        column = column.dictionary_encode()
+    # Hash each distinct route once; the last slot is for nulls
+    per_value = np.array([route_bucket(value, buckets) for value in column.dictionary.to_pylist()] + [0],
+                         dtype=np.int64)
+    indices = pc.fill_null(column.indices, len(column.dictionary)).to_numpy(zero_copy_only=False)
+    return per_value[indices]
+
+
+def partition_path(moment, bucket=None):
+    """year=/month=/day=/utc_hour=[/route_bucket=] of a UTC datetime."""
+    path = f"year={moment.year}/month={moment:%m}/day={moment:%d}/utc_hour={moment:%H}"
+    return path if bucket is None else f"{path}/route_bucket={bucket}"
+
+
+def split_partitions(table, seconds, fallback, route_column=None):
+    """
+    [(partition path, rows)] of table by the UTC hour of seconds (a column of
+    unix seconds) and, with route_column, by route bucket.
+
+    Rows where seconds is null go to the hour of fallback (unix seconds).
+    Rows keep their order within a partition; a table that falls in a single
+    partition is returned as it is. An empty table has no partitions.
+    """
+    if table.num_rows == 0:
+        return []
+    hours = pc.fill_null(table[seconds], fallback).to_numpy() // 3600
+    buckets = route_buckets(table[route_column]) if route_column else None
+    group = hours * ROUTE_BUCKETS + buckets if buckets is not None else hours
+
+    def path(value):
+        hour, bucket = divmod(int(value), ROUTE_BUCKETS) if buckets is not None else (int(value), None)
+        return partition_path(datetime.fromtimestamp(hour * 3600, timezone.utc), bucket)
+
+    values = np.unique(group)
+    if len(values) == 1:
+        return [(path(values[0]), table)]
+    order = np.argsort(group, kind="stable")
+    values, starts, counts = np.unique(group[order], return_index=True, return_counts=True)
+    ordered = table.take(order)
+    return [(path(value), ordered.slice(start, count)) for value, start, count in zip(values, starts, counts)]
+
+
+def day_predicate(day, hours=None):
+    """Partition predicate for one UTC day, or only the given hours (0-23) of it."""
+    clauses = f"year = '{day:%Y}' AND month = '{day:%m}' AND day = '{day:%d}'"
+    if hours is not None:
+        clauses += " AND utc_hour IN ({})".format(", ".join(f"'{hour:02d}'" for hour in hours))
+    return f"({clauses})"
+
+
+def window_predicate(start, end):
+    """
+    Partition predicate for the UTC hours from start up to, not including,
+    end (datetimes, truncated to the hour; naive ones are taken as UTC).
+
+    Whole days are matched by day alone, partial ones by day and utc_hour.
+    """
+    hour = start.replace(minute=0, second=0, microsecond=0, tzinfo=None)
+    end = end.replace(tzinfo=None)
+    days = {}
+    while hour < end:
+        days.setdefault(hour.date(), []).append(hour.hour)
+        hour += timedelta(hours=1)
+    if not days:
+        raise ValueError(f"Empty window {start} .. {end}")
+    return "(" + " OR ".join(
+        day_predicate(day, None if len(hours) == 24 else hours) for day, hours in days.items()
+    ) + ")"
+
+
+def route_predicate(route_ids, buckets=ROUTE_BUCKETS):
+    """Predicate for rows of these routes: their buckets, so only those are read, and the routes."""
+    route_ids = sorted(set(route_ids))
+    if not route_ids:
+        raise ValueError("No routes given")
+    bucket_list = ", ".join(f"'{bucket}'" for bucket in sorted({route_bucket(r, buckets) for r in route_ids}))
+    route_list = ", ".join("'{}'".format(route_id.replace("'", "''")) for route_id in route_ids)
+    return f"(route_bucket IN ({bucket_list}) AND route_id IN ({route_list}))"
@@ -0,0 +1,210 @@
+"""
+Delay propagation along trips: how much delay each stop adds.
+
+A route's average delay says nothing about where the delay comes from. Here
+a day of gold rows (GOLD_SCHEMA) becomes one row per (route, direction,
+stop) with the delay the trips gained between the previous stop and this
+one:
+
+1. latest_predictions keeps each trip's last prediction per stop_sequence
+   (the highest feed_timestamp, the one made closest to the arrival), via
+   one np.lexsort by (trip, stop_sequence, feed_timestamp).
+2. In that (trip, stop_sequence) order, np.diff of delay_seconds between
+   consecutive rows of the same trip is the delay added on the way to the
+   later stop. A trip's first stop has nothing before it and adds nothing.
+3. The increments are summed per (route_id, direction_id, stop_id) with
+   np.bincount over one combined integer key.
+
+Nothing loops over rows or groups in Python, so a day (a few million gold
+rows) takes seconds on one core. The reduction in step 1 is associative:
+it can run per hour partition and again over the concatenated results
+(stop_delays_for_day does), so the whole day's gold never has to be in
+memory at once.
+
+Rows hold sums, like rollups: trips, added_sum, added_sum_sq, added_min,
+added_max and delay_sum merge over days by addition and min/max
+(merge_stop_delays), and mean added delay = added_sum / trips. A stop whose
+mean is positive generates delay; a negative one recovers it (timing
+points, where early buses wait). stop_sequence is the lowest position the
+stop had on the route, for ordering a route's stops in a chart.
+
+The day file is public/history/stops/day=YYYY-MM-DD.parquet in the results
+bucket (day_key), next to the hsl_common.history files the dashboard
+already reads; about 10-40k rows, a few hundred KB.
+"""
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from hsl_common.history import PREFIX
+
+COLUMNS = ["feed_timestamp", "route_id", "route_short_name", "trip_id", "direction_id",
+           "stop_id", "stop_name", "stop_sequence", "delay_seconds"]
+KEYS = ["route_id", "direction_id", "stop_id"]
+
+STOP_SCHEMA = pa.schema([
+    ("route_id", pa.dictionary(pa.int32(), pa.string())),
+    ("route_short_name", pa.dictionary(pa.int32(), pa.string())),
+    ("direction_id", pa.int32()),
+    ("stop_id", pa.dictionary(pa.int32(), pa.string())),
+    ("stop_name", pa.dictionary(pa.int32(), pa.string())),
+    ("stop_sequence", pa.int32()),      # lowest position of the stop on the route
+    ("trips", pa.int64()),              # trips with a delay here and at the stop before
+    ("added_sum", pa.int64()),          # seconds of delay gained since the previous stop
+    ("added_sum_sq", pa.int64()),
+    ("added_min", pa.int32()),
+    ("added_max", pa.int32()),
+    ("delay_sum", pa.int64()),          # arrival delay at this stop, same trips
+])
+
+# How each column combines when days are merged
+MERGE = {
+    "stop_sequence": "min",
+    "trips": "sum",
+    "added_sum": "sum",
+    "added_sum_sq": "sum",
+    "added_min": "min",
+    "added_max": "max",
+    "delay_sum": "sum",
+}
+
+# The dashboard ranks only stops seen on at least this many trips
+MIN_TRIPS = 10
+
+
+def day_key(day):
+    """Results bucket key of one day's stop delays."""
+    return f"{PREFIX}/stops/day={day:%Y-%m-%d}.parquet"
+
+
+def _codes(column):
+    """int64 codes of a column's values (equal values, equal codes), and the encoded column."""
+    column = column.cast(pa.string()) if pa.types.is_dictionary(column.type) else column
+    encoded = pc.dictionary_encode(column).combine_chunks()
+    return encoded.indices.to_numpy().astype(np.int64), encoded
+
+
+def latest_predictions(gold):
+    """
+    The last prediction of every (trip_id, stop_sequence) in gold rows (any
+    table with COLUMNS), sorted by trip and stop_sequence.
+
+    Rows without a delay, a stop_sequence or a trip_id are dropped.
+    """
+    gold = gold.select(COLUMNS)
+    keep = pc.and_(pc.and_(pc.is_valid(gold["delay_seconds"]), pc.is_valid(gold["stop_sequence"])),
+                   pc.is_valid(gold["trip_id"]))
+    gold = gold.filter(keep)
+    if gold.num_rows == 0:
+        return gold
+
+    trip, _ = _codes(gold["trip_id"])
+    sequence = gold["stop_sequence"].to_numpy()
+    timestamp = gold["feed_timestamp"].to_numpy()
+    # np.lexsort sorts by its last key first
+    order = np.lexsort((timestamp, sequence, trip))
+    trip, sequence = trip[order], sequence[order]
+    last = np.ones(len(order), dtype=bool)
+    last[:-1] = (trip[1:] != trip[:-1]) | (sequence[1:] != sequence[:-1])
+    return gold.take(order[last])
+
+
+def compute_stop_delays(latest):
+    """Stop delay rows (STOP_SCHEMA) from latest_predictions output."""
+    if latest.num_rows < 2:
+        return STOP_SCHEMA.empty_table()
+
+    trip, _ = _codes(latest["trip_id"])
+    delay = latest["delay_seconds"].to_numpy().astype(np.int64)
+    # Row i + 1 follows row i on the same trip: it gets the difference
+    follows = np.flatnonzero(trip[1:] == trip[:-1]) + 1
+    if not len(follows):
+        return STOP_SCHEMA.empty_table()
+    added = delay[follows] - delay[follows - 1]
+    rows = latest.take(follows)
+
+    route, route_ids = _codes(rows["route_id"])
+    stop, stop_ids = _codes(rows["stop_id"])
+    # Directions 0/1, null as 2
+    direction = pc.fill_null(rows["direction_id"], 2).to_numpy().astype(np.int64)
+    combined = (route * 3 + direction) * max(len(stop_ids.dictionary), 1) + stop
+    groups, first, group = np.unique(combined, return_index=True, return_inverse=True)
+    size = len(groups)
+
+    # Per-group min/max over the rows sorted by group
+    by_group = np.argsort(group, kind="stable")
+    starts = np.searchsorted(group[by_group], np.arange(size))
+    sequence = rows["stop_sequence"].to_numpy()
+
+    keys = rows.take(first)
+    return pa.table({
+        "route_id": keys["route_id"],
+        "route_short_name": keys["route_short_name"],
+        "direction_id": keys["direction_id"],
+        "stop_id": keys["stop_id"],
+        "stop_name": keys["stop_name"],
+        "stop_sequence": pa.array(np.minimum.reduceat(sequence[by_group], starts), pa.int32()),
+        "trips": pa.array(np.bincount(group, minlength=size), pa.int64()),
+        "added_sum": pa.array(np.bincount(group, weights=added, minlength=size).astype(np.int64)),
+        "added_sum_sq": pa.array(np.bincount(group, weights=added * added, minlength=size).astype(np.int64)),
+        "added_min": pa.array(np.minimum.reduceat(added[by_group], starts), pa.int32()),
+        "added_max": pa.array(np.maximum.reduceat(added[by_group], starts), pa.int32()),
+        "delay_sum": pa.array(np.bincount(group, weights=delay[follows], minlength=size).astype(np.int64)),
+    }).cast(STOP_SCHEMA)
+
+
+def stop_delays_for_day(tables):
+    """
+    Stop delays for a day of gold given as tables (e.g. one per hour
+    partition), reducing each to its latest predictions as it arrives.
+    """
+    latest = [latest_predictions(table) for table in tables]
+    latest = [table for table in latest if table.num_rows]
+    if not latest:
+        return STOP_SCHEMA.empty_table()
+    combined = pa.concat_tables(latest, promote_options="permissive") if len(latest) > 1 else latest[0]
+    return sort_stops(compute_stop_delays(latest_predictions(combined)))
+
+
+def sort_stops(stops):
+    """Stops ordered along their routes: route_id, direction_id, stop_sequence."""
+    return stops.take(np.lexsort((
+        stops["stop_sequence"].to_numpy(zero_copy_only=False),
+        pc.fill_null(stops["direction_id"], 2).to_numpy(),
+        stops["route_id"].cast(pa.string()).to_numpy(zero_copy_only=False),
+    )))
+
+
+def merge_stop_delays(tables):
+    """Merge stop delay tables (several days) into one row per (route_id, direction_id, stop_id)."""
+    tables = [table for table in tables if table.num_rows]
+    if not tables:
+        return STOP_SCHEMA.empty_table()
+    if len(tables) == 1:
+        return tables[0]
+    table = pa.concat_tables([t.cast(STOP_SCHEMA) for t in tables]).unify_dictionaries()
+    decoded = pa.table({
+        name: table[name].cast(pa.string()) if pa.types.is_dictionary(table[name].type) else table[name]
+        for name in STOP_SCHEMA.names
+    })
+    grouped = decoded.group_by(KEYS, use_threads=False).aggregate(
+        list(MERGE.items()) + [("route_short_name", "max"), ("stop_name", "max")]
+    )
+    columns = {name: grouped[name] for name in KEYS}
+    columns["route_short_name"] = grouped["route_short_name_max"]
+    columns["stop_name"] = grouped["stop_name_max"]
+    columns.update({name: grouped[f"{name}_{how}"] for name, how in MERGE.items()})
+    return sort_stops(pa.table({name: columns[name] for name in STOP_SCHEMA.names}).cast(STOP_SCHEMA))
+
+
+def summarize_stops(stops):
+    """Mean and standard deviation of added delay and mean delay (seconds), as numpy arrays."""
+    trips = stops["trips"].to_numpy().astype(np.float64)
+    added = stops["added_sum"].to_numpy().astype(np.float64)
+    added_sq = stops["added_sum_sq"].to_numpy().astype(np.float64)
+    delay = stops["delay_sum"].to_numpy().astype(np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = added / trips
+        spread = np.sqrt(np.maximum(added_sq / trips - mean * mean, 0.0))
+        mean_delay = delay / trips
+    return mean, spread, mean_delay
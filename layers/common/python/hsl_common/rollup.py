@@ -0,0 +1,120 @@
+"""
+Mergeable delay rollups per (route, direction, hour).
+
+flatten_data writes one small rollup per snapshot next to the gold rows. Each
+rollup row holds count, sum, sum of squares, min and max of delay_seconds for
+one group. These merge by plain addition (count/sum/sum_sq) and min/max. A
+day, a week or one route's evening peak therefore comes from rollup rows
+alone: the work grows with routes × hours, not with predictions.
+
+Rows enter a rollup under the same conditions the "late routes" queries
+use: a delay was computed (scheduled_arrival found) and route_short_name is
+set. avg = sum / count therefore equals AVG(delay_seconds) over the same gold
+rows exactly.
+
+hour is the UTC hour (unix seconds, truncated) of the snapshot's
+feed_timestamp.
+
+Keep ROLLUP_SCHEMA in sync with the gold_rollups table in terraform/athena.tf.
+"""
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+KEYS = ["route_id", "route_short_name", "direction_id", "hour"]
+
+ROLLUP_SCHEMA = pa.schema([
+    ("route_id", pa.dictionary(pa.int32(), pa.string())),
+    ("route_short_name", pa.dictionary(pa.int32(), pa.string())),
+    ("direction_id", pa.int32()),
+    ("hour", pa.int64()),               # unix seconds, start of the UTC hour
+    ("delay_count", pa.int64()),
+    ("delay_sum", pa.int64()),
+    ("delay_sum_sq", pa.int64()),
+    ("delay_min", pa.int32()),
+    ("delay_max", pa.int32()),
+])
+
+# How each statistic combines when rollups are merged
+MERGE = {
+    "delay_count": "sum",
+    "delay_sum": "sum",
+    "delay_sum_sq": "sum",
+    "delay_min": "min",
+    "delay_max": "max",
+}
+
+
+def _aggregate(table, keys, aggregations):
+    # Arrow can't group on dictionary columns; group on the decoded values
+    decoded = table.select(list(dict.fromkeys(keys + [column for column, _ in aggregations])))
+    for i, name in enumerate(decoded.column_names):
+        if pa.types.is_dictionary(decoded.schema.field(name).type):
+            decoded = decoded.set_column(i, name, decoded[name].cast(pa.string()))
+    return decoded.group_by(keys, use_threads=False).aggregate(aggregations)
+
+
+def compute_rollup(gold):
+    """Rollup rows (ROLLUP_SCHEMA) for one gold snapshot (GOLD_SCHEMA)."""
+    delay = gold["delay_seconds"]
+    keep = pc.and_(pc.is_valid(delay), pc.is_valid(gold["route_short_name"]))
+    rows = gold.filter(keep)
+
+    delay = rows["delay_seconds"].cast(pa.int64())
+    hour = pc.multiply(pc.divide(rows["feed_timestamp"], 3600), 3600)
+    table = pa.table({
+        "route_id": rows["route_id"],
+        "route_short_name": rows["route_short_name"],
+        "direction_id": rows["direction_id"],
+        "hour": hour,
+        "delay": delay,
+        "delay_sq": pc.multiply(delay, delay),
+    })
+    grouped = _aggregate(table, KEYS, [
+        ("delay", "count"),
+        ("delay", "sum"),
+        ("delay_sq", "sum"),
+        ("delay", "min"),
+        ("delay", "max"),
+    ])
+    return _finish(grouped, KEYS, {
+        "delay_count": "delay_count",
+        "delay_sum": "delay_sum",
+        "delay_sum_sq": "delay_sq_sum",
+        "delay_min": "delay_min",
+        "delay_max": "delay_max",
+    })
+
+
+def merge_rollups(tables, keys=KEYS):
+    """
+    Merge rollup tables, grouping by keys (any subset of KEYS).
+
+    merge_rollups(day, keys=["route_short_name"]) gives one row per route
+    for the whole day.
+    """
+    tables = [table for table in tables if table.num_rows]
+    if not tables:
+        return ROLLUP_SCHEMA.empty_table().select(keys + list(MERGE))
+    table = pa.concat_tables([t.select(KEYS + list(MERGE)).cast(ROLLUP_SCHEMA) for t in tables]).unify_dictionaries()
+    grouped = _aggregate(table, list(keys), list(MERGE.items()))
+    return _finish(grouped, list(keys), {name: f"{name}_{how}" for name, how in MERGE.items()})
+
+
+def _finish(grouped, keys, renames):
+    """Rename aggregate columns back to rollup names and restore the schema types."""
+    columns = {key: grouped[key] for key in keys}
+    columns.update({name: grouped[source] for name, source in renames.items()})
+    schema = pa.schema([ROLLUP_SCHEMA.field(name) for name in columns])
+    return pa.table(columns).cast(schema)
+
+
+def summarize(rollup):
+    """Per-row avg and standard deviation (seconds) from the merged sums, as numpy arrays."""
+    count = rollup["delay_count"].to_numpy().astype(np.float64)
+    total = rollup["delay_sum"].to_numpy().astype(np.float64)
+    total_sq = rollup["delay_sum_sq"].to_numpy().astype(np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        avg = total / count
+        variance = np.maximum(total_sq / count - avg * avg, 0.0)
+    return avg, np.sqrt(variance)
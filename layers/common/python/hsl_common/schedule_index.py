@@ -0,0 +1,268 @@
+"""
+Memory-mappable schedule lookup index.
+
+Answers (route_id, direction_id, start_time, stop_id) → scheduled arrival
+(seconds after service-day midnight) and stop_sequence, the same lookup the
+gold_performance view does by joining ref_trips and ref_stop_times.
+
+route_id and stop_id strings are interned into small tables. Each key is packed
+into one uint64, and keys are stored sorted next to array-backed value
+columns. A lookup is a binary search (np.searchsorted), so whole snapshot
+columns resolve in one vectorized call.
+
+File layout (little endian):
+
+    b"HSLSIDX1" | uint32 header length | JSON header | pad to 8 bytes | arrays
+
+The header holds the interned tables and each array's dtype, offset and
+length. load() maps the file and wraps the arrays without copying them.
+"""
+import json
+import mmap
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+MAGIC = b"HSLSIDX1"
+
+# Packed key: route (16 bits) | direction (1) | start seconds (18) | stop (24)
+STOP_BITS = 24
+START_BITS = 18
+DIRECTION_BITS = 1
+ROUTE_BITS = 16
+
+ARRAYS = {
+    "keys": "<u8",
+    "arrival_seconds": "<i4",
+    "stop_sequence": "<i4",
+}
+
+
+def _encode(values):
+    """Hash-encode an id column into (distinct strings, per-row positions); nulls → -1."""
+    if isinstance(values, pa.ChunkedArray):
+        values = values.combine_chunks()
+    if not isinstance(values, pa.Array):
+        values = pa.array(values)
+    if not pa.types.is_dictionary(values.type):
+        values = pc.dictionary_encode(values.cast(pa.string()))
+    indices = values.indices.fill_null(-1).to_numpy(zero_copy_only=False).astype(np.int64)
+    return values.dictionary.cast(pa.string()).to_pylist(), indices
+
+
+def _gather(table, indices, missing):
+    """table[indices] with missing where indices == -1."""
+    table = np.append(np.asarray(table), missing)
+    return table[indices]
+
+
+def hms_to_seconds(values):
+    """Vectorized "HH:MM:SS" → seconds (GTFS hours may exceed 24). Unparseable → -1."""
+    uniques, indices = _encode(values)
+    seconds = []
+    for text in uniques:
+        try:
+            h, m, s = text.split(":")
+            seconds.append(int(h) * 3600 + int(m) * 60 + int(s))
+        except (AttributeError, ValueError):
+            seconds.append(-1)
+    return _gather(np.array(seconds, dtype=np.int64), indices, -1)
+
+
+def intern(values, positions):
+    """Map values to codes via positions (-1 for unknown), one dict lookup per distinct value."""
+    uniques, indices = _encode(values)
+    codes = np.array([positions.get(value, -1) for value in uniques], dtype=np.int64)
+    return _gather(codes, indices, -1)
+
+
+def pack_keys(route_codes, direction_ids, start_seconds, stop_codes):
+    key = np.asarray(route_codes, dtype=np.uint64)
+    key = (key << np.uint64(DIRECTION_BITS)) | np.asarray(direction_ids, dtype=np.uint64)
+    key = (key << np.uint64(START_BITS)) | np.asarray(start_seconds, dtype=np.uint64)
+    key = (key << np.uint64(STOP_BITS)) | np.asarray(stop_codes, dtype=np.uint64)
+    return key
+
+
+class ScheduleIndex:
+    def __init__(self, routes, route_names, stops, stop_names, keys, arrival_seconds, stop_sequence, _mmap=None):
+        self.routes = routes
+        self.route_names = route_names
+        self.stops = stops
+        self.stop_names = stop_names
+        self.keys = keys
+        self.arrival_seconds = arrival_seconds
+        self.stop_sequence = stop_sequence
+        self._mmap = _mmap
+        self._route_codes = {route: i for i, route in enumerate(routes)}
+        self._stop_codes = {stop: i for i, stop in enumerate(stops)}
+
+    def __len__(self):
+        return len(self.keys)
+
+    @classmethod
+    def build(cls, route_ids, direction_ids, start_seconds, stop_ids, arrival_seconds, stop_sequence,
+              route_names=None, stop_names=None):
+        """
+        Build from one row per scheduled stop (stop_times joined to trips).
+
+        route_names / stop_names map ids to route_short_name / stop_name.
+        When several trips share a key (same departure on different service
+        days), the one with the lowest stop_sequence wins.
+        """
+        route_names = route_names or {}
+        stop_names = stop_names or {}
+        route_values, route_rows = _encode(route_ids)
+        stop_values, stop_rows = _encode(stop_ids)
+
+        routes = sorted(set(route_values) | set(route_names))
+        stops = sorted(set(stop_values) | set(stop_names))
+        if len(routes) >= 1 << ROUTE_BITS or len(stops) >= 1 << STOP_BITS:
+            raise ValueError(f"Too many routes ({len(routes)}) or stops ({len(stops)}) for the key layout")
+
+        route_position = {route: i for i, route in enumerate(routes)}
+        stop_position = {stop: i for i, stop in enumerate(stops)}
+        route_codes = _gather(np.array([route_position[v] for v in route_values], dtype=np.int64), route_rows, -1)
+        stop_codes = _gather(np.array([stop_position[v] for v in stop_values], dtype=np.int64), stop_rows, -1)
+
+        start_seconds = np.asarray(start_seconds)
+        arrival_seconds = np.asarray(arrival_seconds, dtype=np.int32)
+        stop_sequence = np.asarray(stop_sequence, dtype=np.int32)
+        valid = (
+            (route_codes >= 0) & (stop_codes >= 0) & (arrival_seconds >= 0)
+            & (start_seconds >= 0) & (start_seconds < 1 << START_BITS)
+        )
+
+        keys = pack_keys(
+            route_codes[valid],
+            np.asarray(direction_ids)[valid],
+            start_seconds[valid],
+            stop_codes[valid],
+        )
+        arrival_seconds = arrival_seconds[valid]
+        stop_sequence = stop_sequence[valid]
+
+        order = np.lexsort((stop_sequence, keys))
+        keys = keys[order]
+        first = np.ones(len(keys), dtype=bool)
+        first[1:] = keys[1:] != keys[:-1]
+
+        return cls(
+            routes,
+            [route_names.get(route) for route in routes],
+            stops,
+            [stop_names.get(stop) for stop in stops],
+            keys[first],
+            arrival_seconds[order][first],
+            stop_sequence[order][first],
+        )
+
+    def write(self, path):
+        arrays = {name: np.ascontiguousarray(getattr(self, name), dtype=dtype) for name, dtype in ARRAYS.items()}
+        header = {
+            "routes": self.routes,
+            "route_names": self.route_names,
+            "stops": self.stops,
+            "stop_names": self.stop_names,
+            "arrays": {},
+        }
+
+        # Offsets depend on the header length, so settle the layout first
+        offset = 0
+        for name, array in arrays.items():
+            header["arrays"][name] = {"dtype": ARRAYS[name], "length": len(array), "offset": offset}
+            offset += array.nbytes
+        header_bytes = json.dumps(header, separators=(",", ":")).encode()
+        data_start = len(MAGIC) + 4 + len(header_bytes)
+        padding = -data_start % 8
+
+        with open(path, "wb") as f:
+            f.write(MAGIC)
+            f.write(len(header_bytes).to_bytes(4, "little"))
+            f.write(header_bytes)
+            f.write(b"\0" * padding)
+            for array in arrays.values():
+                f.write(array.tobytes())
+
+    @classmethod
+    def load(cls, path):
+        """Map an index file. Arrays are views over the mapping (no copy, no parse)."""
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if mapped[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a schedule index")
+        header_length = int.from_bytes(mapped[len(MAGIC):len(MAGIC) + 4], "little")
+        header_start = len(MAGIC) + 4
+        header = json.loads(mapped[header_start:header_start + header_length])
+        data_start = header_start + header_length
+        data_start += -data_start % 8
+
+        arrays = {
+            name: np.frombuffer(mapped, dtype=spec["dtype"], count=spec["length"], offset=data_start + spec["offset"])
+            for name, spec in header["arrays"].items()
+        }
+        return cls(
+            header["routes"],
+            header["route_names"],
+            header["stops"],
+            header["stop_names"],
+            arrays["keys"],
+            arrays["arrival_seconds"],
+            arrays["stop_sequence"],
+            _mmap=mapped,
+        )
+
+    def route_codes(self, route_ids):
+        return intern(route_ids, self._route_codes)
+
+    def stop_codes(self, stop_ids):
+        return intern(stop_ids, self._stop_codes)
+
+    def lookup(self, route_ids, direction_ids, start_times, stop_ids):
+        """
+        Vectorized lookup for whole columns.
+
+        start_times are "HH:MM:SS" strings as in GTFS-RT. Returns
+        (arrival_seconds, stop_sequence, found); values are 0 where found is False.
+        """
+        route_codes = self.route_codes(route_ids)
+        stop_codes = self.stop_codes(stop_ids)
+        start_seconds = hms_to_seconds(start_times)
+        if isinstance(direction_ids, pa.ChunkedArray):
+            direction_ids = direction_ids.combine_chunks()
+        if not isinstance(direction_ids, pa.Array):
+            direction_ids = pa.array(direction_ids)
+        direction_ids = direction_ids.cast(pa.int64()).fill_null(-1).to_numpy(zero_copy_only=False)
+
+        valid = (
+            (route_codes >= 0) & (stop_codes >= 0)
+            & (start_seconds >= 0) & (start_seconds < 1 << START_BITS)
+            & ((direction_ids == 0) | (direction_ids == 1))
+        )
+        query = pack_keys(
+            np.where(valid, route_codes, 0),
+            np.where(valid, direction_ids, 0),
+            np.where(valid, start_seconds, 0),
+            np.where(valid, stop_codes, 0),
+        )
+
+        if not len(self.keys):
+            zeros = np.zeros(len(query), dtype=np.int32)
+            return zeros, zeros, np.zeros(len(query), dtype=bool)
+
+        # Probing in key order keeps the binary search cache-friendly
+        order = np.argsort(query, kind="stable")
+        position = np.empty(len(query), dtype=np.int64)
+        position[order] = np.searchsorted(self.keys, query[order])
+        position = np.minimum(position, len(self.keys) - 1)
+        found = valid & (self.keys[position] == query)
+        arrival_seconds = np.where(found, self.arrival_seconds[position], 0)
+        stop_sequence = np.where(found, self.stop_sequence[position], 0)
+        return arrival_seconds, stop_sequence, found
+
+    def get(self, route_id, direction_id, start_time, stop_id):
+        """Single lookup; returns (arrival_seconds, stop_sequence) or None."""
+        arrival, sequence, found = self.lookup([route_id], [direction_id], [start_time], [stop_id])
+        return (int(arrival[0]), int(sequence[0])) if found[0] else None
@@ -0,0 +1,83 @@
+"""
+Silver layer Parquet writer.
+
+Silver snapshots are written as Parquet with a fixed schema, so Athena reads
+typed columns instead of re-parsing JSON text on every scan. route_id and
+stop_id repeat heavily within a snapshot and are dictionary-encoded.
+
+Keep SILVER_SCHEMA in sync with the silver_realtime table in terraform/athena.tf.
+
+Objects are keyed by the snapshot they hold, not by when they were written:
+snapshot_key gives HHMMSS.parquet from the earliest snapshot header
+timestamp (UTC), which is known before any row is flattened. Each row goes
+to the hour and route bucket partition of its own feed_timestamp
+(hsl_common.partitions). The same bronze object always maps to the same
+silver, gold, rollup and sketch keys, so reprocessing it (a retry, or a
+replay after the flatten logic changed) overwrites its earlier output
+instead of adding a second copy.
+"""
+import io
+from datetime import datetime, timezone
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from hsl_common.feed import SILVER_COLUMNS
+
+SILVER_SCHEMA = pa.schema([
+    ("feed_timestamp", pa.int64()),
+    ("route_id", pa.dictionary(pa.int32(), pa.string())),
+    ("start_time", pa.string()),
+    ("start_date", pa.string()),
+    ("direction_id", pa.int32()),
+    ("trip_id", pa.string()),
+    ("stop_id", pa.dictionary(pa.int32(), pa.string())),
+    ("predicted_arrival", pa.int64()),
+    ("arrival_uncertainty", pa.int32()),
+    ("predicted_departure", pa.int64()),
+    ("departure_uncertainty", pa.int32()),
+])
+
+# Checked at import rather than asserted, so python -O keeps the check
+if tuple(SILVER_SCHEMA.names) != SILVER_COLUMNS:
+    raise RuntimeError(f"SILVER_SCHEMA columns {SILVER_SCHEMA.names} differ from feed.SILVER_COLUMNS {SILVER_COLUMNS}")
+
+COMPRESSION = "snappy"
+
+
+def columns_to_table(columns):
+    """Build a silver Arrow table from feed_to_columns output."""
+    return pa.Table.from_pydict(columns, schema=SILVER_SCHEMA)
+
+
+def write_parquet(table, compression=COMPRESSION):
+    """Serialize a table into a single in-memory Parquet buffer."""
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, compression=compression)
+    buffer.seek(0)
+    return buffer
+
+
+def snapshot_key(timestamps, fallback=None):
+    """
+    (first, filename) for the snapshots with these feed timestamps
+    (header.timestamp, None where unset), from the earliest one: its unix
+    seconds, where rows without a feed_timestamp are partitioned, and
+    HHMMSS.parquet.
+
+    Without any timestamp the key comes from fallback (a UTC datetime,
+    default now).
+    """
+    first = min((timestamp for timestamp in timestamps if timestamp is not None), default=None)
+    if first is None:
+        moment = fallback or datetime.now(timezone.utc)
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        first = int(moment.timestamp())
+    else:
+        moment = datetime.fromtimestamp(first, timezone.utc)
+    return first, f"{moment:%H%M%S}.parquet"
+
+
+def columns_to_parquet(columns):
+    return write_parquet(columns_to_table(columns))
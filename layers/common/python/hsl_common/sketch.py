@@ -0,0 +1,147 @@
+"""
+Mergeable delay histograms (quantile sketches) per route and per stop.
+
+flatten_data writes one sketch file per snapshot next to the gold rows. A
+sketch counts delay_seconds into the fixed bins of BIN_EDGES, so one
+(dimension, value, hour) never holds more than NUM_BINS entries, however many
+predictions it saw. Sketches merge by adding counts bin by bin, which is
+exact. p50/p90/p99 over any set of hours or days come from the merged
+counts, with no pass over gold rows.
+
+Storage is sparse and long: one row per non-empty bin, with bin_delay (the
+bin's representative delay in seconds) and bin_count. Merging is then
+GROUP BY dimension, dimension_value, bin_delay / SUM(bin_count), which reads
+the same in Athena, DuckDB and Arrow.
+
+A quantile is the bin_delay of the first bin whose running count reaches
+q × total. Its error is at most half a bin: 7.5 s within ±10 min, 30 s up to
+an hour late, 150 s up to two hours. Delays outside [-30 min, +2 h] count in
+the edge bins.
+
+Keep SKETCH_SCHEMA in sync with the gold_sketches table in terraform/athena.tf.
+"""
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+BIN_EDGES = np.concatenate([
+    np.arange(-1800, -600, 60),
+    np.arange(-600, 600, 15),
+    np.arange(600, 3600, 60),
+    np.arange(3600, 7201, 300),
+])
+NUM_BINS = len(BIN_EDGES) - 1
+BIN_DELAYS = ((BIN_EDGES[:-1] + BIN_EDGES[1:]) // 2).astype(np.int32)
+
+# dimension → gold column the sketch is keyed by
+DIMENSIONS = {"route": "route_short_name", "stop": "stop_id"}
+
+QUANTILES = (0.5, 0.9, 0.99)
+
+SKETCH_SCHEMA = pa.schema([
+    ("dimension", pa.dictionary(pa.int32(), pa.string())),        # "route" | "stop"
+    ("dimension_value", pa.dictionary(pa.int32(), pa.string())),  # route_short_name | stop_id
+    ("hour", pa.int64()),                                         # unix seconds, start of the UTC hour
+    ("bin_delay", pa.int32()),
+    ("bin_count", pa.int32()),
+])
+
+
+def _bin_index(delay):
+    return np.clip(np.searchsorted(BIN_EDGES, delay, side="right") - 1, 0, NUM_BINS - 1)
+
+
+def _sketch(dimension, values, hours, delay):
+    """Sparse bin counts for one dimension; values is a string Arrow array."""
+    encoded = pc.dictionary_encode(values).combine_chunks()
+    value_codes = encoded.indices.to_numpy()
+    hour_values, hour_codes = np.unique(hours, return_inverse=True)
+
+    cell = (value_codes.astype(np.int64) * len(hour_values) + hour_codes) * NUM_BINS + _bin_index(delay)
+    cells, counts = np.unique(cell, return_counts=True)
+    group, bins = np.divmod(cells, NUM_BINS)
+    value_codes, hour_codes = np.divmod(group, len(hour_values))
+
+    return pa.table({
+        "dimension": pa.DictionaryArray.from_arrays(
+            np.zeros(len(cells), dtype=np.int32), pa.array([dimension])),
+        "dimension_value": pa.DictionaryArray.from_arrays(
+            value_codes.astype(np.int32), encoded.dictionary),
+        "hour": hour_values[hour_codes],
+        "bin_delay": BIN_DELAYS[bins],
+        "bin_count": counts.astype(np.int32),
+    }, schema=SKETCH_SCHEMA)
+
+
+def compute_sketches(gold):
+    """Route and stop sketches (SKETCH_SCHEMA) for one gold snapshot (GOLD_SCHEMA)."""
+    gold = gold.filter(pc.is_valid(gold["delay_seconds"]))
+    sketches = []
+    for dimension, column in DIMENSIONS.items():
+        rows = gold.filter(pc.is_valid(gold[column]))
+        delay = rows["delay_seconds"].to_numpy()
+        hours = rows["feed_timestamp"].to_numpy() // 3600 * 3600
+        sketches.append(_sketch(dimension, rows[column].cast(pa.string()), hours, delay))
+    return pa.concat_tables(sketches).unify_dictionaries()
+
+
+def merge_sketches(tables, keys=("dimension", "dimension_value")):
+    """
+    Merge sketch tables into one sketch per distinct keys (a subset of
+    dimension, dimension_value, hour), sorted by keys then bin_delay.
+    """
+    keys = list(keys)
+    tables = [table.select(keys + ["bin_delay", "bin_count"]) for table in tables if table.num_rows]
+    if not tables:
+        return SKETCH_SCHEMA.empty_table().select(keys + ["bin_delay", "bin_count"])
+
+    table = pa.concat_tables(tables, promote_options="permissive")
+    decoded = {name: table[name].cast(pa.string()) if pa.types.is_dictionary(table[name].type) else table[name]
+               for name in keys + ["bin_delay"]}
+    grouped = pa.table({**decoded, "bin_count": table["bin_count"].cast(pa.int64())}).group_by(
+        keys + ["bin_delay"], use_threads=False).aggregate([("bin_count", "sum")])
+    grouped = grouped.sort_by([(name, "ascending") for name in keys + ["bin_delay"]])
+
+    fields = [SKETCH_SCHEMA.field(name) for name in keys + ["bin_delay"]]
+    columns = [grouped[name].cast(field.type) for name, field in zip(keys + ["bin_delay"], fields)]
+    # Counts are summed in int64; a merged sketch can exceed int32
+    schema = pa.schema(fields + [pa.field("bin_count", pa.int64())])
+    return pa.Table.from_arrays(columns + [grouped["bin_count_sum"]], schema=schema)
+
+
+def quantiles(sketch, keys=("dimension", "dimension_value"), qs=QUANTILES):
+    """
+    Quantiles per merged sketch: a table of keys, total and one int32 column
+    per q (p50, p90, p99 for the defaults), in seconds.
+    """
+    keys = list(keys)
+    merged = merge_sketches([sketch], keys)
+    counts = merged["bin_count"].to_numpy()
+    delays = merged["bin_delay"].to_numpy()
+    names = [f"p{q * 100:g}".replace(".", "_") for q in qs]
+    if not len(counts):
+        return pa.table({**{key: merged[key] for key in keys}, "total": pa.array([], pa.int64()),
+                         **{name: pa.array([], pa.int32()) for name in names}})
+
+    # Rows are sorted by keys, so each sketch is one contiguous run
+    key_columns = [merged[key].to_numpy(zero_copy_only=False) for key in keys]
+    changed = np.zeros(len(counts), dtype=bool)
+    changed[0] = True
+    for column in key_columns:
+        changed[1:] |= column[1:] != column[:-1]
+    starts = np.flatnonzero(changed)
+    ends = np.append(starts[1:], len(counts))
+
+    running = np.cumsum(counts)
+    before = np.concatenate([[0], running[starts[1:] - 1]])
+    total = running[ends - 1] - before
+    result = {key: merged[key].take(starts) for key in keys}
+    result["total"] = pa.array(total)
+    group = np.repeat(np.arange(len(starts)), ends - starts)
+    within = running - before[group]
+    for name, q in zip(names, qs):
+        # First bin of each run whose running count reaches q × total
+        reached = within >= q * total[group]
+        first = np.minimum.reduceat(np.where(reached, np.arange(len(counts)), len(counts)), starts)
+        result[name] = pa.array(delays[first].astype(np.int32))
+    return pa.table(result)
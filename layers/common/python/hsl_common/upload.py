@@ -0,0 +1,92 @@
+"""
+Write-only file object that uploads to S3 in parts as it fills.
+
+pyarrow's ParquetWriter writes each row group into it. write() only buffers.
+send_full_parts() uploads what has accumulated once it reaches part_size,
+so the caller decides when network time is spent (and can time it apart
+from serialization). Nothing beyond one part is ever held.
+
+An object that never reached a full part is sent with a single put_object on
+close(). A 15-minute silver snapshot costs one request, as before, while a
+large batch becomes a multipart upload. On an exception inside a with block
+the upload is aborted, so no orphaned parts are left behind.
+"""
+PART_SIZE = 8 * 1024 * 1024
+# S3 rejects smaller parts (except the last)
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+class MultipartUpload:
+    def __init__(self, s3, bucket, key, content_type="application/octet-stream", part_size=PART_SIZE):
+        if part_size < MIN_PART_SIZE:
+            raise ValueError(f"part_size must be at least {MIN_PART_SIZE} bytes")
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.content_type = content_type
+        self.part_size = part_size
+        self.buffer = bytearray()
+        self.size = 0           # bytes written so far
+        self.upload_id = None
+        self.parts = []
+        self.closed = False
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+        self.size += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.size
+
+    def flush(self):
+        pass
+
+    def send_full_parts(self):
+        """Upload the buffer as the next part if it has reached part_size."""
+        if len(self.buffer) >= self.part_size:
+            self._send_part()
+
+    def _send_part(self):
+        if self.upload_id is None:
+            self.upload_id = self.s3.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, ContentType=self.content_type
+            )["UploadId"]
+        number = len(self.parts) + 1
+        response = self.s3.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=number, Body=bytes(self.buffer)
+        )
+        self.parts.append({"ETag": response["ETag"], "PartNumber": number})
+        self.buffer = bytearray()
+
+    def close(self):
+        if self.closed:
+            return
+        if self.upload_id is None:
+            self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer), ContentType=self.content_type)
+        else:
+            if self.buffer:
+                self._send_part()
+            self.s3.complete_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, MultipartUpload={"Parts": self.parts}
+            )
+        self.buffer = bytearray()
+        self.closed = True
+
+    def abort(self):
+        if self.upload_id is not None and not self.closed:
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+        self.buffer = bytearray()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
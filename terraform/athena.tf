@@ -65,6 +65,11 @@ resource "aws_glue_catalog_table" "ref_trips" {
       type = "string"
     }
   }
+
+  partition_keys {
+    name = "feed_version"
+    type = "string"
+  }
 }
 
 resource "aws_glue_catalog_table" "ref_stop_times" {
@@ -103,7 +108,7 @@ resource "aws_glue_catalog_table" "ref_stop_times" {
     }
     columns {
       name = "stop_sequence"
-      type = "bigint"
+      type = "int"
     }
     columns {
       name = "stop_headsign"
@@ -126,6 +131,58 @@ resource "aws_glue_catalog_table" "ref_stop_times" {
       type = "bigint"
     }
   }
+
+  partition_keys {
+    name = "feed_version"
+    type = "string"
+  }
+}
+
+# Which feed version was valid for which service dates (written by
+# covertToPaquet.py). Join silver start_date BETWEEN valid_from AND valid_to.
+resource "aws_glue_catalog_table" "ref_feed_versions" {
+  database_name = aws_glue_catalog_database.hsl.name
+  name          = "ref_feed_versions"
+  table_type    = "EXTERNAL_TABLE"
+
+  parameters = {
+    "classification" = "parquet"
+  }
+
+  storage_descriptor {
+    location      = "s3://${aws_s3_bucket.data_bucket[3].id}/feed_versions/"
+    input_format  = "org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat"
+    output_format = "org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat"
+
+    ser_de_info {
+      serialization_library = "org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe"
+    }
+
+    columns {
+      name = "feed_version"
+      type = "string"
+    }
+    columns {
+      name = "valid_from"
+      type = "string"
+    }
+    columns {
+      name = "valid_to"
+      type = "string"
+    }
+    columns {
+      name = "trips_sha256"
+      type = "string"
+    }
+    columns {
+      name = "stop_times_sha256"
+      type = "string"
+    }
+    columns {
+      name = "converted_at"
+      type = "string"
+    }
+  }
 }
 
 resource "aws_glue_catalog_table" "ref_routes" {
@@ -255,8 +312,18 @@ resource "aws_glue_catalog_table" "ref_stops" {
 }
 
 # =============================================================================
-# SILVER TABLE (JSON SerDe - realtime predictions)
+# SILVER TABLE (Parquet - realtime predictions)
 # =============================================================================
+#
+# Columns match SILVER_SCHEMA in layers/common/python/hsl_common/silver.py.
+#
+# Partitioned by UTC day, hour and route bucket (crc32(route_id) mod 8, see
+# hsl_common/partitions.py) with partition projection: Athena computes the
+# partitions a query's predicates select from the projection.* ranges and
+# storage.location.template, so new partitions need no MSCK REPAIR and a
+# query on one hour or route reads only those prefixes. gold_realtime uses
+# the same layout; rollups, sketches, vehicle positions and alerts stop at
+# the hour.
 
 resource "aws_glue_catalog_table" "silver_realtime" {
   database_name = aws_glue_catalog_database.hsl.name
@@ -265,21 +332,36 @@ resource "aws_glue_catalog_table" "silver_realtime" {
   table_type = "EXTERNAL_TABLE"
 
   parameters = {
-    "classification" = "json"
+    "classification"                = "parquet"
+    "projection.enabled"            = "true"
+    "projection.year.type"          = "integer"
+    "projection.year.range"         = "2026,2035"
+    "projection.month.type"         = "integer"
+    "projection.month.range"        = "1,12"
+    "projection.month.digits"       = "2"
+    "projection.day.type"           = "integer"
+    "projection.day.range"          = "1,31"
+    "projection.day.digits"         = "2"
+    "projection.utc_hour.type"      = "integer"
+    "projection.utc_hour.range"     = "0,23"
+    "projection.utc_hour.digits"    = "2"
+    "projection.route_bucket.type"  = "integer"
+    "projection.route_bucket.range" = "0,7"
+    "storage.location.template"     = "s3://${aws_s3_bucket.data_bucket[1].id}/parquet/year=$${year}/month=$${month}/day=$${day}/utc_hour=$${utc_hour}/route_bucket=$${route_bucket}/"
   }
 
   storage_descriptor {
-    location      = "s3://${aws_s3_bucket.data_bucket[1].id}/flat/"
-    input_format  = "org.apache.hadoop.mapred.TextInputFormat"
-    output_format = "org.apache.hadoop.hive.ql.io.HiveIgnoreKeyTextOutputFormat"
+    location      = "s3://${aws_s3_bucket.data_bucket[1].id}/parquet/"
+    input_format  = "org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat"
+    output_format = "org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat"
 
     ser_de_info {
-      serialization_library = "org.openx.data.jsonserde.JsonSerDe"
+      serialization_library = "org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe"
     }
 
     columns {
       name = "feed_timestamp"
-      type = "string"
+      type = "bigint"
     }
     columns {
       name = "route_id"
@@ -307,7 +389,7 @@ resource "aws_glue_catalog_table" "silver_realtime" {
     }
     columns {
       name = "predicted_arrival"
-      type = "string"
+      type = "bigint"
     }
     columns {
       name = "arrival_uncertainty"
@@ -315,7 +397,7 @@ resource "aws_glue_catalog_table" "silver_realtime" {
     }
     columns {
       name = "predicted_departure"
-      type = "string"
+      type = "bigint"
     }
     columns {
       name = "departure_uncertainty"
@@ -335,18 +417,753 @@ resource "aws_glue_catalog_table" "silver_realtime" {
     name = "day"
     type = "string"
   }
+  partition_keys {
+    name = "utc_hour"
+    type = "string"
+  }
+  partition_keys {
+    name = "route_bucket"
+    type = "string"
+  }
+}
+
+# =============================================================================
+# SILVER VEHICLE POSITIONS / SERVICE ALERTS (Parquet, one file per snapshot)
+# =============================================================================
+#
+# The other two GTFS-RT feeds, fetched alongside trip updates. One row per
+# vehicle, and one row per (alert, informed entity). They join trip updates
+# on (route_id, direction_id, start_date, start_time).
+# Columns match VEHICLE_SCHEMA and ALERT_SCHEMA in
+# layers/common/python/hsl_common/feeds.py.
+
+resource "aws_glue_catalog_table" "silver_vehicle_positions" {
+  database_name = aws_glue_catalog_database.hsl.name
+  name          = "silver_vehicle_positions"
+
+  table_type = "EXTERNAL_TABLE"
+
+  parameters = {
+    "classification"             = "parquet"
+    "projection.enabled"         = "true"
+    "projection.year.type"       = "integer"
+    "projection.year.range"      = "2026,2035"
+    "projection.month.type"      = "integer"
+    "projection.month.range"     = "1,12"
+    "projection.month.digits"    = "2"
+    "projection.day.type"        = "integer"
+    "projection.day.range"       = "1,31"
+    "projection.day.digits"      = "2"
+    "projection.utc_hour.type"   = "integer"
+    "projection.utc_hour.range"  = "0,23"
+    "projection.utc_hour.digits" = "2"
+    "storage.location.template"  = "s3://${aws_s3_bucket.data_bucket[1].id}/vehicle_positions/year=$${year}/month=$${month}/day=$${day}/utc_hour=$${utc_hour}/"
+  }
+
+  storage_descriptor {
+    location      = "s3://${aws_s3_bucket.data_bucket[1].id}/vehicle_positions/"
+    input_format  = "org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat"
+    output_format = "org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat"
+
+    ser_de_info {
+      serialization_library = "org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe"
+    }
+
+    columns {
+      name = "feed_timestamp"
+      type = "bigint"
+    }
+    columns {
+      name = "vehicle_timestamp"
+      type = "bigint"
+    }
+    columns {
+      name = "vehicle_id"
+      type = "string"
+    }
+    columns {
+      name = "vehicle_label"
+      type = "string"
+    }
+    columns {
+      name = "route_id"
+      type = "string"
+    }
+    columns {
+      name = "direction_id"
+      type = "int"
+    }
+    columns {
+      name = "start_time"
+      type = "string"
+    }
+    columns {
+      name = "start_date"
+      type = "string"
+    }
+    columns {
+      name = "trip_id"
+      type = "string"
+    }
+    columns {
+      name = "latitude"
+      type = "float"
+    }
+    columns {
+      name = "longitude"
+      type = "float"
+    }
+    columns {
+      name = "bearing"
+      type = "float"
+    }
+    columns {
+      name = "speed"
+      type = "float"
+    }
+    columns {
+      name = "current_stop_sequence"
+      type = "int"
+    }
+    columns {
+      name = "stop_id"
+      type = "string"
+    }
+    columns {
+      name = "current_status"
+      type = "string"
+    }
+    columns {
+      name = "occupancy_status"
+      type = "string"
+    }
+  }
+
+  partition_keys {
+    name = "year"
+    type = "string"
+  }
+  partition_keys {
+    name = "month"
+    type = "string"
+  }
+  partition_keys {
+    name = "day"
+    type = "string"
+  }
+  partition_keys {
+    name = "utc_hour"
+    type = "string"
+  }
+}
+
+resource "aws_glue_catalog_table" "silver_service_alerts" {
+  database_name = aws_glue_catalog_database.hsl.name
+  name          = "silver_service_alerts"
+
+  table_type = "EXTERNAL_TABLE"
+
+  parameters = {
+    "classification"             = "parquet"
+    "projection.enabled"         = "true"
+    "projection.year.type"       = "integer"
+    "projection.year.range"      = "2026,2035"
+    "projection.month.type"      = "integer"
+    "projection.month.range"     = "1,12"
+    "projection.month.digits"    = "2"
+    "projection.day.type"        = "integer"
+    "projection.day.range"       = "1,31"
+    "projection.day.digits"      = "2"
+    "projection.utc_hour.type"   = "integer"
+    "projection.utc_hour.range"  = "0,23"
+    "projection.utc_hour.digits" = "2"
+    "storage.location.template"  = "s3://${aws_s3_bucket.data_bucket[1].id}/service_alerts/year=$${year}/month=$${month}/day=$${day}/utc_hour=$${utc_hour}/"
+  }
+
+  storage_descriptor {
+    location      = "s3://${aws_s3_bucket.data_bucket[1].id}/service_alerts/"
+    input_format  = "org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat"
+    output_format = "org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat"
+
+    ser_de_info {
+      serialization_library = "org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe"
+    }
+
+    columns {
+      name = "feed_timestamp"
+      type = "bigint"
+    }
+    columns {
+      name = "alert_id"
+      type = "string"
+    }
+    columns {
+      name = "cause"
+      type = "string"
+    }
+    columns {
+      name = "effect"
+      type = "string"
+    }
+    columns {
+      name = "severity_level"
+      type = "string"
+    }
+    columns {
+      name = "active_start"
+      type = "bigint"
+    }
+    columns {
+      name = "active_end"
+      type = "bigint"
+    }
+    columns {
+      name = "route_id"
+      type = "string"
+    }
+    columns {
+      name = "direction_id"
+      type = "int"
+    }
+    columns {
+      name = "stop_id"
+      type = "string"
+    }
+    columns {
+      name = "trip_id"
+      type = "string"
+    }
+    columns {
+      name = "start_time"
+      type = "string"
+    }
+    columns {
+      name = "start_date"
+      type = "string"
+    }
+    columns {
+      name = "header_text"
+      type = "string"
+    }
+    columns {
+      name = "description_text"
+      type = "string"
+    }
+  }
+
+  partition_keys {
+    name = "year"
+    type = "string"
+  }
+  partition_keys {
+    name = "month"
+    type = "string"
+  }
+  partition_keys {
+    name = "day"
+    type = "string"
+  }
+  partition_keys {
+    name = "utc_hour"
+    type = "string"
+  }
+}
+
+# =============================================================================
+# SILVER DELTA TABLE (Parquet - change data capture, SILVER_MODE=delta)
+# =============================================================================
+#
+# Only the predictions that changed between snapshots, keyed by
+# (trip_id, stop_id, occurrence). Partitioned by the UTC day of valid_from;
+# each day starts with a full checkpoint (op = S), so the state at any
+# moment T of a day is, per key, the latest row with valid_from <= T at or
+# after the last checkpoint <= T, unless that row is a delete.
+# hsl_common.delta.as_of does the same in Python.
+# Columns match DELTA_SCHEMA in layers/common/python/hsl_common/delta.py.
+
+resource "aws_glue_catalog_table" "silver_delta" {
+  database_name = aws_glue_catalog_database.hsl.name
+  name          = "silver_delta"
+
+  table_type = "EXTERNAL_TABLE"
+
+  parameters = {
+    "classification" = "parquet"
+  }
+
+  storage_descriptor {
+    location      = "s3://${aws_s3_bucket.data_bucket[1].id}/delta/"
+    input_format  = "org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat"
+    output_format = "org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat"
+
+    ser_de_info {
+      serialization_library = "org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe"
+    }
+
+    columns {
+      name    = "valid_from"
+      type    = "bigint"
+      comment = "feed_timestamp of the snapshot the change appeared in"
+    }
+    columns {
+      name    = "op"
+      type    = "string"
+      comment = "I insert, U update, D delete (last values), S daily checkpoint"
+    }
+    columns {
+      name = "trip_id"
+      type = "string"
+    }
+    columns {
+      name = "stop_id"
+      type = "string"
+    }
+    columns {
+      name    = "occurrence"
+      type    = "int"
+      comment = "Repeat visit of stop_id within the trip (loop lines), usually 0"
+    }
+    columns {
+      name = "route_id"
+      type = "string"
+    }
+    columns {
+      name = "start_time"
+      type = "string"
+    }
+    columns {
+      name = "start_date"
+      type = "string"
+    }
+    columns {
+      name = "direction_id"
+      type = "int"
+    }
+    columns {
+      name = "predicted_arrival"
+      type = "bigint"
+    }
+    columns {
+      name = "arrival_uncertainty"
+      type = "int"
+    }
+    columns {
+      name = "predicted_departure"
+      type = "bigint"
+    }
+    columns {
+      name = "departure_uncertainty"
+      type = "int"
+    }
+  }
+
+  partition_keys {
+    name = "year"
+    type = "string"
+  }
+  partition_keys {
+    name = "month"
+    type = "string"
+  }
+  partition_keys {
+    name = "day"
+    type = "string"
+  }
+}
+
+# =============================================================================
+# LEGACY SILVER TABLE (JSON SerDe - NDJSON snapshots written before Parquet)
+# =============================================================================
+
+resource "aws_glue_catalog_table" "silver_realtime_json" {
+  database_name = aws_glue_catalog_database.hsl.name
+  name          = "silver_realtime_json"
+
+  table_type = "EXTERNAL_TABLE"
+
+  parameters = {
+    "classification" = "json"
+  }
+
+  storage_descriptor {
+    location      = "s3://${aws_s3_bucket.data_bucket[1].id}/flat/"
+    input_format  = "org.apache.hadoop.mapred.TextInputFormat"
+    output_format = "org.apache.hadoop.hive.ql.io.HiveIgnoreKeyTextOutputFormat"
+
+    ser_de_info {
+      serialization_library = "org.openx.data.jsonserde.JsonSerDe"
+    }
+
+    columns {
+      name = "feed_timestamp"
+      type = "string"
+    }
+    columns {
+      name = "route_id"
+      type = "string"
+    }
+    columns {
+      name = "start_time"
+      type = "string"
+    }
+    columns {
+      name = "start_date"
+      type = "string"
+    }
+    columns {
+      name = "direction_id"
+      type = "int"
+    }
+    columns {
+      name = "trip_id"
+      type = "string"
+    }
+    columns {
+      name = "stop_id"
+      type = "string"
+    }
+    columns {
+      name = "predicted_arrival"
+      type = "string"
+    }
+    columns {
+      name = "arrival_uncertainty"
+      type = "int"
+    }
+    columns {
+      name = "predicted_departure"
+      type = "string"
+    }
+    columns {
+      name = "departure_uncertainty"
+      type = "int"
+    }
+  }
+
+  partition_keys {
+    name = "year"
+    type = "string"
+  }
+  partition_keys {
+    name = "month"
+    type = "string"
+  }
+  partition_keys {
+    name = "day"
+    type = "string"
+  }
+}
+
+# =============================================================================
+# GOLD TABLE (Parquet - materialized by flatten_data)
+# =============================================================================
+#
+# flatten_data computes delay_seconds per snapshot against the schedule index
+# and writes it here, so daily queries are a single-table scan with no joins.
+# Columns match GOLD_SCHEMA in layers/common/python/hsl_common/gold.py.
+# gold_performance (below) stays as a fallback for days without gold files;
+# it computes delay_seconds with the same service-day arithmetic.
+
+resource "aws_glue_catalog_table" "gold_realtime" {
+  database_name = aws_glue_catalog_database.hsl.name
+  name          = "gold_realtime"
+
+  table_type = "EXTERNAL_TABLE"
+
+  parameters = {
+    "classification"                = "parquet"
+    "projection.enabled"            = "true"
+    "projection.year.type"          = "integer"
+    "projection.year.range"         = "2026,2035"
+    "projection.month.type"         = "integer"
+    "projection.month.range"        = "1,12"
+    "projection.month.digits"       = "2"
+    "projection.day.type"           = "integer"
+    "projection.day.range"          = "1,31"
+    "projection.day.digits"         = "2"
+    "projection.utc_hour.type"      = "integer"
+    "projection.utc_hour.range"     = "0,23"
+    "projection.utc_hour.digits"    = "2"
+    "projection.route_bucket.type"  = "integer"
+    "projection.route_bucket.range" = "0,7"
+    "storage.location.template"     = "s3://${aws_s3_bucket.data_bucket[2].id}/performance/year=$${year}/month=$${month}/day=$${day}/utc_hour=$${utc_hour}/route_bucket=$${route_bucket}/"
+  }
+
+  storage_descriptor {
+    location      = "s3://${aws_s3_bucket.data_bucket[2].id}/performance/"
+    input_format  = "org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat"
+    output_format = "org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat"
+
+    ser_de_info {
+      serialization_library = "org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe"
+    }
+
+    columns {
+      name = "feed_timestamp"
+      type = "bigint"
+    }
+    columns {
+      name = "route_id"
+      type = "string"
+    }
+    columns {
+      name = "route_short_name"
+      type = "string"
+    }
+    columns {
+      name = "trip_id"
+      type = "string"
+    }
+    columns {
+      name = "direction_id"
+      type = "int"
+    }
+    columns {
+      name = "stop_id"
+      type = "string"
+    }
+    columns {
+      name = "stop_name"
+      type = "string"
+    }
+    columns {
+      name = "stop_sequence"
+      type = "int"
+    }
+    columns {
+      name    = "scheduled_arrival"
+      type    = "int"
+      comment = "Seconds after service-day midnight"
+    }
+    columns {
+      name    = "predicted_arrival"
+      type    = "bigint"
+      comment = "Unix seconds (UTC)"
+    }
+    columns {
+      name = "delay_seconds"
+      type = "int"
+    }
+    columns {
+      name = "arrival_uncertainty"
+      type = "int"
+    }
+  }
+
+  partition_keys {
+    name = "year"
+    type = "string"
+  }
+  partition_keys {
+    name = "month"
+    type = "string"
+  }
+  partition_keys {
+    name = "day"
+    type = "string"
+  }
+  partition_keys {
+    name = "utc_hour"
+    type = "string"
+  }
+  partition_keys {
+    name = "route_bucket"
+    type = "string"
+  }
+}
+
+# =============================================================================
+# GOLD ROLLUPS (Parquet - written by flatten_data next to each gold file)
+# =============================================================================
+#
+# One row per (route, direction, hour) per snapshot with count, sum, sum of
+# squares, min and max of delay_seconds. Sums merge by addition, so a day of
+# per-route averages is SUM(delay_sum) / SUM(delay_count) over a few thousand
+# rows instead of a scan of every prediction. Columns match ROLLUP_SCHEMA in
+# layers/common/python/hsl_common/rollup.py.
+
+resource "aws_glue_catalog_table" "gold_rollups" {
+  database_name = aws_glue_catalog_database.hsl.name
+  name          = "gold_rollups"
+
+  table_type = "EXTERNAL_TABLE"
+
+  parameters = {
+    "classification"             = "parquet"
+    "projection.enabled"         = "true"
+    "projection.year.type"       = "integer"
+    "projection.year.range"      = "2026,2035"
+    "projection.month.type"      = "integer"
+    "projection.month.range"     = "1,12"
+    "projection.month.digits"    = "2"
+    "projection.day.type"        = "integer"
+    "projection.day.range"       = "1,31"
+    "projection.day.digits"      = "2"
+    "projection.utc_hour.type"   = "integer"
+    "projection.utc_hour.range"  = "0,23"
+    "projection.utc_hour.digits" = "2"
+    "storage.location.template"  = "s3://${aws_s3_bucket.data_bucket[2].id}/rollups/year=$${year}/month=$${month}/day=$${day}/utc_hour=$${utc_hour}/"
+  }
+
+  storage_descriptor {
+    location      = "s3://${aws_s3_bucket.data_bucket[2].id}/rollups/"
+    input_format  = "org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat"
+    output_format = "org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat"
+
+    ser_de_info {
+      serialization_library = "org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe"
+    }
+
+    columns {
+      name = "route_id"
+      type = "string"
+    }
+    columns {
+      name = "route_short_name"
+      type = "string"
+    }
+    columns {
+      name = "direction_id"
+      type = "int"
+    }
+    columns {
+      name    = "hour"
+      type    = "bigint"
+      comment = "Unix seconds, start of the UTC hour of feed_timestamp"
+    }
+    columns {
+      name = "delay_count"
+      type = "bigint"
+    }
+    columns {
+      name    = "delay_sum"
+      type    = "bigint"
+      comment = "Seconds"
+    }
+    columns {
+      name    = "delay_sum_sq"
+      type    = "bigint"
+      comment = "Seconds squared, for the standard deviation"
+    }
+    columns {
+      name = "delay_min"
+      type = "int"
+    }
+    columns {
+      name = "delay_max"
+      type = "int"
+    }
+  }
+
+  partition_keys {
+    name = "year"
+    type = "string"
+  }
+  partition_keys {
+    name = "month"
+    type = "string"
+  }
+  partition_keys {
+    name = "day"
+    type = "string"
+  }
+  partition_keys {
+    name = "utc_hour"
+    type = "string"
+  }
+}
+
+# =============================================================================
+# GOLD SKETCHES (Parquet - written by flatten_data next to each gold file)
+# =============================================================================
+#
+# Fixed-bin delay histograms per route and per stop and hour, one row per
+# non-empty bin. Merge with GROUP BY ..., bin_delay / SUM(bin_count); a
+# percentile is the first bin_delay whose running count reaches q × total.
+# Columns match SKETCH_SCHEMA in layers/common/python/hsl_common/sketch.py.
+
+resource "aws_glue_catalog_table" "gold_sketches" {
+  database_name = aws_glue_catalog_database.hsl.name
+  name          = "gold_sketches"
+
+  table_type = "EXTERNAL_TABLE"
+
+  parameters = {
+    "classification"             = "parquet"
+    "projection.enabled"         = "true"
+    "projection.year.type"       = "integer"
+    "projection.year.range"      = "2026,2035"
+    "projection.month.type"      = "integer"
+    "projection.month.range"     = "1,12"
+    "projection.month.digits"    = "2"
+    "projection.day.type"        = "integer"
+    "projection.day.range"       = "1,31"
+    "projection.day.digits"      = "2"
+    "projection.utc_hour.type"   = "integer"
+    "projection.utc_hour.range"  = "0,23"
+    "projection.utc_hour.digits" = "2"
+    "storage.location.template"  = "s3://${aws_s3_bucket.data_bucket[2].id}/sketches/year=$${year}/month=$${month}/day=$${day}/utc_hour=$${utc_hour}/"
+  }
+
+  storage_descriptor {
+    location      = "s3://${aws_s3_bucket.data_bucket[2].id}/sketches/"
+    input_format  = "org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat"
+    output_format = "org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat"
+
+    ser_de_info {
+      serialization_library = "org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe"
+    }
+
+    columns {
+      name    = "dimension"
+      type    = "string"
+      comment = "route (keyed by route_short_name) or stop (keyed by stop_id)"
+    }
+    columns {
+      name = "dimension_value"
+      type = "string"
+    }
+    columns {
+      name    = "hour"
+      type    = "bigint"
+      comment = "Unix seconds, start of the UTC hour of feed_timestamp"
+    }
+    columns {
+      name    = "bin_delay"
+      type    = "int"
+      comment = "Representative delay of the histogram bin, seconds"
+    }
+    columns {
+      name = "bin_count"
+      type = "int"
+    }
+  }
+
+  partition_keys {
+    name = "year"
+    type = "string"
+  }
+  partition_keys {
+    name = "month"
+    type = "string"
+  }
+  partition_keys {
+    name = "day"
+    type = "string"
+  }
+  partition_keys {
+    name = "utc_hour"
+    type = "string"
+  }
 }
 
 # =============================================================================
-# GOLD LAYER (Athena View - virtual semantic layer)
+# GOLD FALLBACK VIEW (computed from silver at query time)
 # =============================================================================
 #
-# The gold layer is implemented as a VIEW that joins silver realtime data
-# with reference tables on-demand. This is the "semantic layer" pattern:
-# - No data duplication (saves storage cost)
-# - Always fresh (computed at query time)
-# - No ETL pipeline needed for gold
-# - Athena handles the heavy lifting
+# flatten_data materializes gold (gold_realtime, gold_rollups, gold_sketches
+# above). This view joins silver_realtime with the reference tables instead,
+# for days flattened before gold files were written.
 #
 # To query: SELECT * FROM hsl_transport.gold_performance WHERE year='2026'
 
@@ -369,7 +1186,11 @@ resource "aws_athena_named_query" "create_gold_view" {
         stm.stop_sequence,
         stm.arrival_time as scheduled_arrival,
         date_format(from_unixtime(CAST(s.predicted_arrival AS bigint)), '%H:%i:%s') as predicted_arrival,
+        -- Against the trip's service day, as hsl_common.gold.compute_gold does:
+        -- noon Helsinki time on start_date minus 12h, plus the GTFS time
         CAST(s.predicted_arrival AS bigint) - (
+            CAST(to_unixtime(with_timezone(date_parse(s.start_date, '%Y%m%d') + INTERVAL '12' HOUR,
+                                           'Europe/Helsinki')) AS bigint) - 43200 +
             CAST(split_part(stm.arrival_time, ':', 1) AS bigint) * 3600 +
             CAST(split_part(stm.arrival_time, ':', 2) AS bigint) * 60 +
             CAST(split_part(stm.arrival_time, ':', 3) AS bigint)
@@ -377,17 +1198,23 @@ resource "aws_athena_named_query" "create_gold_view" {
         s.arrival_uncertainty,
         s.year,
         s.month,
-        s.day
+        s.day,
+        s.utc_hour,
+        s.route_bucket
     FROM silver_realtime s
+    LEFT JOIN ref_feed_versions fv
+        ON s.start_date BETWEEN fv.valid_from AND fv.valid_to
     LEFT JOIN ref_trips t
-        ON CAST(s.route_id AS bigint) = t.route_id
+        ON t.feed_version = fv.feed_version
+        AND s.route_id = t.route_id
         AND s.direction_id = t.direction_id
         AND s.start_time = t.start_time
     LEFT JOIN ref_stop_times stm
-        ON t.trip_id = stm.trip_id
+        ON stm.feed_version = t.feed_version
+        AND t.trip_id = stm.trip_id
         AND CAST(s.stop_id AS bigint) = stm.stop_id
     LEFT JOIN ref_routes r
-        ON CAST(s.route_id AS bigint) = r.route_id
+        ON s.route_id = r.route_id
     LEFT JOIN ref_stops st
         ON CAST(s.stop_id AS bigint) = st.stop_id
   EOT
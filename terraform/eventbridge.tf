@@ -11,6 +11,29 @@ resource "aws_cloudwatch_event_target" "start_pipeline" {
   role_arn = aws_iam_role.eventbridge.arn
 }
 
+# High-frequency collector: re-armed every 15 minutes, each run polls until
+# shortly before its 900 s timeout. Disabled by default; when enabling it,
+# disable hsl_schedule so snapshots are not collected twice.
+resource "aws_cloudwatch_event_rule" "collector_schedule" {
+  name                = "hsl-collector-schedule"
+  description         = "Restarts the high-frequency trip-updates collector"
+  schedule_expression = "rate(15 minutes)"
+  state               = "DISABLED"
+}
+
+resource "aws_cloudwatch_event_target" "collect_realtime" {
+  rule = aws_cloudwatch_event_rule.collector_schedule.name
+  arn  = aws_lambda_function.collect_realtime.arn
+}
+
+resource "aws_lambda_permission" "allow_eventbridge_collector" {
+  statement_id  = "AllowEventBridgeInvoke"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.collect_realtime.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.collector_schedule.arn
+}
+
 # Daily stats generation (for public dashboard)
 resource "aws_cloudwatch_event_rule" "daily_stats" {
   name                = "hsl-daily-stats"
@@ -31,3 +54,24 @@ resource "aws_lambda_permission" "allow_eventbridge_stats" {
   principal     = "events.amazonaws.com"
   source_arn    = aws_cloudwatch_event_rule.daily_stats.arn
 }
+
+# Daily silver compaction (merges yesterday's 15-minute snapshots)
+resource "aws_cloudwatch_event_rule" "daily_compaction" {
+  name                = "hsl-daily-compaction"
+  description         = "Compacts the previous day's silver snapshots"
+  schedule_expression = "cron(30 0 * * ? *)"  # 00:30 UTC daily
+  state               = "ENABLED"
+}
+
+resource "aws_cloudwatch_event_target" "compact_silver" {
+  rule = aws_cloudwatch_event_rule.daily_compaction.name
+  arn  = aws_lambda_function.compact_silver.arn
+}
+
+resource "aws_lambda_permission" "allow_eventbridge_compaction" {
+  statement_id  = "AllowEventBridgeInvoke"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.compact_silver.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.daily_compaction.arn
+}
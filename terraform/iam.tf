@@ -71,6 +71,11 @@ resource "aws_iam_role" "athena_query" {
   assume_role_policy = data.aws_iam_policy_document.athena_assume_role.json
 }
 
+resource "aws_iam_role" "lambda_compact" {
+  name               = "hsl-lambda-compact-role"
+  assume_role_policy = data.aws_iam_policy_document.lambda_assume_role.json
+}
+
 resource "aws_iam_role" "lambda_stats" {
   name               = "hsl-lambda-stats-role"
   assume_role_policy = data.aws_iam_policy_document.lambda_assume_role.json
@@ -84,6 +89,13 @@ data "aws_iam_policy_document" "lambda_fetch_permissions" {
     actions   = ["s3:PutObject"]
     resources = ["${aws_s3_bucket.data_bucket[0].arn}/*"]
   }
+
+  # Collector mode starts flatten for each batch it writes
+  statement {
+    effect    = "Allow"
+    actions   = ["lambda:InvokeFunction"]
+    resources = [aws_lambda_function.flatten_data.arn]
+  }
   statement {
     effect = "Allow"
     actions = [
@@ -101,10 +113,44 @@ data "aws_iam_policy_document" "lambda_flatten_permissions" {
     actions   = ["s3:GetObject"]
     resources = ["${aws_s3_bucket.data_bucket[0].arn}/*"]
   }
+  # PutObject also covers the multipart upload calls, except abort
+  statement {
+    effect  = "Allow"
+    actions = ["s3:PutObject", "s3:AbortMultipartUpload"]
+    resources = [
+      "${aws_s3_bucket.data_bucket[1].arn}/*",
+      "${aws_s3_bucket.data_bucket[2].arn}/*"
+    ]
+  }
+
+  # Schedule index for the materialized gold layer
   statement {
     effect    = "Allow"
-    actions   = ["s3:PutObject"]
-    resources = ["${aws_s3_bucket.data_bucket[1].arn}/*"]
+    actions   = ["s3:GetObject"]
+    resources = ["${aws_s3_bucket.data_bucket[3].arn}/schedule_index/*"]
+  }
+  statement {
+    effect    = "Allow"
+    actions   = ["s3:ListBucket"]
+    resources = [aws_s3_bucket.data_bucket[3].arn]
+  }
+
+  # Delta mode: previous snapshot state (ListBucket so a missing state is a 404)
+  statement {
+    effect    = "Allow"
+    actions   = ["s3:GetObject"]
+    resources = ["${aws_s3_bucket.data_bucket[1].arn}/delta_state/*"]
+  }
+  # Delta files staged until their state commits, then moved to delta/
+  statement {
+    effect    = "Allow"
+    actions   = ["s3:GetObject", "s3:DeleteObject"]
+    resources = ["${aws_s3_bucket.data_bucket[1].arn}/delta_staging/*"]
+  }
+  statement {
+    effect    = "Allow"
+    actions   = ["s3:ListBucket"]
+    resources = [aws_s3_bucket.data_bucket[1].arn]
   }
   statement {
     effect = "Allow"
@@ -203,12 +249,15 @@ data "aws_iam_policy_document" "eventbridge_permissions" {
 }
 
 data "aws_iam_policy_document" "lambda_stats_permissions" {
-  # Athena query execution
+  # Athena query execution (hsl_common.athena polls in batches and stops
+  # queries that outlive the timeout)
   statement {
     effect = "Allow"
     actions = [
       "athena:StartQueryExecution",
       "athena:GetQueryExecution",
+      "athena:BatchGetQueryExecution",
+      "athena:StopQueryExecution",
       "athena:GetQueryResults"
     ]
     resources = ["*"]
@@ -226,17 +275,18 @@ data "aws_iam_policy_document" "lambda_stats_permissions" {
     resources = ["*"]
   }
 
-  # S3 read for silver and reference
+  # S3 read for silver, gold and reference
   statement {
     effect  = "Allow"
     actions = ["s3:GetObject"]
     resources = [
       "${aws_s3_bucket.data_bucket[1].arn}/*",
+      "${aws_s3_bucket.data_bucket[2].arn}/*",
       "${aws_s3_bucket.data_bucket[3].arn}/*"
     ]
   }
 
-  # S3 write for query results and public JSON
+  # S3 write for query results, public JSON and history files
   statement {
     effect = "Allow"
     actions = [
@@ -246,6 +296,13 @@ data "aws_iam_policy_document" "lambda_stats_permissions" {
     resources = ["${aws_s3_bucket.data_bucket[4].arn}/*"]
   }
 
+  # generate_stats hands each finished day to hsl-stop-delays
+  statement {
+    effect    = "Allow"
+    actions   = ["lambda:InvokeFunction"]
+    resources = [aws_lambda_function.stop_delays.arn]
+  }
+
   # S3 list for partition discovery
   statement {
     effect = "Allow"
@@ -255,6 +312,7 @@ data "aws_iam_policy_document" "lambda_stats_permissions" {
     ]
     resources = [
       aws_s3_bucket.data_bucket[1].arn,
+      aws_s3_bucket.data_bucket[2].arn,
       aws_s3_bucket.data_bucket[3].arn,
       aws_s3_bucket.data_bucket[4].arn
     ]
@@ -272,6 +330,35 @@ data "aws_iam_policy_document" "lambda_stats_permissions" {
   }
 }
 
+data "aws_iam_policy_document" "lambda_compact_permissions" {
+  # Read snapshots, write compacted runs next to them, delete the inputs
+  statement {
+    effect = "Allow"
+    actions = [
+      "s3:GetObject",
+      "s3:PutObject",
+      "s3:DeleteObject"
+    ]
+    resources = ["${aws_s3_bucket.data_bucket[1].arn}/*"]
+  }
+
+  statement {
+    effect    = "Allow"
+    actions   = ["s3:ListBucket"]
+    resources = [aws_s3_bucket.data_bucket[1].arn]
+  }
+
+  statement {
+    effect = "Allow"
+    actions = [
+      "logs:CreateLogGroup",
+      "logs:CreateLogStream",
+      "logs:PutLogEvents"
+    ]
+    resources = ["*"]
+  }
+}
+
 data "aws_iam_policy_document" "athena_permissions" {
   # Athena itself
   statement {
@@ -279,6 +366,8 @@ data "aws_iam_policy_document" "athena_permissions" {
     actions = [
       "athena:StartQueryExecution",
       "athena:GetQueryExecution",
+      "athena:BatchGetQueryExecution",
+      "athena:StopQueryExecution",
       "athena:GetQueryResults"
     ]
     resources = ["*"]
@@ -385,6 +474,12 @@ resource "aws_iam_role_policy" "athena_query" {
   policy = data.aws_iam_policy_document.athena_permissions.json
 }
 
+resource "aws_iam_role_policy" "lambda_compact" {
+  name   = "lambda-compact-policy"
+  role   = aws_iam_role.lambda_compact.id
+  policy = data.aws_iam_policy_document.lambda_compact_permissions.json
+}
+
 resource "aws_iam_role_policy" "lambda_stats" {
   name   = "lambda-stats-policy"
   role   = aws_iam_role.lambda_stats.id
@@ -10,6 +10,18 @@ data "archive_file" "flatten_data" {
   output_path = "${path.module}/zip/flatten_data.zip"
 }
 
+data "archive_file" "compact_silver" {
+  type        = "zip"
+  source_dir  = "${path.module}/../lambdas/compact_silver"
+  output_path = "${path.module}/zip/compact_silver.zip"
+}
+
+data "archive_file" "common_layer" {
+  type        = "zip"
+  source_dir  = "${path.module}/../layers/common"
+  output_path = "${path.module}/zip/common_layer.zip"
+}
+
 data "archive_file" "generate_stats" {
   type        = "zip"
   source_dir  = "${path.module}/../lambdas/generate_stats"
@@ -20,16 +32,46 @@ resource "aws_lambda_function" "fetch_realtime" {
   function_name    = "hsl-fetch-realtime"
   filename         = data.archive_file.fetch_realtime.output_path
   source_code_hash = data.archive_file.fetch_realtime.output_base64sha256
-  layers           = [aws_lambda_layer_version.dependencies.arn]
+  layers           = [aws_lambda_layer_version.dependencies.arn, aws_lambda_layer_version.common.arn]
   handler          = "handler.lambda_handler"
   runtime          = "python3.12"
   role             = aws_iam_role.lambda_fetch.arn
-  timeout          = 30
+  # Above the longest feed budget (fetch_realtime/handler.py feed_budget: 30 s)
+  timeout          = 45
   memory_size      = 256
 
   environment {
     variables = {
       BRONZE_BUCKET = aws_s3_bucket.data_bucket[0].id
+      BRONZE_CODEC  = "zstd"
+      # Fetched concurrently; see hsl_common/feeds.py
+      FEEDS         = "trip_updates,vehicle_positions,service_alerts"
+    }
+  }
+}
+
+# High-frequency mode: the same package, polling every POLL_INTERVAL seconds
+# for one 15-minute window per invocation (see collector.py). Its schedule
+# starts disabled; enable it and disable hsl-pipeline-schedule to switch.
+resource "aws_lambda_function" "collect_realtime" {
+  function_name    = "hsl-collect-realtime"
+  filename         = data.archive_file.fetch_realtime.output_path
+  source_code_hash = data.archive_file.fetch_realtime.output_base64sha256
+  layers           = [aws_lambda_layer_version.dependencies.arn, aws_lambda_layer_version.common.arn]
+  handler          = "collector.lambda_handler"
+  runtime          = "python3.12"
+  role             = aws_iam_role.lambda_fetch.arn
+  timeout          = 900
+  memory_size      = 256
+
+  environment {
+    variables = {
+      BRONZE_BUCKET    = aws_s3_bucket.data_bucket[0].id
+      FLATTEN_FUNCTION = aws_lambda_function.flatten_data.function_name
+      POLL_INTERVAL    = "10"
+      BATCH_SNAPSHOTS  = "30"
+      BATCH_SECONDS    = "300"
+      BRONZE_CODEC     = "zstd"
     }
   }
 }
@@ -38,7 +80,7 @@ resource "aws_lambda_function" "flatten_data" {
   function_name    = "hsl-flatten-data"
   filename         = data.archive_file.flatten_data.output_path
   source_code_hash = data.archive_file.flatten_data.output_base64sha256
-  layers           = [aws_lambda_layer_version.dependencies.arn]
+  layers           = [aws_lambda_layer_version.dependencies.arn, aws_lambda_layer_version.common.arn]
   handler          = "handler.lambda_handler"
   runtime          = "python3.12"
   role             = aws_iam_role.lambda_flatten.arn
@@ -47,8 +89,14 @@ resource "aws_lambda_function" "flatten_data" {
 
   environment {
     variables = {
-      BRONZE_BUCKET = aws_s3_bucket.data_bucket[0].id
-      SILVER_BUCKET = aws_s3_bucket.data_bucket[1].id
+      BRONZE_BUCKET      = aws_s3_bucket.data_bucket[0].id
+      SILVER_BUCKET      = aws_s3_bucket.data_bucket[1].id
+      GOLD_BUCKET        = aws_s3_bucket.data_bucket[2].id
+      REFERENCE_BUCKET   = aws_s3_bucket.data_bucket[3].id
+      # "delta" stores only changed predictions (silver_delta); see hsl_common/delta.py
+      SILVER_MODE        = "snapshot"
+      # Rows per Parquet row group while streaming; bounds flatten's memory
+      FLATTEN_CHUNK_ROWS = "50000"
     }
   }
 }
@@ -57,6 +105,7 @@ resource "aws_lambda_function" "generate_stats" {
   function_name    = "hsl-generate-stats"
   filename         = data.archive_file.generate_stats.output_path
   source_code_hash = data.archive_file.generate_stats.output_base64sha256
+  layers           = [aws_lambda_layer_version.dependencies.arn, aws_lambda_layer_version.common.arn]
   handler          = "handler.lambda_handler"
   runtime          = "python3.12"
   role             = aws_iam_role.lambda_stats.arn
@@ -65,8 +114,78 @@ resource "aws_lambda_function" "generate_stats" {
 
   environment {
     variables = {
-      OUTPUT_BUCKET  = aws_s3_bucket.data_bucket[4].id  # athena-results bucket
-      RESULTS_BUCKET = aws_s3_bucket.data_bucket[4].id
+      OUTPUT_BUCKET        = aws_s3_bucket.data_bucket[4].id  # athena-results bucket
+      RESULTS_BUCKET       = aws_s3_bucket.data_bucket[4].id
+      GOLD_BUCKET          = aws_s3_bucket.data_bucket[2].id
+      # Invoked asynchronously for each finished day (see stop_delays.py)
+      STOP_DELAYS_FUNCTION = aws_lambda_function.stop_delays.function_name
+    }
+  }
+}
+
+# Same package: one day's stop delays from gold (see stop_delays.py), with
+# its own timeout rather than what Athena leaves of generate_stats'
+resource "aws_lambda_function" "stop_delays" {
+  function_name    = "hsl-stop-delays"
+  filename         = data.archive_file.generate_stats.output_path
+  source_code_hash = data.archive_file.generate_stats.output_base64sha256
+  layers           = [aws_lambda_layer_version.dependencies.arn, aws_lambda_layer_version.common.arn]
+  handler          = "stop_delays.lambda_handler"
+  runtime          = "python3.12"
+  role             = aws_iam_role.lambda_stats.arn
+  timeout          = 300
+  # Two utc_hour partitions of gold in memory at a time (hsl_common.propagation)
+  memory_size      = 1024
+
+  environment {
+    variables = {
+      OUTPUT_BUCKET         = aws_s3_bucket.data_bucket[4].id
+      GOLD_BUCKET           = aws_s3_bucket.data_bucket[2].id
+      GOLD_READ_CONCURRENCY = "16"
+    }
+  }
+}
+
+# Same package: regenerates daily stats over a date range (see backfill.py).
+# Invoked by hand; re-invoke with the same range if it returns "remaining".
+resource "aws_lambda_function" "backfill_stats" {
+  function_name    = "hsl-backfill-stats"
+  filename         = data.archive_file.generate_stats.output_path
+  source_code_hash = data.archive_file.generate_stats.output_base64sha256
+  layers           = [aws_lambda_layer_version.dependencies.arn, aws_lambda_layer_version.common.arn]
+  handler          = "backfill.lambda_handler"
+  runtime          = "python3.12"
+  role             = aws_iam_role.lambda_stats.arn
+  timeout          = 900
+  memory_size      = 512
+
+  environment {
+    variables = {
+      OUTPUT_BUCKET         = aws_s3_bucket.data_bucket[4].id
+      RESULTS_BUCKET        = aws_s3_bucket.data_bucket[4].id
+      GOLD_BUCKET           = aws_s3_bucket.data_bucket[2].id
+      BACKFILL_CONCURRENCY  = "4"
+      QUERY_TIMEOUT         = "300"
+      # One asynchronous invocation per day, sized for one day (see stop_delays.py)
+      STOP_DELAYS_FUNCTION  = aws_lambda_function.stop_delays.function_name
+    }
+  }
+}
+
+resource "aws_lambda_function" "compact_silver" {
+  function_name    = "hsl-compact-silver"
+  filename         = data.archive_file.compact_silver.output_path
+  source_code_hash = data.archive_file.compact_silver.output_base64sha256
+  layers           = [aws_lambda_layer_version.dependencies.arn, aws_lambda_layer_version.common.arn]
+  handler          = "handler.lambda_handler"
+  runtime          = "python3.12"
+  role             = aws_iam_role.lambda_compact.arn
+  timeout          = 300
+  memory_size      = 2048
+
+  environment {
+    variables = {
+      SILVER_BUCKET = aws_s3_bucket.data_bucket[1].id
     }
   }
 }
@@ -80,3 +199,11 @@ resource "aws_lambda_layer_version" "dependencies" {
   compatible_runtimes = ["python3.12"]
   source_code_hash    = filebase64sha256("${path.module}/../layers/lambda_layer.zip")
 }
+
+# Shared pipeline code (layers/common/python/hsl_common)
+resource "aws_lambda_layer_version" "common" {
+  layer_name          = "hsl-common"
+  filename            = data.archive_file.common_layer.output_path
+  compatible_runtimes = ["python3.12"]
+  source_code_hash    = data.archive_file.common_layer.output_base64sha256
+}
@@ -13,6 +13,39 @@ resource "aws_s3_bucket" "data_bucket" {
   }
 }
 
+# Flatten streams into multipart uploads; a run killed mid-upload (a Lambda
+# timeout) cannot abort its own, so silver and gold drop leftovers after a day
+resource "aws_s3_bucket_lifecycle_configuration" "abort_incomplete_uploads" {
+  for_each = { silver = 1, gold = 2 }
+  bucket   = aws_s3_bucket.data_bucket[each.value].id
+
+  rule {
+    id     = "abort-incomplete-multipart-uploads"
+    status = "Enabled"
+    filter {}
+
+    abort_incomplete_multipart_upload {
+      days_after_initiation = 1
+    }
+  }
+
+  # Delta files a flatten staged but neither published nor cleaned up (it
+  # died between the two); the next flatten publishes committed ones
+  dynamic "rule" {
+    for_each = each.key == "silver" ? [1] : []
+    content {
+      id     = "expire-staged-deltas"
+      status = "Enabled"
+      filter {
+        prefix = "delta_staging/"
+      }
+      expiration {
+        days = 7
+      }
+    }
+  }
+}
+
 # Allow public read on results bucket for the public dashboard JSON
 resource "aws_s3_bucket_public_access_block" "results_public" {
   bucket = aws_s3_bucket.data_bucket[4].id
@@ -3,7 +3,7 @@ resource "aws_sfn_state_machine" "hsl_pipeline" {
   role_arn = aws_iam_role.step_functions.arn
 
   definition = jsonencode({
-    Comment = "HSL realtime data pipeline - Bronze -> Silver (Gold is a view)"
+    Comment = "HSL realtime data pipeline - Bronze -> Silver + Gold (flatten writes both)"
     StartAt = "FetchRealtimeData"
     States = {
       FetchRealtimeData = {
@@ -23,19 +23,40 @@ resource "aws_sfn_state_machine" "hsl_pipeline" {
             Next        = "PipelineFailed"
           }
         ]
-        Next = "FlattenData"
+        Next = "FlattenFeeds"
       }
-      FlattenData = {
-        Type     = "Task"
-        Resource = aws_lambda_function.flatten_data.arn
-        Retry = [
-          {
-            ErrorEquals     = ["States.ALL"]
-            IntervalSeconds = 10
-            MaxAttempts     = 2
-            BackoffRate     = 2.0
+
+      # One flatten per feed fetched (trip updates, vehicle positions,
+      # service alerts), all at once; each item is one entry of the fetch
+      # output's feeds list
+      FlattenFeeds = {
+        Type           = "Map"
+        ItemsPath      = "$.feeds"
+        MaxConcurrency = 0
+        ItemProcessor = {
+          ProcessorConfig = {
+            Mode = "INLINE"
           }
-        ]
+          StartAt = "FlattenData"
+          States = {
+            FlattenData = {
+              Type     = "Task"
+              Resource = aws_lambda_function.flatten_data.arn
+              Retry = [
+                {
+                  ErrorEquals     = ["States.ALL"]
+                  IntervalSeconds = 10
+                  MaxAttempts     = 2
+                  BackoffRate     = 2.0
+                }
+              ]
+              End = true
+            }
+          }
+        }
+
+        # Keep the fetch output (and its metrics) next to the flatten outputs in the execution output
+        ResultPath = "$.flatten"
         Catch = [
           {
             ErrorEquals = ["States.ALL"]
@@ -56,11 +77,9 @@ resource "aws_sfn_state_machine" "hsl_pipeline" {
   })
 }
 
-# Note: The Gold layer (gold_performance) is implemented as an Athena VIEW
-# that joins silver_realtime with reference tables on-demand.
-# See athena.tf for the view definition.
-#
-# This is the "semantic layer" pattern:
-# - No ETL step needed (no data movement)
-# - Always fresh (computed at query time)
-# - Lower storage cost (no data duplication)
+# Note: flatten_data materializes gold next to silver: per-prediction delays
+# (performance/, the gold_realtime table), hourly per-route rollups
+# (rollups/) and delay sketches (sketches/), all keyed by the bronze
+# snapshot. There is no separate gold step; the state machine ends once every
+# feed is flattened. The gold_performance view in athena.tf computes the same
+# delays from silver and only serves days without gold files.
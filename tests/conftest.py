@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# hsl_common lives in the Lambda layer, as it does for the local scripts
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "layers" / "common" / "python"))
@@ -0,0 +1,173 @@
+import io
+
+import pytest
+from botocore.response import StreamingBody
+
+from hsl_common import athena
+from hsl_common.athena import AthenaRunner, QueryError, QueryTimeout, parse_csv
+
+COLUMNS = [("route", "varchar"), ("first_feed", "timestamp"), ("count", "bigint")]
+
+
+class StubAthena:
+    """get_query_results: column types, and the rows when paged through."""
+
+    def __init__(self, rows=()):
+        self.rows = rows
+
+    def _page(self, rows):
+        return {"ResultSet": {
+            "ResultSetMetadata": {"ColumnInfo": [{"Name": name, "Type": kind} for name, kind in COLUMNS]},
+            "Rows": [{"Data": [{} if value is None else {"VarCharValue": value} for value in row]} for row in rows],
+        }}
+
+    def get_query_results(self, QueryExecutionId, MaxResults):
+        return self._page([[name for name, _ in COLUMNS]][:MaxResults])
+
+    def get_paginator(self, name):
+        page = self._page([[name for name, _ in COLUMNS]] + list(self.rows))
+        return type("Paginator", (), {"paginate": lambda _, **kwargs: [page]})()
+
+
+class ScriptedAthena:
+    """
+    batch_get_query_execution answering from a script: states[query_id] is
+    the state at each poll round, the last one repeating.
+    """
+
+    def __init__(self, states, reasons=None):
+        self.states = states
+        self.reasons = reasons or {}
+        self.rounds = {query_id: 0 for query_id in states}
+        self.batches = []
+        self.stopped = []
+
+    def batch_get_query_execution(self, QueryExecutionIds):
+        self.batches.append(len(QueryExecutionIds))
+        executions = []
+        for query_id in QueryExecutionIds:
+            script = self.states[query_id]
+            state = script[min(self.rounds[query_id], len(script) - 1)]
+            self.rounds[query_id] += 1
+            status = {"State": state}
+            if query_id in self.reasons:
+                status["StateChangeReason"] = self.reasons[query_id]
+            executions.append({"QueryExecutionId": query_id, "Status": status})
+        return {"QueryExecutions": executions}
+
+    def stop_query_execution(self, QueryExecutionId):
+        self.stopped.append(QueryExecutionId)
+
+
+class FakeClock:
+    """A monotonic clock that only moves when the runner sleeps."""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(round(seconds, 4))
+        self.now += seconds
+
+
+def scripted_runner(states, timeout=10.0, **kwargs):
+    client = ScriptedAthena(states, **kwargs)
+    clock = FakeClock()
+    runner = AthenaRunner(client, "s3://results/", timeout=timeout, initial_delay=0.2, max_delay=1.0,
+                          backoff=2.0, sleep=clock.sleep, clock=clock)
+    return runner, client, clock
+
+
+class StubS3:
+    def __init__(self, body):
+        self.body = body
+
+    def get_object(self, Bucket, Key):
+        body = self.body.encode()
+        return {"Body": StreamingBody(io.BytesIO(body), len(body))}
+
+
+def test_parse_csv_tells_null_from_empty_string():
+    text = '"route","first_feed","count"\n"",,\n"a,""b""\nc","2026-02-13 05:00:00.000","3"\r\n'
+    assert list(parse_csv(text)) == [
+        ["route", "first_feed", "count"],
+        ["", None, None],
+        ['a,"b"\nc', "2026-02-13 05:00:00.000", "3"],
+    ]
+
+
+def test_csv_results_null_strings_are_none():
+    body = '"route","first_feed","count"\n,,"0"\n"","2026-02-13 05:00:00.000",\n'
+    runner = AthenaRunner(StubAthena(), "s3://results/", s3=StubS3(body))
+    rows = runner.read_csv_results("q", "s3://results/q.csv")
+    assert rows == [
+        {"route": None, "first_feed": None, "count": 0},
+        {"route": "", "first_feed": "2026-02-13 05:00:00.000", "count": None},
+    ]
+
+
+def test_paged_results_null_strings_are_none():
+    runner = AthenaRunner(StubAthena([[None, None, "0"], ["", "2026-02-13 05:00:00.000", None]]), "s3://results/")
+    assert runner.results("q") == [
+        {"route": None, "first_feed": None, "count": 0},
+        {"route": "", "first_feed": "2026-02-13 05:00:00.000", "count": None},
+    ]
+
+
+def test_csv_results_stream_across_chunks(monkeypatch):
+    # Chunks smaller than a record, and a quoted value spanning lines
+    monkeypatch.setattr(athena, "CSV_CHUNK_BYTES", 7)
+    body = '"route","first_feed","count"\r\n"a\r\nb,""c""",,"1"\r\n"ä",,\r\n'
+    runner = AthenaRunner(StubAthena(), "s3://results/", s3=StubS3(body))
+    assert runner.read_csv_results("q", "s3://results/q.csv") == [
+        {"route": 'a\r\nb,"c"', "first_feed": None, "count": 1},
+        {"route": "ä", "first_feed": None, "count": None},
+    ]
+
+
+def test_wait_polls_in_batches_until_every_query_succeeds():
+    states = {f"q{i}": ["RUNNING", "SUCCEEDED"] for i in range(120)}
+    runner, client, clock = scripted_runner(states)
+    finished = runner.wait(list(states))
+    assert set(finished) == set(states)
+    # Two rounds of 50 + 50 + 20, one sleep between them
+    assert client.batches == [50, 50, 20, 50, 50, 20]
+    assert clock.sleeps == [0.4]
+
+
+def test_wait_backs_off_while_nothing_changes_and_resets_on_progress():
+    runner, client, clock = scripted_runner({
+        "fast": ["RUNNING"] * 3 + ["SUCCEEDED"],
+        "slow": ["QUEUED"] * 7 + ["SUCCEEDED"],
+    })
+    runner.wait(["fast", "slow"])
+    # Doubles to the 1 s cap, back to 0.2 s after "fast" finishes, then up again
+    assert clock.sleeps == [0.4, 0.8, 1.0, 0.2, 0.4, 0.8, 1.0]
+    assert client.stopped == []
+
+
+def test_wait_times_out_and_stops_what_is_still_running():
+    runner, client, clock = scripted_runner({"done": ["SUCCEEDED"], "stuck": ["RUNNING"], "queued": ["QUEUED"]},
+                                            timeout=3.0)
+    with pytest.raises(QueryTimeout) as raised:
+        runner.wait(["done", "stuck", "queued"])
+    assert raised.value.state == "TIMEOUT"
+    assert client.stopped == ["stuck", "queued"]
+    # The last sleep is cut to what is left of the budget
+    assert clock.sleeps == [0.2, 0.4, 0.8, 1.0, 0.6]
+    assert clock.now == pytest.approx(3.0)
+
+
+@pytest.mark.parametrize("state", ["FAILED", "CANCELLED"])
+def test_wait_raises_on_a_failed_query_and_stops_the_rest(state):
+    runner, client, clock = scripted_runner({"ok": ["SUCCEEDED"], "bad": ["RUNNING", state], "slow": ["RUNNING"]},
+                                            reasons={"bad": "SYNTAX_ERROR"})
+    with pytest.raises(QueryError) as raised:
+        runner.wait(["ok", "bad", "slow"])
+    assert not isinstance(raised.value, QueryTimeout)
+    assert (raised.value.query_id, raised.value.state, raised.value.reason) == ("bad", state, "SYNTAX_ERROR")
+    assert client.stopped == ["slow"]
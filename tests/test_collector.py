@@ -0,0 +1,121 @@
+import sys
+import threading
+from http.server import ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+from hsl_common.bronze import read_snapshots
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "benchmarks"))
+sys.path.insert(0, str(ROOT / "lambdas" / "fetch_realtime"))
+from collector import Collector, FeedPoller, LocalSink  # noqa: E402
+from feed_stub import FeedStub, load_recorded, make_handler, synthetic  # noqa: E402
+
+# header.timestamp's length says more bytes follow than there are
+CORRUPT = b"\x0a\xff"
+
+
+@pytest.fixture
+def recorded(tmp_path):
+    """Three snapshots 15 s apart, recorded as bronze .pb objects and read back."""
+    directory = tmp_path / "recorded"
+    directory.mkdir()
+    for index, body in enumerate(synthetic(3, n_trips=5, stops_per_trip=3, period=15)):
+        (directory / f"{index:06d}.pb").write_bytes(body)
+    return load_recorded(directory)
+
+
+@pytest.fixture
+def serve():
+    """serve(snapshots, validators) → (url, advance): a local feed on its own clock."""
+    servers = []
+
+    def start(snapshots, validators=True):
+        now = [0.0]
+        stub = FeedStub(snapshots, period=1, validators=validators, clock=lambda: now[0])
+        server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(stub))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+
+        def advance():
+            now[0] += 1
+
+        return f"http://127.0.0.1:{server.server_address[1]}/", advance
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+class FlakySink(LocalSink):
+    """Fails its first `failures` writes."""
+
+    def __init__(self, directory, failures):
+        super().__init__(directory)
+        self.failures = failures
+
+    def write(self, key, body, frames):
+        if self.failures:
+            self.failures -= 1
+            raise OSError("bucket unavailable")
+        super().write(key, body, frames)
+
+
+def written(directory):
+    return [snapshot for path in sorted(Path(directory).rglob("*.hslb"))
+            for snapshot in read_snapshots(path.name, path.read_bytes())]
+
+
+def make_collector(url, sink, **kwargs):
+    return Collector(FeedPoller(url, timeout=5), sink, codec="zstd", sleep=lambda seconds: None, **kwargs)
+
+
+def test_unchanged_feed_is_a_304_and_new_snapshots_are_batched(serve, recorded, tmp_path):
+    url, advance = serve(recorded)
+    run = make_collector(url, LocalSink(tmp_path / "bronze"), batch_snapshots=2)
+    run.step()
+    run.step()  # same snapshot: If-None-Match answered with 304
+    advance()
+    run.step()  # second new snapshot fills the batch
+    summary = run.summary()
+    assert (summary["polls"], summary["not_modified"], summary["snapshots"], summary["batches"]) == (3, 1, 2, 1)
+    assert written(tmp_path / "bronze") == recorded[:2]
+
+
+def test_repeated_header_timestamp_is_dropped_without_validators(serve, recorded, tmp_path):
+    url, advance = serve([recorded[0], recorded[0], recorded[1]], validators=False)
+    run = make_collector(url, LocalSink(tmp_path / "bronze"))
+    for _ in range(3):
+        run.step()
+        advance()
+    run.final_flush()
+    summary = run.summary()
+    assert (summary["not_modified"], summary["duplicates"], summary["snapshots"]) == (0, 1, 2)
+    assert written(tmp_path / "bronze") == [recorded[0], recorded[1]]
+
+
+def test_corrupt_body_costs_one_sample_and_is_fetched_again(serve, recorded, tmp_path):
+    url, advance = serve([CORRUPT, recorded[0]])
+    run = make_collector(url, LocalSink(tmp_path / "bronze"))
+    run.step()
+    assert (run.errors, run.poller.etag, run.batch) == (1, None, [])
+    advance()
+    run.step()
+    run.final_flush()
+    assert written(tmp_path / "bronze") == [recorded[0]]
+
+
+def test_failed_write_keeps_the_batch_for_the_next_flush(serve, recorded, tmp_path):
+    url, advance = serve(recorded)
+    run = make_collector(url, FlakySink(tmp_path / "bronze", failures=2), batch_snapshots=2)
+    for _ in range(3):
+        run.step()
+        advance()
+    # Both flushes while polling failed; the final flush writes all three
+    run.final_flush()
+    summary = run.summary()
+    assert (summary["write_errors"], summary["unwritten"], summary["batches"]) == (2, 0, 1)
+    assert written(tmp_path / "bronze") == recorded
@@ -0,0 +1,51 @@
+import io
+import json
+import sys
+from pathlib import Path
+
+from botocore.exceptions import ClientError
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "lambdas" / "generate_stats"))
+import handler  # noqa: E402
+
+
+class StubS3:
+    """get_object and conditional put_object (IfMatch / IfNoneMatch) over a dict."""
+
+    class exceptions:
+        ClientError = ClientError
+
+        class NoSuchKey(Exception):
+            pass
+
+    def __init__(self):
+        self.objects = {}
+        self.versions = 0
+        self.before_put = None
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise self.exceptions.NoSuchKey(Key)
+        body, etag = self.objects[Key]
+        return {"Body": io.BytesIO(body.encode()), "ETag": etag}
+
+    def put_object(self, Bucket, Key, Body, ContentType, IfMatch=None, IfNoneMatch=None):
+        if self.before_put:
+            hook, self.before_put = self.before_put, None
+            hook()
+        current = self.objects.get(Key)
+        if (IfNoneMatch and current) or (IfMatch and (not current or current[1] != IfMatch)):
+            raise ClientError({"Error": {"Code": "PreconditionFailed"}}, "PutObject")
+        self.versions += 1
+        self.objects[Key] = (Body, f'"{self.versions}"')
+
+
+def test_concurrent_index_writers_keep_each_others_days(monkeypatch):
+    monkeypatch.setattr(handler.time, "sleep", lambda seconds: None)
+    s3 = StubS3()
+    handler.record_days(s3, {"2026-02-01": {"key": "a"}})
+    # Another writer records its day between this writer's read and PUT
+    s3.before_put = lambda: handler.record_days(s3, {"2026-02-02": {"key": "b"}})
+    index = handler.record_days(s3, {"2026-02-03": {"key": "c"}})
+    assert list(index["days"]) == ["2026-02-01", "2026-02-02", "2026-02-03"]
+    assert json.loads(s3.objects[handler.DAILY_INDEX_KEY][0])["days"] == index["days"]
@@ -0,0 +1,140 @@
+import importlib.util
+import io
+import os
+import random
+import sys
+from pathlib import Path
+
+import pyarrow.parquet as pq
+import pytest
+from botocore.exceptions import ClientError
+
+from hsl_common.delta import as_of
+from hsl_common.feed import feed_to_columns
+from hsl_common.metrics import Metrics
+from hsl_common.silver import columns_to_table
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "benchmarks"))
+from bench_delta import evolve, sorted_rows  # noqa: E402
+from synthetic_feed import FEED_TIMESTAMP, build_feed  # noqa: E402
+
+os.environ.setdefault("SILVER_BUCKET", "silver")
+os.environ.setdefault("AWS_DEFAULT_REGION", "eu-north-1")
+# Loaded under its own name: other tests import generate_stats' handler
+spec = importlib.util.spec_from_file_location("flatten_handler", ROOT / "lambdas" / "flatten_data" / "handler.py")
+handler = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(handler)
+
+
+def not_found(operation):
+    return ClientError({"Error": {"Code": "NoSuchKey"}}, operation)
+
+
+class StubS3:
+    """One bucket: head/get/put (IfMatch / IfNoneMatch, Metadata), copy and delete."""
+
+    class exceptions:
+        ClientError = ClientError
+
+    def __init__(self):
+        self.objects = {}
+        self.versions = 0
+        self.before_state_put = None
+
+    def head_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise ClientError({"Error": {"Code": "404"}}, "HeadObject")
+        _, etag, metadata = self.objects[Key]
+        return {"ETag": etag, "Metadata": metadata}
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise not_found("GetObject")
+        return {"Body": io.BytesIO(self.objects[Key][0])}
+
+    def put_object(self, Bucket, Key, Body, ContentType=None, Metadata=None, IfMatch=None, IfNoneMatch=None):
+        if Key == handler.DELTA_STATE_KEY and self.before_state_put:
+            hook, self.before_state_put = self.before_state_put, None
+            hook()
+        current = self.objects.get(Key)
+        if (IfNoneMatch and current) or (IfMatch and (not current or current[1] != IfMatch)):
+            raise ClientError({"Error": {"Code": "PreconditionFailed"}}, "PutObject")
+        self.versions += 1
+        body = Body.getvalue() if hasattr(Body, "getvalue") else Body
+        self.objects[Key] = (body, f'"{self.versions}"', Metadata or {})
+        return {"ETag": f'"{self.versions}"'}
+
+    def copy_object(self, Bucket, Key, CopySource):
+        if CopySource["Key"] not in self.objects:
+            raise not_found("CopyObject")
+        body = self.objects[CopySource["Key"]][0]
+        self.put_object(Bucket, Key, body)
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop(Key, None)
+
+    def keys(self, prefix):
+        return sorted(key for key in self.objects if key.startswith(prefix))
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    stub = StubS3()
+    monkeypatch.setattr(handler, "s3", stub)
+    monkeypatch.setattr(handler, "_delta_state", {"table": None, "etag": None, "published": None})
+    return stub
+
+
+@pytest.fixture
+def snapshots():
+    """Four silver snapshots 10 s apart, each re-predicting some trips."""
+    rng = random.Random(0)
+    feed = build_feed(40, 10)
+    tables = []
+    for i in range(4):
+        if i:
+            feed = evolve(feed, rng, 0.2, FEED_TIMESTAMP + 10 * i, i)
+        tables.append(columns_to_table(feed_to_columns(feed)))
+    return tables
+
+
+def flatten(snapshot, index):
+    return handler.write_delta(snapshot, f"{index:06d}.parquet", Metrics("test"))
+
+
+def rebuilt(s3, timestamp):
+    return as_of([pq.read_table(io.BytesIO(s3.objects[key][0])) for key in s3.keys("delta/")], timestamp)
+
+
+def test_flatten_that_loses_the_state_race_leaves_no_delta(s3, snapshots):
+    flatten(snapshots[0], 0)
+    # Another flatten commits snapshot 2 between this one's diff and its state PUT
+    s3.before_state_put = lambda: flatten(snapshots[2], 2)
+    with pytest.raises(ClientError):
+        flatten(snapshots[1], 1)
+
+    assert s3.keys(handler.DELTA_STAGING_PREFIX) == []
+    assert [key.rsplit("/", 1)[1] for key in s3.keys("delta/")] == ["000000.parquet", "000002.parquet"]
+    # The retry finds snapshot 1 older than the state and writes nothing
+    assert flatten(snapshots[1], 1) == []
+    assert sorted_rows(rebuilt(s3, FEED_TIMESTAMP + 25)) == sorted_rows(snapshots[2])
+
+
+def test_committed_deltas_are_published_by_the_next_flatten(s3, snapshots, monkeypatch):
+    flatten(snapshots[0], 0)
+
+    def die(token, delta_keys):
+        raise TimeoutError("killed after the state commit")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(handler, "publish_deltas", die)
+        with pytest.raises(TimeoutError):
+            flatten(snapshots[1], 1)
+    assert len(s3.keys(handler.DELTA_STAGING_PREFIX)) == 1
+
+    flatten(snapshots[2], 2)
+    assert s3.keys(handler.DELTA_STAGING_PREFIX) == []
+    for snapshot in snapshots[:3]:
+        timestamp = snapshot["feed_timestamp"][0].as_py()
+        assert sorted_rows(rebuilt(s3, timestamp + 5)) == sorted_rows(snapshot)
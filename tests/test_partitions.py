@@ -0,0 +1,68 @@
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from hsl_common.gold import GOLD_SCHEMA
+from hsl_common.partitions import ROUTE_BUCKETS, route_bucket, route_predicate, split_partitions
+
+duckdb = pytest.importorskip("duckdb")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "dashboard"))
+from result_store import route_stops_query  # noqa: E402
+
+END = datetime(2026, 2, 13, 12, tzinfo=timezone.utc)
+# Routes in different buckets
+ROUTES = {}
+for number in range(1000, 1100):
+    ROUTES.setdefault(route_bucket(str(number)), str(number))
+    if len(ROUTES) == ROUTE_BUCKETS:
+        break
+
+
+def gold_rows(hours):
+    """Ten predictions (delay 60 s at each of stops 1-2) per route per hour before END."""
+    rows = []
+    for hour in range(hours):
+        moment = int((END - timedelta(hours=hour + 1)).timestamp()) + 60
+        for route_id in ROUTES.values():
+            for stop_sequence in (1, 2) * 5:
+                rows.append({"feed_timestamp": moment, "route_id": route_id, "route_short_name": route_id,
+                             "trip_id": f"{route_id}-1", "direction_id": 0, "stop_id": str(stop_sequence),
+                             "stop_name": f"Stop {stop_sequence}", "stop_sequence": stop_sequence,
+                             "delay_seconds": 60})
+    return pa.Table.from_pylist(rows, schema=GOLD_SCHEMA)
+
+
+@pytest.fixture
+def gold_root(tmp_path):
+    for path, rows in split_partitions(gold_rows(hours=8), "feed_timestamp", 0, "route_id"):
+        directory = tmp_path / "gold" / "performance" / path
+        directory.mkdir(parents=True)
+        pq.write_table(rows, directory / "000000.parquet")
+    return tmp_path
+
+
+def test_route_predicate_names_only_the_routes_buckets():
+    route_id = ROUTES[3]
+    assert f"route_bucket IN ('3') AND route_id IN ('{route_id}')" in route_predicate([route_id])
+    with pytest.raises(ValueError):
+        route_predicate([])
+
+
+def test_route_query_reads_only_its_hours_and_bucket(gold_root):
+    from hsl_common.local_engine import LocalRunner
+
+    runner = LocalRunner(gold_root)
+    query = route_stops_query([ROUTES[5]], END, hours=3)
+    rows = runner.run(query)
+    assert [(row["stop_sequence"], row["predictions"], row["avg_delay_min"]) for row in rows] == [
+        (1, 15, 1.0), (2, 15, 1.0),
+    ]
+
+    # 8 hours x 8 buckets written; the 3 hours of route bucket 5 are read
+    plan = runner.connection.execute(f"EXPLAIN ANALYZE {query}").fetchall()[0][1]
+    assert "Total Files Read: 3" in plan
+    assert "Scanning Files: 3/64" in plan
@@ -0,0 +1,96 @@
+import io
+import json
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from hsl_common import propagation
+from hsl_common.gold import GOLD_SCHEMA
+from hsl_common.metrics import Metrics
+from hsl_common.partitions import split_partitions
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "lambdas" / "generate_stats"))
+import handler  # noqa: E402
+
+DAY = datetime(2026, 2, 13)
+
+
+def gold_rows():
+    """Two trips a route per hour for hours 5-7, delay growing by 30 s a stop."""
+    rows = []
+    start = int(DAY.replace(tzinfo=timezone.utc).timestamp())
+    for hour in (5, 6, 7):
+        for route_id in ("1001", "1002", "1003"):
+            for trip in range(2):
+                for stop_sequence in (1, 2, 3):
+                    rows.append({"feed_timestamp": start + hour * 3600 + 60, "route_id": route_id,
+                                 "route_short_name": route_id, "trip_id": f"{route_id}-{hour}-{trip}",
+                                 "direction_id": 0, "stop_id": f"{route_id}-{stop_sequence}",
+                                 "stop_sequence": stop_sequence, "delay_seconds": 30 * stop_sequence + trip})
+    return pa.Table.from_pylist(rows, schema=GOLD_SCHEMA)
+
+
+class StubS3:
+    """list_objects_v2 paging, get_object and put_object over a dict of objects."""
+
+    def __init__(self, objects):
+        self.objects = dict(objects)
+
+    def get_paginator(self, name):
+        objects = self.objects
+        return type("Paginator", (), {"paginate": lambda _, Bucket, Prefix: [
+            {"Contents": [{"Key": key} for key in sorted(objects) if key.startswith(Prefix)]}]})()
+
+    def get_object(self, Bucket, Key):
+        return {"Body": io.BytesIO(self.objects[Key])}
+
+    def put_object(self, Bucket, Key, Body, ContentType=None):
+        self.objects[Key] = Body
+
+
+def gold_objects(gold):
+    """Each partition written as two objects, as separate flattens would."""
+    objects = {}
+    for half, rows in enumerate((gold.slice(0, gold.num_rows // 2), gold.slice(gold.num_rows // 2))):
+        for path, part in split_partitions(rows, "feed_timestamp", 0, "route_id"):
+            body = io.BytesIO()
+            pq.write_table(part, body)
+            objects[f"performance/{path}/{half:06d}.parquet"] = body.getvalue()
+    return objects
+
+
+def test_gold_hours_are_read_whole_and_in_order():
+    gold = gold_rows()
+    hours = list(handler.read_gold_hours(StubS3(gold_objects(gold)), DAY, concurrency=4))
+    assert [table.num_rows for table in hours] == [18, 18, 18]
+    assert hours[0].column_names == propagation.COLUMNS
+    assert [table["feed_timestamp"][0].as_py() for table in hours] == sorted(gold["feed_timestamp"].unique().to_pylist())
+
+
+def test_written_stop_delays_match_the_whole_day():
+    gold = gold_rows()
+    s3 = StubS3(gold_objects(gold))
+    key = handler.write_propagation(s3, DAY, Metrics("test"))
+    assert key == propagation.day_key(DAY)
+    written = pq.read_table(io.BytesIO(s3.objects[key]))
+    assert written.equals(propagation.stop_delays_for_day([gold.select(propagation.COLUMNS)]))
+    assert handler.write_propagation(StubS3({}), DAY, Metrics("test")) is None
+
+
+def test_stop_delays_are_handed_to_their_own_lambda(monkeypatch):
+    invoked = []
+
+    class StubLambda:
+        def invoke(self, **kwargs):
+            invoked.append(kwargs)
+
+    monkeypatch.setattr(handler, "STOP_DELAYS_FUNCTION", "hsl-stop-delays")
+    monkeypatch.setattr(handler.boto3, "client", lambda service, **kwargs: StubLambda())
+    s3 = StubS3(gold_objects(gold_rows()))
+    handler.start_propagation(s3, DAY, Metrics("test"))
+    assert [(call["FunctionName"], call["InvocationType"], json.loads(call["Payload"])) for call in invoked] == [
+        ("hsl-stop-delays", "Event", {"day": "2026-02-13"})]
+    assert propagation.day_key(DAY) not in s3.objects